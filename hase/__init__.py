@@ -1,10 +1,11 @@
 import sys
 from typing import Any, List
 
-from .cli import parse_arguments
-
 
 def main(argv: List[str] = sys.argv) -> Any:
+    # hase.coredump_handler runs for every crash, keep this package light
+    from .cli import parse_arguments
+
     args = parse_arguments(argv)
     if args.debug:
         from ipdb import launch_ipdb_on_exception
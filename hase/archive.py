@@ -0,0 +1,319 @@
+import gzip
+import json
+import os
+import struct
+import tarfile
+from pathlib import Path
+from typing import IO, Any, Dict, List, Optional
+
+from .compression import CHUNK_SIZE, PAGE_SIZE, SparseWriter, zstd_module
+from .errors import HaseError
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+INDEXED_MAGIC = b"HASEIDX1"
+# json index length, magic
+INDEXED_FOOTER = struct.Struct("<Q8s")
+
+
+class GzipCompressor:
+    name = "gzip"
+    suffix = ".tar.gz"
+    default_level = 6
+
+    def __init__(self, level: Optional[int] = None) -> None:
+        self.level = self.default_level if level is None else level
+
+    def writer(self, f: IO[bytes]) -> Any:
+        return gzip.GzipFile(fileobj=f, mode="wb", compresslevel=self.level)
+
+
+class ZstdCompressor:
+    name = "zstd"
+    suffix = ".tar.zst"
+    default_level = 3
+
+    def __init__(self, level: Optional[int] = None) -> None:
+        self.level = self.default_level if level is None else level
+        zstd = zstd_module()
+        if zstd is None:
+            raise HaseError("zstd archives require the zstandard python module")
+        self.zstd = zstd
+
+    def writer(self, f: IO[bytes]) -> Any:
+        # compressor objects must not be shared between report workers,
+        # threads=-1 compresses with one thread per cpu
+        compressor = self.zstd.ZstdCompressor(level=self.level, threads=-1)
+        return compressor.stream_writer(f)
+
+
+class IndexedCompressor:
+    """
+    Report container with random access to its members: every member is a
+    separate zstd frame (or stored uncompressed and page aligned, if zstandard
+    is not available or level is 0), followed by a json index.
+    """
+
+    name = "indexed"
+    suffix = ".hase"
+    default_level = 3
+
+    def __init__(self, level: Optional[int] = None) -> None:
+        self.level = self.default_level if level is None else level
+        self.zstd = zstd_module() if self.level > 0 else None
+
+
+COMPRESSORS = {
+    "gzip": GzipCompressor,
+    "zstd": ZstdCompressor,
+    "indexed": IndexedCompressor,
+}  # type: Dict[str, Any]
+
+ARCHIVE_SUFFIXES = [c.suffix for c in COMPRESSORS.values()]
+
+
+def compressor(name: Optional[str] = None, level: Optional[int] = None) -> Any:
+    if name is None:
+        # without zstandard indexed archives would be stored uncompressed
+        name = "indexed" if zstd_module() is not None else "gzip"
+    return COMPRESSORS[name](level)
+
+
+def is_archive(path: Path) -> bool:
+    return any(path.name.endswith(suffix) for suffix in ARCHIVE_SUFFIXES)
+
+
+def write_archive(
+    archive_path: Path, root: Path, members: List[str], compressor: Any
+) -> None:
+    # the archive only appears under its final name once it is complete
+    tmp_path = archive_path.with_name("." + archive_path.name + ".tmp")
+    try:
+        if isinstance(compressor, IndexedCompressor):
+            _write_indexed(tmp_path, root, members, compressor)
+        else:
+            _write_tar(tmp_path, root, members, compressor)
+        os.rename(str(tmp_path), str(archive_path))
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+def _write_tar(path: Path, root: Path, members: List[str], compressor: Any) -> None:
+    with open(str(path), "wb") as f, compressor.writer(f) as stream:
+        with tarfile.open(fileobj=stream, mode="w|") as tar:
+            for member in members:
+                tar.add(str(root.joinpath(member)), arcname=member, recursive=False)
+
+
+def _write_indexed(
+    path: Path, root: Path, members: List[str], compressor: IndexedCompressor
+) -> None:
+    index = {}  # type: Dict[str, Dict[str, Any]]
+    with open(str(path), "wb") as f:
+        f.write(INDEXED_MAGIC)
+        for member in members:
+            source = str(root.joinpath(member))
+            size = os.path.getsize(source)
+            with open(source, "rb") as src:
+                if compressor.zstd is not None:
+                    offset = f.tell()
+                    cctx = compressor.zstd.ZstdCompressor(
+                        level=compressor.level, threads=-1
+                    )
+                    cctx.copy_stream(src, f, size=size)
+                    compression = "zstd"
+                else:
+                    # page aligned, so that zero pages stay holes when extracted
+                    offset = f.tell() + (-f.tell() % PAGE_SIZE)
+                    writer = SparseWriter(f, drop_cache=False, offset=offset)
+                    _copy_chunks(src, writer)
+                    f.seek(writer.offset)
+                    compression = "none"
+            index[member] = dict(
+                offset=offset,
+                length=f.tell() - offset,
+                size=size,
+                compression=compression,
+            )
+        data = json.dumps(index).encode("utf-8")
+        f.write(data)
+        f.write(INDEXED_FOOTER.pack(len(data), INDEXED_MAGIC))
+
+
+class _MemberReader:
+    """
+    File like object limited to one member of an indexed archive
+    """
+
+    def __init__(self, f: IO[bytes], offset: int, length: int) -> None:
+        self.f = f
+        self.offset = offset
+        self.remaining = length
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        self.f.seek(self.offset)
+        data = self.f.read(size)
+        self.offset += len(data)
+        self.remaining -= len(data)
+        return data
+
+
+class IndexedArchive:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.f = open(path, "rb")
+        self.f.seek(-INDEXED_FOOTER.size, os.SEEK_END)
+        footer_offset = self.f.tell()
+        length, magic = INDEXED_FOOTER.unpack(self.f.read(INDEXED_FOOTER.size))
+        if magic != INDEXED_MAGIC:
+            raise HaseError("%s: index not found, truncated archive?" % path)
+        self.f.seek(footer_offset - length)
+        self.index = json.loads(self.f.read(length).decode("utf-8"))
+
+    def __enter__(self) -> "IndexedArchive":
+        return self
+
+    def __exit__(self, type: Any, value: Any, traceback: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.f.close()
+
+    def members(self) -> List[str]:
+        return list(self.index.keys())
+
+    def _entry(self, name: str) -> Dict[str, Any]:
+        entry = self.index.get(name)
+        if entry is None:
+            raise HaseError("%s not found in %s" % (name, self.path))
+        return entry
+
+    def open(self, name: str) -> Any:
+        entry = self._entry(name)
+        reader = _MemberReader(self.f, entry["offset"], entry["length"])
+        if entry["compression"] == "none":
+            return reader
+        zstd = zstd_module()
+        if zstd is None:
+            raise HaseError(
+                "%s is zstd compressed, install the zstandard python module"
+                % self.path
+            )
+        return zstd.ZstdDecompressor().stream_reader(reader)
+
+    def read(self, name: str) -> bytes:
+        src = self.open(name)
+        chunks = []  # type: List[bytes]
+        while True:
+            chunk = src.read(CHUNK_SIZE)
+            if not chunk:
+                return b"".join(chunks)
+            chunks.append(chunk)
+
+    def extract(self, name: str, root: Path) -> Path:
+        """
+        Materialize a single member below `root`, unless it already exists
+        """
+        if os.path.isabs(name) or ".." in Path(name).parts:
+            raise HaseError("invalid member %s in %s" % (name, self.path))
+        target = root.joinpath(name)
+        if target.exists():
+            return target
+        target.parent.mkdir(parents=True, exist_ok=True)
+        src = self.open(name)
+        with open(str(target), "wb") as dst:
+            _copy_sparse(src, dst)
+        return target
+
+
+def _copy_chunks(src: Any, writer: SparseWriter) -> None:
+    while True:
+        chunk = src.read(CHUNK_SIZE)
+        if not chunk:
+            return
+        writer.write(chunk)
+
+
+def _copy_sparse(src: Any, dst: IO[bytes]) -> None:
+    writer = SparseWriter(dst, drop_cache=False)
+    _copy_chunks(src, writer)
+    writer.close()
+
+
+def detect_format(path: str) -> str:
+    with open(path, "rb") as f:
+        magic = f.read(len(INDEXED_MAGIC))
+    if magic == INDEXED_MAGIC:
+        return "indexed"
+    if magic.startswith(GZIP_MAGIC):
+        return "gzip"
+    if magic.startswith(ZSTD_MAGIC):
+        return "zstd"
+    return "tar"
+
+
+def _open_stream(path: str, f: IO[bytes]) -> Any:
+    archive_format = detect_format(path)
+    if archive_format == "gzip":
+        return gzip.GzipFile(fileobj=f, mode="rb")
+    if archive_format == "zstd":
+        zstd = zstd_module()
+        if zstd is None:
+            raise HaseError(
+                "%s is zstd compressed, install the zstandard python module" % path
+            )
+        return zstd.ZstdDecompressor().stream_reader(f)
+    return f
+
+
+def read_member(path: str, name: str) -> bytes:
+    """
+    Read a single member without extracting the archive. Tar archives are
+    only read up to the member.
+    """
+    if detect_format(path) == "indexed":
+        with IndexedArchive(path) as indexed:
+            return indexed.read(name)
+
+    with open(path, "rb") as f:
+        stream = _open_stream(path, f)
+        with tarfile.open(fileobj=stream, mode="r|") as tar:
+            for member in tar:
+                if member.name == name and member.isfile():
+                    src = tar.extractfile(member)
+                    assert src is not None
+                    return src.read()
+    raise HaseError("%s not found in %s" % (name, path))
+
+
+def extract_archive(path: str, root: Path) -> None:
+    """
+    Extract a report archive in any supported format into `root`.
+    Runs of zeros (i.e. dropped pages of minimized cores) become holes.
+    """
+    if detect_format(path) == "indexed":
+        with IndexedArchive(path) as indexed:
+            for member in indexed.members():
+                indexed.extract(member, root)
+        return
+
+    with open(path, "rb") as f:
+        stream = _open_stream(path, f)
+        with tarfile.open(fileobj=stream, mode="r|") as tar:
+            for info in tar:
+                target = root.joinpath(info.name)
+                if os.path.isabs(info.name) or ".." in Path(info.name).parts:
+                    raise HaseError("invalid member %s in %s" % (info.name, path))
+                if info.isdir():
+                    target.mkdir(parents=True, exist_ok=True)
+                    continue
+                if not info.isfile():
+                    continue
+                target.parent.mkdir(parents=True, exist_ok=True)
+                src = tar.extractfile(info)
+                assert src is not None
+                with open(str(target), "wb") as dst:
+                    _copy_sparse(src, dst)
@@ -0,0 +1,120 @@
+import hashlib
+import os
+import shutil
+import struct
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from threading import Lock
+from typing import Dict, Iterator, Optional, Tuple
+
+from .errors import HaseError
+
+# directory next to the report archives
+STORE_NAME = "blobs"
+
+PT_NOTE = 4
+NT_GNU_BUILD_ID = 3
+
+
+def _notes(data: bytes) -> Iterator[Tuple[bytes, int, bytes]]:
+    offset = 0
+    while offset + 12 <= len(data):
+        namesz, descsz, note_type = struct.unpack_from("<III", data, offset)
+        offset += 12
+        name = data[offset : offset + namesz]
+        offset += (namesz + 3) & ~3
+        desc = data[offset : offset + descsz]
+        offset += (descsz + 3) & ~3
+        yield name, note_type, desc
+
+
+def build_id(path: str) -> Optional[str]:
+    with open(path, "rb") as f:
+        header = f.read(64)
+        if len(header) < 64 or header[:4] != b"\x7fELF" or header[4] != 2:
+            return None
+        (phoff,) = struct.unpack_from("<Q", header, 0x20)
+        phentsize, phnum = struct.unpack_from("<HH", header, 0x36)
+        for i in range(phnum):
+            f.seek(phoff + i * phentsize)
+            p_type, _, p_offset, _, _, p_filesz = struct.unpack("<IIQQQQ", f.read(40))
+            if p_type != PT_NOTE:
+                continue
+            f.seek(p_offset)
+            for name, note_type, desc in _notes(f.read(p_filesz)):
+                if note_type == NT_GNU_BUILD_ID and name == b"GNU\0":
+                    return desc.hex()
+    return None
+
+
+def sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(1024 * 1024)
+            if not chunk:
+                return digest.hexdigest()
+            digest.update(chunk)
+
+
+class BinaryStore:
+    """
+    Content addressed store for the binaries referenced by reports.
+    Blobs are keyed by their sha256, prefixed with the build-id if they have
+    one: stripped and unstripped builds share the build-id, but not the
+    content.
+    """
+
+    def __init__(self, root: Path) -> None:
+        self.root = root
+        # stat() -> key, so files are only hashed once per recorder
+        self._keys = {}  # type: Dict[Tuple[int, int, int, int], str]
+        self._lock = Lock()
+
+    @classmethod
+    def for_report(cls, report: str) -> "BinaryStore":
+        return cls(Path(report).resolve().parent.joinpath(STORE_NAME))
+
+    def key(self, path: str) -> str:
+        st = os.stat(path)
+        cache_key = (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+        with self._lock:
+            key = self._keys.get(cache_key)
+        if key is None:
+            bid = build_id(path)
+            key = "sha256-" + sha256(path)
+            if bid is not None:
+                key = "buildid-%s-%s" % (bid, key)
+            with self._lock:
+                self._keys[cache_key] = key
+        return key
+
+    def blob(self, key: str) -> Path:
+        return self.root.joinpath(key)
+
+    def add(self, path: str) -> str:
+        key = self.key(path)
+        blob = self.blob(key)
+        if blob.exists():
+            return key
+        self.root.mkdir(parents=True, exist_ok=True)
+        # other report workers might add the same file concurrently
+        with NamedTemporaryFile(dir=str(self.root), delete=False) as tmp:
+            with open(path, "rb") as src:
+                shutil.copyfileobj(src, tmp)
+        os.chmod(tmp.name, 0o444)
+        os.rename(tmp.name, str(blob))
+        return key
+
+    def materialize(self, key: str, target: Path) -> None:
+        blob = self.blob(key)
+        if not blob.exists():
+            raise HaseError(
+                "binary %s not found in %s, use --binary-store" % (key, self.root)
+            )
+        target.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.link(str(blob), str(target))
+        except OSError:
+            # e.g. the report is unpacked on another file system
+            os.symlink(str(blob), str(target))
@@ -1,6 +1,8 @@
 import argparse
 from typing import List, Any
 
+from .archive import COMPRESSORS
+from .perf.pt_config import PROFILES
 from .record import DEFAULT_LOG_DIR, record_command
 
 
@@ -35,6 +37,91 @@ def parse_arguments(argv: List[str]) -> argparse.Namespace:
         help="Maximum crashes to record (0 for unlimited crashes)",
     )
 
+    record.add_argument(
+        "--max-pending-reports",
+        default=16,
+        type=int,
+        help="Crashes collected but not yet archived, further crashes are dropped",
+    )
+
+    record.add_argument(
+        "--core-context",
+        type=int,
+        metavar="PAGES",
+        help="Minimize coredumps: keep stacks, mapped files and PAGES pages around addresses found in registers and on the stack",
+    )
+
+    record.add_argument(
+        "--archive-format",
+        choices=sorted(COMPRESSORS.keys()),
+        help="Compression of report archives (default: indexed if zstandard is available, else gzip)",
+    )
+
+    record.add_argument(
+        "--archive-level",
+        type=int,
+        help="Compression level of report archives",
+    )
+
+    record.add_argument(
+        "--pt-profile",
+        default="default",
+        choices=sorted(PROFILES.keys()),
+        help="Intel PT configuration profile, trades trace bandwidth against timing precision and decodability",
+    )
+
+    record.add_argument(
+        "--ip-filter",
+        action="append",
+        metavar="BINARY",
+        help="Only trace code of this binary, can be repeated. 'main' selects the recorded executable",
+    )
+
+    record.add_argument(
+        "--flight-recorder",
+        action="store_true",
+        help="Keep recording and store snapshots on SIGUSR1, on request via --control-socket or periodically",
+    )
+
+    record.add_argument(
+        "--snapshot-interval",
+        type=float,
+        help="Take a flight recorder snapshot every N seconds",
+    )
+
+    record.add_argument(
+        "--control-socket",
+        help="Unix socket accepting 'snapshot' commands in flight recorder mode or 'add PID', 'remove PID' and 'list' when supervising processes",
+    )
+
+    record.add_argument(
+        "--pid",
+        dest="pids",
+        type=int,
+        action="append",
+        default=[],
+        help="Supervise a running process, can be repeated. All supervised processes share one set of per-cpu trace buffers",
+    )
+
+    record.add_argument(
+        "--cgroup",
+        help="Supervise all processes of this cgroup (v2) instead of a new cgroup",
+    )
+
+    record.add_argument(
+        "--min-snapshot-interval",
+        default=10.0,
+        type=float,
+        help="Minimum seconds between two flight recorder snapshots",
+    )
+
+    record.add_argument(
+        "--max-snapshots",
+        default=10,
+        type=int,
+        help="Maximum number of flight recorder snapshots kept in --log-dir",
+    )
+
     record.add_argument(
         "--rusage-file",
         help="the file to output resource usage result (for benchmarking)",
@@ -50,6 +137,80 @@ def parse_arguments(argv: List[str]) -> argparse.Namespace:
     unpack = subparsers.add_parser("unpack")
     unpack.add_argument("report")
 
+    replay.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Unpack into a temporary directory instead of the report cache (HASE_CACHE_DIR)",
+    )
+
+    replay.add_argument(
+        "--binary-store",
+        help="Directory with the binaries of the report (default: blobs/ next to the report)",
+    )
+
+    replay.add_argument(
+        "--single-step",
+        action="store_true",
+        help="Execute one instruction at a time, also in straight-line code",
+    )
+
+    replay.add_argument(
+        "--unicorn",
+        action="store_true",
+        help="Execute concrete parts of the trace natively with unicorn",
+    )
+
+    replay.add_argument(
+        "--window",
+        type=int,
+        help="Only replay about the last N instructions before the crash, "
+        "memory and registers are taken from the coredump",
+    )
+
+    replay.add_argument(
+        "--sat-interval",
+        type=int,
+        default=1,
+        help="Check satisfiability every N instructions instead of after each one, "
+        "0 only checks at conditional jumps",
+    )
+
+    replay.add_argument(
+        "--solver-cache",
+        help="Store solver results in this file and reuse them in later replays "
+        "(default: HASE_SOLVER_CACHE)",
+    )
+
+    replay.add_argument(
+        "--memory-budget",
+        type=int,
+        help="Memory in MiB for states computed while navigating the trace, "
+        "least recently used ones are dropped",
+    )
+
+    replay.add_argument(
+        "--checkpoints",
+        type=int,
+        default=200,
+        help="Number of states recorded during replay, states in between are "
+        "computed again when they are accessed",
+    )
+
+    replay.add_argument(
+        "--crash-density",
+        type=float,
+        default=8.0,
+        help="Record states that many times more densely right before the crash "
+        "than at the start of the trace, 1 spaces them evenly",
+    )
+
+    replay.add_argument(
+        "--max-latency",
+        type=float,
+        help="Keep additional states while navigating the trace, so that "
+        "computing a state takes about this many seconds at most",
+    )
+
     def lazy_import_replay_command(args: argparse.Namespace) -> Any:
         from .replay import replay_command
 
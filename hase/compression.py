@@ -0,0 +1,139 @@
+import fcntl
+import os
+from typing import IO, Any, Iterator, Optional
+
+from .errors import HaseError
+
+ZSTD_SUFFIX = ".zst"
+
+PAGE_SIZE = 4096
+CHUNK_SIZE = 1024 * 1024
+ZERO_PAGE = bytes(PAGE_SIZE)
+
+# see fcntl(2), not exported by the fcntl module before python 3.10
+F_SETPIPE_SZ = 1031
+
+
+def zstd_module() -> Optional[Any]:
+    try:
+        import zstandard
+
+        return zstandard
+    except ImportError:
+        return None
+
+
+def grow_pipe(fd: int, size: int = CHUNK_SIZE) -> None:
+    # fewer context switches, if the pipe allows it
+    try:
+        fcntl.fcntl(fd, F_SETPIPE_SZ, size)
+    except OSError:
+        pass
+
+
+def read_chunks(fd: int, size: int = CHUNK_SIZE) -> Iterator[memoryview]:
+    """
+    Yield page aligned chunks of `size` bytes (except for the last one)
+    """
+    buf = bytearray(size)
+    view = memoryview(buf)
+    while True:
+        filled = 0
+        while filled < size:
+            n = os.readv(fd, [view[filled:]])
+            if n == 0:
+                break
+            filled += n
+        if filled == 0:
+            return
+        yield view[:filled]
+        if filled < size:
+            return
+
+
+def drop_cache(f: IO[bytes], start: int, end: int) -> None:
+    # the core is not read again soon, keep the page cache for others
+    f.flush()
+    try:
+        os.posix_fadvise(f.fileno(), start, end - start, os.POSIX_FADV_DONTNEED)
+    except OSError:
+        pass
+
+
+class SparseWriter:
+    """
+    Writes to `f` but seeks over pages only containing zeros
+    """
+
+    def __init__(self, f: IO[bytes], drop_cache: bool = True, offset: int = 0) -> None:
+        self.f = f
+        self.offset = offset
+        self.drop_cache = drop_cache
+
+    def write(self, data: Any) -> None:
+        start = self.offset
+        for page in range(0, len(data), PAGE_SIZE):
+            block = data[page : page + PAGE_SIZE]
+            if block != ZERO_PAGE[: len(block)]:
+                self.f.seek(self.offset)
+                self.f.write(block)
+            self.offset += len(block)
+        if self.drop_cache:
+            drop_cache(self.f, start, self.offset)
+
+    def close(self) -> None:
+        # a trailing hole is not allocated by seek alone
+        self.f.truncate(self.offset)
+
+
+def copy_core(fd: int, path: str, level: int) -> str:
+    """
+    Stream the core from `fd` to `path`, zstd compressed when the
+    zstandard module is available and `level` > 0.
+    Returns the path of the written file.
+    """
+    grow_pipe(fd)
+    zstd = zstd_module() if level > 0 else None
+    if zstd is None:
+        with open(path, "wb") as f:
+            writer = SparseWriter(f)
+            for chunk in read_chunks(fd):
+                writer.write(chunk)
+            writer.close()
+        return path
+
+    path += ZSTD_SUFFIX
+    compressor = zstd.ZstdCompressor(level=level, threads=-1)
+    with open(path, "wb") as f, compressor.stream_writer(f) as stream:
+        start = 0
+        for chunk in read_chunks(fd):
+            stream.write(chunk)
+            end = f.tell()
+            drop_cache(f, start, end)
+            start = end
+    return path
+
+
+def decompress_core(path: str) -> str:
+    """
+    Returns the path of an uncompressed (sparse) copy of the core at `path`
+    """
+    if not path.endswith(ZSTD_SUFFIX):
+        return path
+    zstd = zstd_module()
+    if zstd is None:
+        raise HaseError(
+            "%s is zstd compressed, install the zstandard python module" % path
+        )
+    target = path[: -len(ZSTD_SUFFIX)]
+    with open(path, "rb") as src, open(target, "wb") as dst:
+        reader = zstd.ZstdDecompressor().stream_reader(src)
+        # replay reads the core right away
+        writer = SparseWriter(dst, drop_cache=False)
+        while True:
+            chunk = reader.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            writer.write(chunk)
+        writer.close()
+    return target
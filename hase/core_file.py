@@ -0,0 +1,477 @@
+import mmap
+import struct
+from bisect import bisect_right
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+from .errors import HaseError
+
+# Reader for ELF core files with the subset of the pwnlib Coredump API used by
+# hase. Only depends on the standard library, so the recorder and
+# coredump_handler can use it without loading pwnlib.
+
+PT_LOAD = 1
+PT_NOTE = 4
+
+NT_PRSTATUS = 1
+NT_AUXV = 6
+NT_SIGINFO = 0x53494749
+NT_FILE = 0x46494C45
+
+AT_EXECFN = 31
+AT_SYSINFO_EHDR = 33
+
+PF_X = 1
+PF_W = 2
+PF_R = 4
+
+PAGE_SIZE = 4096
+
+VSYSCALL_START = 0xFFFFFFFFFF600000
+
+ELF_HEADER = struct.Struct("<16sHHIQQQIHHHHHH")
+PROGRAM_HEADER = struct.Struct("<IIQQQQQQ")
+NOTE_HEADER = struct.Struct("<III")
+U64 = struct.Struct("<Q")
+
+# struct elf_prstatus on x86_64
+PRSTATUS_CURSIG_OFFSET = 12
+PRSTATUS_PID_OFFSET = 32
+PRSTATUS_REGS_OFFSET = 112
+# order of struct user_regs_struct
+REGISTER_NAMES = [
+    "r15",
+    "r14",
+    "r13",
+    "r12",
+    "rbp",
+    "rbx",
+    "r11",
+    "r10",
+    "r9",
+    "r8",
+    "rax",
+    "rcx",
+    "rdx",
+    "rsi",
+    "rdi",
+    "orig_rax",
+    "rip",
+    "cs",
+    "eflags",
+    "rsp",
+    "ss",
+    "fs_base",
+    "gs_base",
+    "ds",
+    "es",
+    "fs",
+    "gs",
+]
+REGISTERS = struct.Struct("<%dQ" % len(REGISTER_NAMES))
+# si_addr in siginfo_t
+SIGINFO_ADDR_OFFSET = 16
+
+
+def program_headers(core: mmap.mmap) -> Iterator[Tuple[int, ...]]:
+    header = ELF_HEADER.unpack_from(core, 0)
+    ident, phoff, phentsize, phnum = header[0], header[5], header[9], header[10]
+    if ident[:4] != b"\x7fELF" or ident[4] != 2:
+        raise HaseError("not a 64-bit elf core")
+    for i in range(phnum):
+        yield PROGRAM_HEADER.unpack_from(core, phoff + i * phentsize)
+
+
+def notes(core: mmap.mmap, offset: int, end: int) -> Iterator[Tuple[int, int, int]]:
+    """
+    Yields type, offset and size of the descriptor of every note
+    """
+    while offset + NOTE_HEADER.size <= end:
+        namesz, descsz, note_type = NOTE_HEADER.unpack_from(core, offset)
+        offset += NOTE_HEADER.size
+        offset += (namesz + 3) & ~3
+        yield note_type, offset, descsz
+        offset += (descsz + 3) & ~3
+
+
+def parse_nt_file(
+    core: mmap.mmap, desc: int, size: int
+) -> List[Tuple[int, int, int, str]]:
+    """
+    Returns start, stop, file offset and path of every file mapping
+    """
+    count, page_size = struct.unpack_from("<QQ", core, desc)
+    ranges = struct.unpack_from("<%dQ" % (count * 3), core, desc + 16)
+    names = core[desc + 16 + count * 24 : desc + size].split(b"\0")
+    mappings = []  # type: List[Tuple[int, int, int, str]]
+    for i in range(count):
+        start, stop, page_offset = ranges[i * 3 : i * 3 + 3]
+        path = names[i].decode("utf-8", "surrogateescape")
+        mappings.append((start, stop, page_offset * page_size, path))
+    return mappings
+
+
+class Segment:
+    """
+    PT_LOAD segment, memory beyond `filesz` was not dumped and reads as zeros
+    """
+
+    def __init__(
+        self, vaddr: int, memsz: int, offset: int, filesz: int, flags: int = 0
+    ) -> None:
+        self.vaddr = vaddr
+        self.end = vaddr + memsz
+        self.offset = offset
+        self.filesz = filesz
+        self.flags = flags
+
+    @property
+    def pages(self) -> int:
+        return (self.filesz + PAGE_SIZE - 1) // PAGE_SIZE
+
+
+class Mapping:
+    """
+    Same interface as pwnlib.elf.corefile.Mapping
+    """
+
+    def __init__(
+        self,
+        core: "Coredump",
+        name: str,
+        start: int,
+        stop: int,
+        flags: int,
+        page_offset: int = 0,
+    ) -> None:
+        self._core = core
+        self.name = name
+        self.start = start
+        self.stop = stop
+        self.size = stop - start
+        self.flags = flags
+        self.page_offset = page_offset
+
+    @property
+    def path(self) -> str:
+        return self.name
+
+    @property
+    def address(self) -> int:
+        return self.start
+
+    @property
+    def data(self) -> bytes:
+        return self._core.read(self.start, self.size)
+
+    def __contains__(self, address: int) -> bool:
+        return self.start <= address < self.stop
+
+    def __getitem__(self, item: Union[int, slice]) -> bytes:
+        if isinstance(item, slice):
+            start = self.start if item.start is None else item.start
+            stop = self.stop if item.stop is None else item.stop
+            if not (self.start <= start <= stop <= self.stop):
+                raise IndexError("0x%x-0x%x not in %s" % (start, stop, self))
+            return self._core.read(start, stop - start)[:: item.step or 1]
+        if item not in self:
+            raise IndexError("0x%x not in %s" % (item, self))
+        return self._core.read(item, 1)
+
+    def __repr__(self) -> str:
+        return "Mapping(%r, start=0x%x, stop=0x%x, size=0x%x, flags=0x%x)" % (
+            self.name,
+            self.start,
+            self.stop,
+            self.size,
+            self.flags,
+        )
+
+
+class Coredump:
+    """
+    The core is mapped into memory instead of being read. Segment headers are
+    parsed when the core is opened, notes, mappings and the stack layout on
+    first access.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.file = open(path, "rb")
+        try:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self.file.close()
+            raise
+        self.segments = []  # type: List[Segment]
+        self._note_ranges = []  # type: List[Tuple[int, int]]
+        for phdr in program_headers(self.data):
+            p_type, p_flags, p_offset, p_vaddr = phdr[:4]
+            p_filesz, p_memsz = phdr[5], phdr[6]
+            if p_type == PT_LOAD:
+                segment = Segment(p_vaddr, p_memsz, p_offset, p_filesz, p_flags)
+                self.segments.append(segment)
+            elif p_type == PT_NOTE:
+                self._note_ranges.append((p_offset, p_offset + p_filesz))
+        self.segments.sort(key=lambda s: s.vaddr)
+        self._starts = [s.vaddr for s in self.segments]
+
+        self._notes = None  # type: Optional[Dict[int, List[Tuple[int, int]]]]
+        self._mappings = None  # type: Optional[List[Mapping]]
+        self._stack_layout = None  # type: Optional[Tuple[Any, ...]]
+
+    def __enter__(self) -> "Coredump":
+        return self
+
+    def __exit__(self, type: Any, value: Any, traceback: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.data.close()
+        self.file.close()
+
+    def notes(self, note_type: int) -> List[Tuple[int, int]]:
+        """
+        Offset and size of all notes of `note_type`, in file order
+        """
+        if self._notes is None:
+            self._notes = {}
+            for offset, end in self._note_ranges:
+                for t, desc, size in notes(self.data, offset, end):
+                    self._notes.setdefault(t, []).append((desc, size))
+        return self._notes.get(note_type, [])
+
+    def files(self) -> List[Tuple[int, int, int, str]]:
+        """
+        Start, stop, file offset and path of all file backed mappings
+        """
+        files = []  # type: List[Tuple[int, int, int, str]]
+        for desc, size in self.notes(NT_FILE):
+            files.extend(parse_nt_file(self.data, desc, size))
+        return files
+
+    def _prstatus(self) -> int:
+        prstatus = self.notes(NT_PRSTATUS)
+        if len(prstatus) == 0:
+            raise HaseError("%s has no NT_PRSTATUS note" % self.path)
+        # the thread that received the signal comes first
+        return prstatus[0][0]
+
+    @property
+    def registers(self) -> Dict[str, int]:
+        values = REGISTERS.unpack_from(
+            self.data, self._prstatus() + PRSTATUS_REGS_OFFSET
+        )
+        return dict(zip(REGISTER_NAMES, values))
+
+    def thread_registers(self) -> List[Dict[str, int]]:
+        return [
+            dict(
+                zip(
+                    REGISTER_NAMES,
+                    REGISTERS.unpack_from(self.data, desc + PRSTATUS_REGS_OFFSET),
+                )
+            )
+            for desc, _ in self.notes(NT_PRSTATUS)
+        ]
+
+    @property
+    def pid(self) -> int:
+        offset = self._prstatus() + PRSTATUS_PID_OFFSET
+        return struct.unpack_from("<i", self.data, offset)[0]
+
+    @property
+    def signal(self) -> int:
+        offset = self._prstatus() + PRSTATUS_CURSIG_OFFSET
+        return struct.unpack_from("<h", self.data, offset)[0]
+
+    @property
+    def fault_addr(self) -> Optional[int]:
+        siginfo = self.notes(NT_SIGINFO)
+        if len(siginfo) == 0:
+            return None
+        return U64.unpack_from(self.data, siginfo[0][0] + SIGINFO_ADDR_OFFSET)[0]
+
+    @property
+    def auxv(self) -> Dict[int, int]:
+        auxv = {}  # type: Dict[int, int]
+        for desc, size in self.notes(NT_AUXV):
+            values = struct.unpack_from("<%dQ" % (size // 8), self.data, desc)
+            for key, value in zip(values[::2], values[1::2]):
+                auxv[key] = value
+        return auxv
+
+    @property
+    def mappings(self) -> List[Mapping]:
+        if self._mappings is not None:
+            return self._mappings
+        files = dict((f[0], f) for f in self.files())
+        auxv = self.auxv
+        special = {VSYSCALL_START: "[vsyscall]"}
+        if AT_SYSINFO_EHDR in auxv:
+            special[auxv[AT_SYSINFO_EHDR]] = "[vdso]"
+        stack = self.find_segment(auxv.get(AT_EXECFN, self.registers["rsp"]))
+        if stack is not None:
+            special[stack.vaddr] = "[stack]"
+
+        self._mappings = []
+        for s in self.segments:
+            name, page_offset = special.get(s.vaddr, ""), 0
+            if s.vaddr in files:
+                _, _, offset, name = files[s.vaddr]
+                page_offset = offset // PAGE_SIZE
+            mapping = Mapping(self, name, s.vaddr, s.end, s.flags, page_offset)
+            self._mappings.append(mapping)
+        return self._mappings
+
+    def _named(self, name: str) -> Optional[Mapping]:
+        for mapping in self.mappings:
+            if mapping.name == name:
+                return mapping
+        return None
+
+    @property
+    def vdso(self) -> Optional[Mapping]:
+        return self._named("[vdso]")
+
+    @property
+    def vsyscall(self) -> Optional[Mapping]:
+        return self._named("[vsyscall]")
+
+    @property
+    def stack(self) -> Optional[Mapping]:
+        return self._named("[stack]")
+
+    @property
+    def exe(self) -> Optional[Mapping]:
+        for mapping in self.mappings:
+            if mapping.name.startswith("/"):
+                return mapping
+        return None
+
+    def segment_index(self, address: int) -> int:
+        """
+        Index of the segment containing `address` or -1
+        """
+        idx = bisect_right(self._starts, address) - 1
+        if idx >= 0 and address < self.segments[idx].end:
+            return idx
+        return -1
+
+    def find_segment(self, address: int) -> Optional[Segment]:
+        idx = self.segment_index(address)
+        return None if idx == -1 else self.segments[idx]
+
+    def find_mapping(self, address: int) -> Optional[Mapping]:
+        idx = self.segment_index(address)
+        return None if idx == -1 else self.mappings[idx]
+
+    def view(self, address: int, size: int) -> memoryview:
+        """
+        Zero-copy view of memory dumped into the core, views have to be
+        released before the core is closed
+        """
+        segment = self.find_segment(address)
+        if segment is None or address + size > segment.vaddr + segment.filesz:
+            raise HaseError("0x%x-0x%x is not in the core" % (address, address + size))
+        offset = segment.offset + address - segment.vaddr
+        return memoryview(self.data)[offset : offset + size]
+
+    def read(self, address: int, size: int) -> bytes:
+        chunks = []
+        while size > 0:
+            segment = self.find_segment(address)
+            if segment is None:
+                raise HaseError("0x%x is not mapped in the core" % address)
+            length = min(size, segment.end - address)
+            dumped = max(min(segment.vaddr + segment.filesz - address, length), 0)
+            offset = segment.offset + address - segment.vaddr
+            chunks.append(self.data[offset : offset + dumped])
+            # pages that are not part of the dump read as zeros
+            chunks.append(b"\0" * (length - dumped))
+            address += length
+            size -= length
+        return b"".join(chunks)
+
+    def dumped_ranges(self, address: int, size: int) -> List[Tuple[int, int]]:
+        """
+        Parts ([start, stop)) of [address, address + size) whose content is
+        in the core
+        """
+        ranges = []
+        stop = address + size
+        idx = max(bisect_right(self._starts, address) - 1, 0)
+        for segment in self.segments[idx:]:
+            if segment.vaddr >= stop:
+                break
+            start = max(address, segment.vaddr)
+            end = min(stop, segment.vaddr + segment.filesz)
+            if start < end:
+                ranges.append((start, end))
+        return ranges
+
+    def u64(self, address: int) -> int:
+        return U64.unpack(self.read(address, 8))[0]
+
+    def string(self, address: int) -> bytes:
+        segment = self.find_segment(address)
+        if segment is None:
+            raise HaseError("0x%x is not mapped in the core" % address)
+        data = self.read(address, segment.end - address)
+        end = data.find(b"\0")
+        return data if end == -1 else data[:end]
+
+    def _parse_stack(self) -> Tuple[Any, ...]:
+        """
+        Finds argc, argv and envp, which are placed below auxv at the top of
+        the main stack
+        """
+        if self._stack_layout is not None:
+            return self._stack_layout
+        self._stack_layout = (None, [], {})
+        stack = self.stack
+        auxv = self.notes(NT_AUXV)
+        if stack is None or len(auxv) == 0:
+            return self._stack_layout
+        desc, size = auxv[0]
+        data = stack.data
+        idx = data.rfind(self.data[desc : desc + size])
+        if idx == -1 or idx % 8 != 0:
+            return self._stack_layout
+
+        # envp, NULL, auxv
+        address = stack.start + idx - 16
+        envp = []  # type: List[int]
+        while address >= stack.start and self.u64(address) != 0:
+            envp.insert(0, self.u64(address))
+            address -= 8
+        # argc, argv, NULL, envp
+        address -= 8
+        argv = []  # type: List[int]
+        while address >= stack.start and self.u64(address) != len(argv):
+            argv.insert(0, self.u64(address))
+            address -= 8
+        if address < stack.start:
+            return self._stack_layout
+
+        env = {}  # type: Dict[str, int]
+        for pointer in envp:
+            name = self.string(pointer).split(b"=", 1)[0]
+            env[name.decode("utf-8", "surrogateescape")] = pointer + len(name) + 1
+        self._stack_layout = (address, argv, env)
+        return self._stack_layout
+
+    @property
+    def argc_address(self) -> Optional[int]:
+        return self._parse_stack()[0]
+
+    @property
+    def argc(self) -> int:
+        return len(self._parse_stack()[1])
+
+    @property
+    def argv(self) -> List[int]:
+        return self._parse_stack()[1]
+
+    @property
+    def env(self) -> Dict[str, int]:
+        return self._parse_stack()[2]
@@ -0,0 +1,171 @@
+import errno
+import json
+import os
+import sys
+from collections import OrderedDict, defaultdict
+from datetime import datetime
+from typing import IO, Any, DefaultDict, List, Optional
+
+from .compression import copy_core
+
+CORE_NAME = "core"
+# zstd level used for the core, 0 stores it uncompressed (but sparse)
+CORE_COMPRESSION_LEVEL = 3
+MANIFEST_NAME = "manifest.json"
+# crash directories are written under this prefix and renamed once complete
+INCOMING_PREFIX = ".incoming-"
+# fifo next to the spool directory, the recorder is woken up with the name
+# of every completed crash
+NOTIFY_SUFFIX = ".notify"
+
+EXTRA_CORE_DUMP_PARAMETER = OrderedDict(
+    [
+        ("executable", "%E"),  # path of executable
+        ("uid", "%u"),  # user id
+        ("gid", "%g"),  # group id
+        ("containerized_tid", "%i"),  # thread id in process's PID namespace
+        ("global_tid", "%I"),  # thread id in global PID namespace
+        ("containerized_pid", "%p"),  # process id in process's PID namespace
+        ("global_pid", "%P"),  # process id in global PID namespace
+        ("signal", "%s"),  # signal causing dump
+        ("time", "%t"),  # time of core dump
+    ]
+)
+
+
+def mapped_binaries(pid: str) -> Optional[List[str]]:
+    """
+    Files mapped executable into the crashed process. /proc/<pid> is available
+    until we have read the complete core, so store_report does not need to
+    parse the (compressed) core to find them.
+    """
+    binaries = set()
+    try:
+        with open("/proc/%s/maps" % pid) as f:
+            for line in f:
+                fields = line.rstrip("\n").split(None, 5)
+                if len(fields) == 6 and fields[1][2] == "x":
+                    if fields[5].startswith("/"):
+                        binaries.add(fields[5])
+    except OSError:
+        return None
+    return sorted(binaries)
+
+
+def cgroup(pid: str) -> Optional[str]:
+    """
+    cgroup v2 of the crashed process, relative to the cgroup mount
+    """
+    try:
+        with open("/proc/%s/cgroup" % pid) as f:
+            for line in f:
+                if line.startswith("0::"):
+                    return line[3:].rstrip("\n")
+    except OSError:
+        pass
+    return None
+
+
+def process_coredump(
+    os_args: List[str], core_path: str, manifest_file: IO[Any]
+) -> None:
+    metadata = defaultdict(dict)  # type: DefaultDict[str, Any]
+    coredump = metadata["coredump"]
+
+    for name, arg in zip(EXTRA_CORE_DUMP_PARAMETER.keys(), os_args):
+        if name == "executable":
+            # strip trailing slash and unescape
+            coredump[name] = arg[1:].replace("!", "/")
+        elif name == "time":
+            # copied from timestamp to avoid imports
+            FORMAT = "%Y%m%dT%H%M%S"
+            time = datetime.utcfromtimestamp(int(arg))
+            coredump[name] = time.strftime(FORMAT)
+        else:
+            coredump[name] = int(arg)
+
+    binaries = mapped_binaries(str(coredump["global_pid"]))
+    if binaries is not None:
+        coredump["mapped_binaries"] = binaries
+    cgroup_path = cgroup(str(coredump["global_pid"]))
+    if cgroup_path is not None:
+        coredump["cgroup"] = cgroup_path
+
+    core_file = copy_core(sys.stdin.fileno(), core_path, CORE_COMPRESSION_LEVEL)
+    coredump["file"] = os.path.basename(core_file)
+
+    json.dump(metadata, manifest_file, indent=4, sort_keys=True)
+
+
+def creat(path: str, mode: str = "wb") -> IO[Any]:
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL
+    return os.fdopen(os.open(path, flags), mode)
+
+
+def notify_path(spool_dir: str) -> str:
+    return spool_dir.rstrip("/") + NOTIFY_SUFFIX
+
+
+def notify(spool_dir: str, name: str) -> None:
+    try:
+        fd = os.open(notify_path(spool_dir), os.O_WRONLY | os.O_NONBLOCK)
+    except OSError as e:
+        # no recorder listening, it will find the crash on its next poll
+        print("cannot notify recorder: %s" % e, file=sys.stderr)
+        return
+    try:
+        # writes up to PIPE_BUF bytes are atomic
+        os.write(fd, (name + "\n").encode("utf-8"))
+    except OSError as e:
+        print("cannot notify recorder: %s" % e, file=sys.stderr)
+    finally:
+        os.close(fd)
+
+
+def crash_name(os_args: List[str]) -> str:
+    # time, global pid and global tid are unique for every coredump
+    params = dict(zip(EXTRA_CORE_DUMP_PARAMETER.keys(), os_args))
+    return "%s-%s-%s" % (params["time"], params["global_pid"], params["global_tid"])
+
+
+def main(args: List[str]) -> None:
+    nargs = 1  # argv[0]
+    nargs += len(EXTRA_CORE_DUMP_PARAMETER)
+    nargs += 2  # arguments from our self
+    msg = "Expected %d arguments, got %d: %s" % (nargs, len(sys.argv), sys.argv)
+    assert len(sys.argv) == nargs, msg
+
+    spool_dir = args[1]
+    max_pending = int(args[2])
+    os_args = args[3:]
+
+    pending = os.listdir(spool_dir)
+    if len(pending) >= max_pending:
+        # the recorder cannot keep up, drop this coredump rather than filling
+        # the disk. The kernel discards the rest of the core when we exit.
+        msg = "%d coredumps are pending in %s, drop coredump of pid %s"
+        print(msg % (len(pending), spool_dir, os_args[6]), file=sys.stderr)
+        return
+
+    name = crash_name(os_args)
+    incoming_dir = os.path.join(spool_dir, INCOMING_PREFIX + name)
+    try:
+        os.mkdir(incoming_dir)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+        print("%s already exists, drop coredump" % incoming_dir, file=sys.stderr)
+        return
+
+    with creat(os.path.join(incoming_dir, MANIFEST_NAME), "w") as manifest_file:
+        process_coredump(
+            os_args, os.path.join(incoming_dir, CORE_NAME), manifest_file
+        )
+    # rename is atomic: the recorder never sees partially written crashes
+    os.rename(incoming_dir, os.path.join(spool_dir, name))
+    notify(spool_dir, name)
+
+
+if __name__ == "__main__":
+    print(sys.argv)
+    main(sys.argv)
@@ -15,8 +15,11 @@ from PyQt5.QtGui import QIcon, QTextCursor
 from PyQt5.uic import loadUiType
 from qtconsole.inprocess import QtInProcessKernelManager
 
+from ..archive import is_archive
 from ..path import APP_ROOT
 from ..record import DEFAULT_LOG_DIR
+from ..symbex.cdconstraint import add_stack_constraints
+from ..symbex.solver_cache import default_cache
 from ..symbex.state import State, StateManager
 from ..symbex.tracer import Tracer
 
@@ -133,12 +136,9 @@ class MainWindow(form_class, QtWidgets.QMainWindow):
         except Exception:
             high_v = coredump.stack.stop
 
-        for addr in range(low_v, high_v):
-            value = active_state.simstate.memory.load(addr, 1, endness="Iend_LE")
-            if value.variables == frozenset():
-                continue
-            cmem = coredump.stack[addr]
-            self.coredump_constraints.append(value == cmem)
+        self.coredump_constraints.extend(
+            add_stack_constraints(active_state.simstate, coredump, high_v - 1, low_v)
+        )
 
     def eval_variable(
         self, active_state: State, loc: int, addr: Any, size: int
@@ -148,7 +148,7 @@ class MainWindow(form_class, QtWidgets.QMainWindow):
             for c in self.coredump_constraints:
                 old_solver = active_state.simstate.solver._solver.branch()
                 active_state.simstate.solver.add(c)
-                if not active_state.simstate.solver.satisfiable():
+                if not default_cache().satisfiable(active_state.simstate):
                     print("Unsatisfiable coredump constraints: {}".format(c))
                     active_state.simstate.solver._stored_solver = old_solver
             active_state.had_coredump_constraints = True
@@ -171,7 +171,7 @@ class MainWindow(form_class, QtWidgets.QMainWindow):
                     result += "** "
                     continue
                 try:
-                    v = hex(active_state.simstate.solver.eval(value))[2:]
+                    v = hex(default_cache().eval(active_state.simstate, value))[2:]
                     if len(v) == 1:
                         v = "0" + v
                 except Exception:
@@ -189,7 +189,7 @@ class MainWindow(form_class, QtWidgets.QMainWindow):
         if value.uninitialized:
             return "uninitialized"
         try:
-            v = hex(active_state.simstate.solver.eval(value))
+            v = hex(default_cache().eval(active_state.simstate, value))
         except Exception:
             v = "symbolic"
         return v
@@ -203,6 +203,8 @@ class MainWindow(form_class, QtWidgets.QMainWindow):
         addr = new_active.address()
         source_file, line = self.addr_map[addr]
         self.set_location(source_file, line)
+        # the next navigation step most likely goes to one of the neighbours
+        self.states.prefetch(new_active.index)
 
     def update_active_index(self, active_index: int) -> None:
         new_state, is_new = self.states[active_index]
@@ -267,6 +269,9 @@ class MainWindow(form_class, QtWidgets.QMainWindow):
 
     def set_slider(self, addr_map: List[Tuple[str, int]], states: StateManager) -> None:
         # NOTE: slider is for major states
+        previous = getattr(self, "states", None)  # type: Optional[StateManager]
+        if previous is not None and previous is not states:
+            previous.stop_prefetch()
         self.addr_map = addr_map
         self.states = states
         self.time_slider.setEnabled(True)
@@ -475,7 +480,7 @@ class MainWindow(form_class, QtWidgets.QMainWindow):
         self.code_view.clear()
 
     def append_archive(self) -> None:
-        files = list(DEFAULT_LOG_DIR.glob("*.tar.gz"))
+        files = [f for f in DEFAULT_LOG_DIR.iterdir() if is_archive(f)]
         files.sort()
         self.code_view.append("\nAvailable files:")
         for f in files:
@@ -118,15 +118,16 @@ class HaseMagics(Magics):
             query = str(DEFAULT_LOG_DIR.joinpath(query))
         if not Path(query).exists():
             raise HaseFrontEndException("Report archive not exist")
-        with replay_trace(query) as rep:
-            user_ns["tracer"] = rep.tracer
+        with replay_trace(query, use_cache=True) as rep:
+            tracer = rep.get_tracer()
+            user_ns["tracer"] = tracer
             executable = rep.executable
             states, _ = rep.run()
             addr2line = annotate.Addr2line()
             # NOTE: we calculate all trace instead of state
-            for instr in rep.tracer.trace:
-                obj = rep.tracer.project.loader.find_object_containing(instr.ip)
-                if obj in rep.tracer.project.loader.all_elf_objects:
+            for instr in tracer.trace:
+                obj = tracer.project.loader.find_object_containing(instr.ip)
+                if obj in tracer.project.loader.all_elf_objects:
                     addr2line.add_addr(obj, instr.ip)
             addr_map = addr2line.compute()
 
@@ -1,9 +1,9 @@
 import copy
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 from angr import Project
 
-from .pwn_wrapper import ELF, Coredump, Mapping
+from .core_file import Mapping
 
 ELF_MAGIC = b"\x7fELF"
 PERM_EXEC = 1
@@ -49,6 +49,30 @@ class Loader:
                 return mapping
         return None
 
+    def address_ranges(
+        self, path: str, offset: int, size: int
+    ) -> List[Tuple[int, int]]:
+        """
+        Virtual address ranges ([start, stop)) where the file range
+        [offset, offset + size) of `path` is mapped
+        """
+        ranges = []
+        for mapping in self.shared_objects:
+            if mapping.path != path:
+                continue
+            file_start = mapping.page_offset * 4096
+            file_stop = file_start + mapping.stop - mapping.start
+            start = max(offset, file_start)
+            stop = min(offset + size, file_stop)
+            if start < stop:
+                ranges.append(
+                    (
+                        mapping.start + start - file_start,
+                        mapping.start + stop - file_start,
+                    )
+                )
+        return ranges
+
     def find_location(self, ip: int) -> str:
         mapping = self.find_mapping(ip)
         if mapping is None:
@@ -1,7 +1,8 @@
 import os
-from typing import Any, List, Union
+from typing import Any, List, Optional, Union
 
 from .consts import PerfRecord
+from .pt_config import AddressFilter, PtConfig
 from .snapshot import CpuId, Snapshot, TscConversion
 import logging
 
@@ -33,6 +34,10 @@ class Trace:
         cpuid: CpuId,
         sample_type: int,
         cpus: List[CpuTrace],
+        pt_config: PtConfig,
+        nom_freq: int = 0,
+        address_filters: Optional[List[AddressFilter]] = None,
+        cgroup: Optional[str] = None,
     ) -> None:
         self.time_mult = tsc_conversion.time_mult
         self.time_shift = tsc_conversion.time_shift
@@ -48,10 +53,31 @@ class Trace:
 
         self.cpus = cpus
 
+        self.pt_config = pt_config
+        # max non-turbo ratio, needed by the decoder to interpret CYC packets
+        self.nom_freq = nom_freq
+        # empty if the whole process was traced
+        self.address_filters = [] if address_filters is None else address_filters
+        # set if the buffers were shared by all processes of a cgroup
+        self.cgroup = cgroup
+
 
 class Perf:
-    def __init__(self, pid: int = -1) -> None:
-        self.snapshot = Snapshot(pid)
+    def __init__(
+        self,
+        pid: int = -1,
+        pt_config: Optional[PtConfig] = None,
+        address_filters: Optional[List[AddressFilter]] = None,
+        cgroup: Optional[str] = None,
+        snapshot: Optional[Any] = None,
+    ) -> None:
+        """
+        `snapshot` replaces the hardware buffers, e.g. with a
+        `captured.CapturedSnapshot`
+        """
+        if snapshot is None:
+            snapshot = Snapshot(pid, pt_config, address_filters, cgroup)
+        self.snapshot = snapshot
 
     def __enter__(self) -> "Perf":
         return self
@@ -71,7 +97,8 @@ class Perf:
             with open(event_path, "wb") as event_file:
                 for ev in cpu.events():
                     if ev.type == PerfRecord.PERF_RECORD_MMAP2:
-                        if not ev.filename.startswith("/") or ev.filename == "//anon":
+                        filename = ev.filename
+                        if not filename.startswith(b"/") or filename == b"//anon":
                             continue
                     event_file.write(bytearray(ev))
                     count += 1
@@ -100,7 +127,22 @@ class Perf:
         conversion = self.snapshot.tsc_conversion()
         cpuid = self.snapshot.cpuid()
         sample_type = self.snapshot.sample_type()
-        return Trace(conversion, cpuid, sample_type, cpus)
+        return Trace(
+            conversion,
+            cpuid,
+            sample_type,
+            cpus,
+            self.snapshot.pt_config,
+            self.snapshot.pt_caps.max_nonturbo_ratio,
+            self.snapshot.address_filters,
+            self.snapshot.cgroup,
+        )
+
+    def resume(self) -> None:
+        """
+        Continue tracing after `write()`, used for snapshots of live processes
+        """
+        self.snapshot.resume()
 
     def close(self) -> None:
         self.snapshot.close()
@@ -0,0 +1,237 @@
+import ctypes as ct
+import mmap
+import os
+import struct
+from pathlib import Path
+from tempfile import TemporaryFile
+from typing import Any, Dict, List
+
+from ..errors import HaseError
+from ..mmap import MMap
+from .consts import (
+    CAP_USER_TIME_ZERO,
+    Libc,
+    PerfRecord,
+    SampleFlags,
+    perf_event_header,
+    perf_event_mmap_page,
+)
+from .pt_config import AddressFilter, PtCaps, PtConfig
+from .snapshot import Cpu, CpuId, Ringbuffer, event_structs
+from .tsc import TscConversion
+
+# Software stand-in for the perf_event_open buffers of `snapshot.Snapshot`.
+# Traces captured earlier are written into file backed mappings with the
+# layout the kernel uses, so everything after the buffers (sideband
+# filtering, writing snapshots, archiving reports) runs without intel pt.
+
+# same as BackwardRingbuffer
+DATA_SIZE = (2 ** 9) * Libc.PAGESIZE
+U64_MASK = (1 << 64) - 1
+
+
+def split_events(data: bytes) -> List[bytes]:
+    """
+    Splits the content of a cpu-N.perf-events file into single records
+    """
+    events = []
+    offset = 0
+    header_size = ct.sizeof(perf_event_header)
+    while offset + header_size <= len(data):
+        _, _, size = struct.unpack_from("<IHH", data, offset)
+        if size < header_size or offset + size > len(data):
+            raise HaseError("truncated perf event at offset %d" % offset)
+        events.append(data[offset : offset + size])
+        offset += size
+    return events
+
+
+def itrace_start_event(pid: int, tid: int, time: int) -> bytes:
+    event = event_structs.itrace_start_event(-1)()
+    event.type = PerfRecord.PERF_RECORD_ITRACE_START
+    event.size = ct.sizeof(event)
+    event.pid = event.sample_id.pid = pid
+    event.tid = event.sample_id.tid = tid
+    event.sample_id.time = time
+    return bytes(event)
+
+
+class FileRingbuffer(Ringbuffer):
+    """
+    perf_event_mmap_page, data area and optionally an aux area in an unlinked
+    file. Records are written like the kernel does for WRITE_BACKWARD events:
+    `data_head` decreases and old records are overwritten once the data area
+    is full.
+    """
+
+    def __init__(self, data_size: int = DATA_SIZE, aux_size: int = 0) -> None:
+        header_size = Libc.PAGESIZE
+        self.file = TemporaryFile()
+        os.ftruncate(self.file.fileno(), header_size + data_size + aux_size)
+        buf = MMap(
+            self.file.fileno(),
+            header_size + data_size,
+            mmap.PROT_READ | mmap.PROT_WRITE,
+            mmap.MAP_SHARED,
+        )
+        page = perf_event_mmap_page.from_address(buf.addr)
+        page.data_offset = header_size
+        page.data_size = data_size
+        super().__init__(buf, data_size)
+        if aux_size != 0:
+            self.header.aux_size = aux_size
+            self.aux_buf = MMap(
+                self.file.fileno(),
+                aux_size,
+                mmap.PROT_READ | mmap.PROT_WRITE,
+                mmap.MAP_SHARED,
+                offset=self.header.aux_offset,
+            )
+        self.stopped = False
+
+    def set_tsc_conversion(self, conversion: TscConversion) -> None:
+        page = self.header._header
+        page.time_mult = conversion.time_mult
+        page.time_shift = conversion.time_shift
+        page.time_zero = conversion.time_zero
+        page.capabilities |= 1 << CAP_USER_TIME_ZERO
+
+    def write_backward(self, event: bytes) -> None:
+        page = self.header._header
+        data_size = self.header.data_size
+        head = (page.data_head - len(event)) & U64_MASK
+        begin = head % data_size
+        length = min(len(event), data_size - begin)
+        ct.memmove(self.header.data_addr + begin, event, length)
+        if length < len(event):
+            # wraps around into ring buffer start
+            ct.memmove(self.header.data_addr, event[length:], len(event) - length)
+        page.data_head = head
+
+    def stop(self) -> None:
+        self.stopped = True
+
+    def resume(self) -> None:
+        self.stopped = False
+
+    def close(self) -> None:
+        if self.aux_buf:
+            self.aux_buf.close()
+            self.aux_buf = None
+        if self.buf:
+            self.buf.close()
+            self.buf = None
+        self.file.close()
+
+
+def aux_buffer(trace: bytes, itrace_start: bytes) -> FileRingbuffer:
+    """
+    Same interface as `snapshot.AuxRingbuffer`
+    """
+    # aux area must be a power of two and larger than the trace
+    aux_size = Libc.PAGESIZE
+    while aux_size <= len(trace):
+        aux_size *= 2
+    buf = FileRingbuffer(aux_size=aux_size)
+    buf.write_backward(itrace_start)
+    assert buf.aux_buf is not None
+    ct.memmove(buf.aux_buf.addr, trace, len(trace))
+    buf.header._header.aux_head = len(trace)
+    return buf
+
+
+def event_buffer(
+    events: List[bytes], conversion: TscConversion, data_size: int = DATA_SIZE
+) -> FileRingbuffer:
+    """
+    Same interface as `snapshot.BackwardRingbuffer`, `events` are ordered
+    from oldest to newest
+    """
+    buf = FileRingbuffer(data_size)
+    buf.set_tsc_conversion(conversion)
+    for event in events:
+        buf.write_backward(event)
+    return buf
+
+
+class CapturedSnapshot:
+    """
+    Same interface as `snapshot.Snapshot`, but the buffers are filled from a
+    trace recorded earlier, i.e. the `trace` section of a report manifest.
+    Relative trace paths are resolved against `root`.
+    """
+
+    def __init__(
+        self, trace: Dict[str, Any], root: Path, data_size: int = DATA_SIZE
+    ) -> None:
+        if trace["sample_type"] != SampleFlags.PERF_SAMPLE_MASK:
+            raise HaseError("trace was recorded with a different sample_type")
+        self.stopped = False
+        self.cpus = []  # type: List[Cpu]
+        self.pt_caps = PtCaps(max_nonturbo_ratio=trace.get("nom_freq", 0))
+        self.pt_config = PtConfig.from_dict(trace.get("pt_config", {}))
+        self.address_filters = [
+            AddressFilter.from_dict(f) for f in trace.get("address_filters", [])
+        ]
+        self.cgroup = trace.get("cgroup")
+        self._cpuid = CpuId(
+            trace["cpu_family"],
+            trace["cpu_model"],
+            trace["cpu_stepping"],
+            trace["cpuid_0x15_eax"],
+            trace["cpuid_0x15_ebx"],
+        )
+        conversion = TscConversion(
+            trace["time_mult"], trace["time_shift"], trace["time_zero"]
+        )
+
+        try:
+            for cpu in trace["cpus"]:
+                with open(str(root.joinpath(cpu["event_path"])), "rb") as f:
+                    events = split_events(f.read())
+                with open(str(root.joinpath(cpu["trace_path"])), "rb") as f:
+                    pt_trace = f.read()
+                itrace_start = itrace_start_event(
+                    cpu["start_pid"], cpu["start_tid"], cpu["start_time"]
+                )
+                self.cpus.append(
+                    Cpu(
+                        cpu["idx"],
+                        event_buffer(events, conversion, data_size),
+                        aux_buffer(pt_trace, itrace_start),
+                    )
+                )
+        except Exception:
+            self.close()
+            raise
+
+    def __enter__(self) -> "CapturedSnapshot":
+        return self
+
+    def __exit__(self, type: Any, value: Any, traceback: Any) -> None:
+        self.close()
+
+    def stop(self) -> None:
+        for cpu in self.cpus:
+            cpu.stop()
+        self.stopped = True
+
+    def resume(self) -> None:
+        assert self.stopped
+        for cpu in self.cpus:
+            cpu.resume()
+        self.stopped = False
+
+    def tsc_conversion(self) -> TscConversion:
+        return self.cpus[0].event_buffer.tsc_conversion()
+
+    def cpuid(self) -> CpuId:
+        return self._cpuid
+
+    def sample_type(self) -> int:
+        return SampleFlags.PERF_SAMPLE_MASK
+
+    def close(self) -> None:
+        for cpu in self.cpus:
+            cpu.close()
+        self.cpus = []
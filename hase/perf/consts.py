@@ -349,6 +349,7 @@ class AttrFlags:
     NAMESPACES = 1 << 28
 
 
+PERF_FLAG_PID_CGROUP = 4
 PERF_FLAG_FD_CLOEXEC = 8
 SYS_perf_event_open = 298
 
@@ -0,0 +1,248 @@
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from ..errors import HaseError
+
+PT_ROOT = Path("/sys/bus/event_source/devices/intel_pt")
+
+# Bit layout of perf_event_attr.config for the intel_pt PMU, see
+# /sys/bus/event_source/devices/intel_pt/format/*
+PT_BIT_CYC = 1
+PT_BIT_PWR_EVT = 4
+PT_BIT_FUP_ON_PTW = 5
+PT_BIT_MTC = 9
+PT_BIT_TSC = 10
+PT_BIT_NORETCOMP = 11
+PT_BIT_PTW = 12
+PT_BIT_BRANCH = 13
+PT_SHIFT_MTC_PERIOD = 14
+PT_SHIFT_CYC_THRESH = 19
+PT_SHIFT_PSB_PERIOD = 24
+
+PT_MASK_MTC_PERIOD = 0xF
+PT_MASK_CYC_THRESH = 0xF
+PT_MASK_PSB_PERIOD = 0xF
+
+
+def _read_cap(root: Path, name: str) -> Optional[str]:
+    path = root.joinpath(name)
+    if not path.exists():
+        return None
+    with open(str(path)) as f:
+        return f.read().strip()
+
+
+class PtCaps:
+    """
+    Capabilities of the intel_pt PMU as exported by the kernel.
+    The *_periods/*_thresholds values are bitmaps of the supported encodings.
+    """
+
+    def __init__(
+        self,
+        mtc: bool = False,
+        mtc_periods: int = 0,
+        psb_cyc: bool = False,
+        cyc_thresholds: int = 0,
+        psb_periods: int = 0,
+        ptwrite: bool = False,
+        ip_filtering: bool = False,
+        num_address_ranges: int = 0,
+        max_nonturbo_ratio: int = 0,
+    ) -> None:
+        self.mtc = mtc
+        self.mtc_periods = mtc_periods
+        self.psb_cyc = psb_cyc
+        self.cyc_thresholds = cyc_thresholds
+        self.psb_periods = psb_periods
+        self.ptwrite = ptwrite
+        self.ip_filtering = ip_filtering
+        self.num_address_ranges = num_address_ranges
+        self.max_nonturbo_ratio = max_nonturbo_ratio
+
+    @classmethod
+    def read(cls, root: Path = PT_ROOT) -> "PtCaps":
+        caps = root.joinpath("caps")
+
+        def flag(name: str) -> bool:
+            value = _read_cap(caps, name)
+            return value is not None and int(value) != 0
+
+        def bitmap(name: str) -> int:
+            value = _read_cap(caps, name)
+            return 0 if value is None else int(value, 16)
+
+        def number(name: str, directory: Path = caps) -> int:
+            value = _read_cap(directory, name)
+            return 0 if value is None else int(value)
+
+        return cls(
+            mtc=flag("mtc"),
+            mtc_periods=bitmap("mtc_periods"),
+            psb_cyc=flag("psb_cyc"),
+            cyc_thresholds=bitmap("cyc_thresholds"),
+            psb_periods=bitmap("psb_periods"),
+            ptwrite=flag("ptwrite"),
+            ip_filtering=flag("ip_filtering"),
+            num_address_ranges=number("num_address_ranges"),
+            max_nonturbo_ratio=number("max_nonturbo_ratio", root),
+        )
+
+
+class PtConfig:
+    """
+    Typed representation of the intel_pt perf_event_attr.config value.
+
+    mtc_period: MTC packet every 2^mtc_period ART ticks
+    cyc_thresh: CYC packet after 2^(cyc_thresh - 1) cycles (0 == every cycle)
+    psb_period: PSB packet every 2^(psb_period + 11) bytes of trace output
+    """
+
+    def __init__(
+        self,
+        branch: bool = True,
+        tsc: bool = True,
+        mtc: bool = True,
+        mtc_period: int = 3,
+        cyc: bool = False,
+        cyc_thresh: int = 0,
+        psb_period: int = 3,
+        ret_compression: bool = True,
+        ptw: bool = True,
+        fup_on_ptw: bool = True,
+    ) -> None:
+        self.branch = branch
+        self.tsc = tsc
+        self.mtc = mtc
+        self.mtc_period = mtc_period
+        self.cyc = cyc
+        self.cyc_thresh = cyc_thresh
+        self.psb_period = psb_period
+        self.ret_compression = ret_compression
+        self.ptw = ptw
+        self.fup_on_ptw = fup_on_ptw
+
+    def config(self) -> int:
+        # bit 0 is the `pt` bit, it is always set
+        value = 1
+        if self.cyc:
+            value |= 1 << PT_BIT_CYC
+            value |= (self.cyc_thresh & PT_MASK_CYC_THRESH) << PT_SHIFT_CYC_THRESH
+        if self.fup_on_ptw:
+            value |= 1 << PT_BIT_FUP_ON_PTW
+        if self.mtc:
+            value |= 1 << PT_BIT_MTC
+            value |= (self.mtc_period & PT_MASK_MTC_PERIOD) << PT_SHIFT_MTC_PERIOD
+        if self.tsc:
+            value |= 1 << PT_BIT_TSC
+        if not self.ret_compression:
+            value |= 1 << PT_BIT_NORETCOMP
+        if self.ptw:
+            value |= 1 << PT_BIT_PTW
+        if self.branch:
+            value |= 1 << PT_BIT_BRANCH
+        value |= (self.psb_period & PT_MASK_PSB_PERIOD) << PT_SHIFT_PSB_PERIOD
+        return value
+
+    def validate(self, caps: PtCaps) -> None:
+        if not self.branch:
+            raise HaseError("branch tracing is required to reconstruct control flow")
+        if not self.tsc:
+            raise HaseError("tsc packets are required to correlate the trace")
+        if self.mtc:
+            if not caps.mtc:
+                raise HaseError("MTC packets are not supported by this cpu")
+            if not caps.mtc_periods & (1 << self.mtc_period):
+                raise HaseError(
+                    "mtc period %d not supported (supported: 0x%x)"
+                    % (self.mtc_period, caps.mtc_periods)
+                )
+        if self.cyc:
+            if not caps.psb_cyc:
+                raise HaseError("CYC packets are not supported by this cpu")
+            if not caps.cyc_thresholds & (1 << self.cyc_thresh):
+                raise HaseError(
+                    "cyc threshold %d not supported (supported: 0x%x)"
+                    % (self.cyc_thresh, caps.cyc_thresholds)
+                )
+        if caps.psb_periods and not caps.psb_periods & (1 << self.psb_period):
+            raise HaseError(
+                "psb period %d not supported (supported: 0x%x)"
+                % (self.psb_period, caps.psb_periods)
+            )
+        if self.ptw and not caps.ptwrite:
+            # ptwrite is only an optional extra, silently drop it
+            self.ptw = False
+            self.fup_on_ptw = False
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(
+            branch=self.branch,
+            tsc=self.tsc,
+            mtc=self.mtc,
+            mtc_period=self.mtc_period,
+            cyc=self.cyc,
+            cyc_thresh=self.cyc_thresh,
+            psb_period=self.psb_period,
+            ret_compression=self.ret_compression,
+            ptw=self.ptw,
+            fup_on_ptw=self.fup_on_ptw,
+        )
+
+    @classmethod
+    def from_dict(cls, values: Dict[str, Any]) -> "PtConfig":
+        return cls(**values)
+
+    def __repr__(self) -> str:
+        return "<PtConfig 0x%x>" % self.config()
+
+
+# "default" reproduces the config perf-record uses (0x300f621)
+PROFILES = {
+    "default": dict(),
+    # fewest timing packets, larger PSB distance: most history per byte
+    "low-overhead": dict(mtc=False, ptw=False, fup_on_ptw=False, psb_period=5),
+    # fine grained timing for latency analysis
+    "timing": dict(mtc_period=0, cyc=True, cyc_thresh=1),
+    # frequent sync points, the decoder can resync after gaps more quickly
+    "dense-psb": dict(psb_period=0),
+}  # type: Dict[str, Dict[str, Any]]
+
+
+def pt_profile(name: str) -> PtConfig:
+    options = PROFILES.get(name)
+    if options is None:
+        raise HaseError(
+            "unknown pt profile '%s', choose from: %s"
+            % (name, ", ".join(sorted(PROFILES.keys())))
+        )
+    return PtConfig(**options)
+
+
+class AddressFilter:
+    """
+    Restricts tracing to [offset, offset + size) of a file mapping, the
+    kernel resolves the range for every executable mapping of `path`.
+    """
+
+    def __init__(self, path: str, offset: int, size: int) -> None:
+        self.path = path
+        self.offset = offset
+        self.size = size
+
+    def __str__(self) -> str:
+        return "filter 0x%x/0x%x@%s" % (self.offset, self.size, self.path)
+
+    def __repr__(self) -> str:
+        return "<AddressFilter %s>" % str(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(path=self.path, offset=self.offset, size=self.size)
+
+    @classmethod
+    def from_dict(cls, values: Dict[str, Any]) -> "AddressFilter":
+        return cls(values["path"], values["offset"], values["size"])
+
+
+def filter_string(filters: List[AddressFilter]) -> str:
+    return ",".join(str(f) for f in filters)
@@ -6,11 +6,13 @@ from typing import Any, Generator, Iterator, List, Optional
 
 from ..mmap import MMap
 from .consts import (CAP_USER_TIME_ZERO, PERF_COUNT_SW_DUMMY,
-                     PERF_FLAG_FD_CLOEXEC, PERF_TYPE_SOFTWARE, AttrFlags,
+                     PERF_FLAG_FD_CLOEXEC, PERF_FLAG_PID_CGROUP,
+                     PERF_TYPE_SOFTWARE, AttrFlags,
                      EventStructs, Ioctls, Libc, PerfRecord, SampleFlags,
                      SYS_perf_event_open, perf_event_attr, perf_event_header,
                      perf_event_mmap_page)
 from .cpuid import CPUID
+from .pt_config import AddressFilter, PtCaps, PtConfig, filter_string
 from .tsc import TscConversion
 
 event_structs = EventStructs(SampleFlags.PERF_SAMPLE_MASK)
@@ -67,9 +69,16 @@ def intel_pt_type() -> int:
 
 
 class PMU:
-    def __init__(self, perf_attr: perf_event_attr, cpu: int, pid: int) -> None:
+    def __init__(
+        self, perf_attr: perf_event_attr, cpu: int, pid: int, flags: int = 0
+    ) -> None:
+        """
+        With PERF_FLAG_PID_CGROUP in `flags`, `pid` is a file descriptor of a
+        cgroup directory and all its processes are traced on `cpu`
+        """
+        flags |= PERF_FLAG_FD_CLOEXEC
         self.fd = Libc.syscall(
-            SYS_perf_event_open, ct.byref(perf_attr), pid, cpu, -1, PERF_FLAG_FD_CLOEXEC
+            SYS_perf_event_open, ct.byref(perf_attr), pid, cpu, -1, flags
         )
         assert self.fd != -1
         fcntl.fcntl(self.fd, fcntl.F_SETFL, os.O_RDONLY | os.O_NONBLOCK)
@@ -85,12 +94,20 @@ class PMU:
         assert res == 0
         return res
 
+    def set_filter(self, filters: str) -> int:
+        return self._ioctl(
+            Ioctls.PERF_EVENT_IOC_SET_FILTER, ct.c_char_p(filters.encode("utf-8"))
+        )
+
     def set_output(self, pmu: "PMU") -> int:
         return self._ioctl(Ioctls.PERF_EVENT_IOC_SET_OUTPUT, pmu.fd)
 
     def pause(self) -> int:
         return self._ioctl(Ioctls.PERF_EVENT_IOC_PAUSE_OUTPUT, 1)
 
+    def resume(self) -> int:
+        return self._ioctl(Ioctls.PERF_EVENT_IOC_PAUSE_OUTPUT, 0)
+
     def disable(self) -> int:
         return self._ioctl(Ioctls.PERF_EVENT_IOC_DISABLE, 0)
 
@@ -106,13 +123,11 @@ class PMU:
         return id.value
 
 
-def open_pt_event(cpu: int, pid: int) -> PMU:
+def open_pt_event(cpu: int, pid: int, pt_config: PtConfig, flags: int = 0) -> PMU:
     attr = perf_event_attr()
     attr.size = ct.sizeof(attr)
     attr.type = intel_pt_type()
-    # FIXME: find out how config works,
-    # currenty copied from strace output
-    attr.config = 0x300f621
+    attr.config = pt_config.config()
     attr.sample_type = SampleFlags.PERF_SAMPLE_MASK
     attr.sample_period = 1
     attr.clockid = 1
@@ -124,10 +139,10 @@ def open_pt_event(cpu: int, pid: int) -> PMU:
         | AttrFlags.WRITE_BACKWARD
     )
 
-    return PMU(attr, cpu, pid)
+    return PMU(attr, cpu, pid, flags)
 
 
-def open_dummy_event(cpu: int, pid: int) -> PMU:
+def open_dummy_event(cpu: int, pid: int, flags: int = 0) -> PMU:
     attr = perf_event_attr()
     attr.size = ct.sizeof(attr)
     attr.type = PERF_TYPE_SOFTWARE
@@ -155,7 +170,7 @@ def open_dummy_event(cpu: int, pid: int) -> PMU:
     #    AttrFlags.CONTEXT_SWITCH | \
     #    AttrFlags.WRITE_BACKWARD
 
-    return PMU(attr, cpu, pid)
+    return PMU(attr, cpu, pid, flags)
 
 
 class CpuId:
@@ -288,52 +303,84 @@ class MmapHeader:
         self._header.data_tail = self._header.data_head
 
 
-class BackwardRingbuffer:
-    def __init__(self, cpu: int, pid: int = -1) -> None:
+class Ringbuffer:
+    """
+    perf_event_mmap_page and data area of an event, as used by `Cpu`
+    """
+
+    def __init__(self, buf: MMap, data_size: int) -> None:
+        self.buf = buf  # type: Optional[MMap]
+        self.header = MmapHeader(buf.addr, data_size)
+        # only mapped for intel pt events
+        self.aux_buf = None  # type: Optional[MMap]
+
+    def events(self) -> Iterator[ct.Structure]:
+        return self.header.events()
+
+    def tsc_conversion(self) -> TscConversion:
+        return self.header.tsc_conversion()
+
+    def mark_as_read(self) -> None:
+        self.header.advance()
+
+    def stop(self) -> None:
+        raise NotImplementedError()
+
+    def resume(self) -> None:
+        raise NotImplementedError()
+
+    def close(self) -> None:
+        raise NotImplementedError()
+
+
+class BackwardRingbuffer(Ringbuffer):
+    def __init__(self, cpu: int, pid: int = -1, flags: int = 0) -> None:
         """
         Implements ring buffer described here: https://lwn.net/Articles/688338/
         """
         # data and aux area must be a multiply of two
-        self.pmu = open_dummy_event(cpu, pid)
+        self.pmu = open_dummy_event(cpu, pid, flags)
         header_size = Libc.PAGESIZE
         data_size = (2 ** 9) * Libc.PAGESIZE  # == 2097152
 
-        self.buf = MMap(
+        buf = MMap(
             self.pmu.fd, header_size + data_size, mmap.PROT_READ, mmap.MAP_SHARED
         )
-
-        self.header = MmapHeader(self.buf.addr, data_size)
+        super().__init__(buf, data_size)
 
     def stop(self) -> None:
         self.pmu.pause()
 
+    def resume(self) -> None:
+        self.pmu.resume()
+
     def close(self) -> None:
         if self.buf:
             self.buf.close()
         self.pmu.close()
 
-    def events(self) -> Iterator[ct.Structure]:
-        return self.header.events()
-
-    def tsc_conversion(self) -> TscConversion:
-        return self.header.tsc_conversion()
 
-
-class AuxRingbuffer:
-    def __init__(self, cpu: int, pid: int = -1) -> None:
+class AuxRingbuffer(Ringbuffer):
+    def __init__(
+        self,
+        cpu: int,
+        pt_config: PtConfig,
+        pid: int = -1,
+        address_filters: Optional[List[AddressFilter]] = None,
+        flags: int = 0,
+    ) -> None:
         # data area must be a multiply of two
         data_size = (2 ** 9) * Libc.PAGESIZE  # == 2097152
-        self.pmu = open_pt_event(cpu, pid)
+        self.pmu = open_pt_event(cpu, pid, pt_config, flags)
         header_size = Libc.PAGESIZE
 
-        self.buf = MMap(
+        buf = MMap(
             self.pmu.fd,
             header_size + data_size,
             mmap.PROT_READ | mmap.PROT_WRITE,
             mmap.MAP_SHARED,
         )
-
-        self.header = MmapHeader(self.buf.addr, data_size)
+        super().__init__(buf, data_size)
 
         # aux area must be a multiply of two
         self.header.aux_size = Libc.PAGESIZE * (2 ** 14)  # == 67108864
@@ -345,10 +392,10 @@ class AuxRingbuffer:
             offset=self.header.aux_offset,
         )
 
-        self.pmu.enable()
+        if address_filters:
+            self.pmu.set_filter(filter_string(address_filters))
 
-    def mark_as_read(self) -> None:
-        self.header.advance()
+        self.pmu.enable()
 
     def close(self) -> None:
         if self.aux_buf:
@@ -362,13 +409,13 @@ class AuxRingbuffer:
     def stop(self) -> None:
         self.pmu.disable()
 
-    def events(self) -> Iterator[ct.Structure]:
-        return self.header.events()
+    def resume(self) -> None:
+        self.pmu.enable()
 
 
 class Cpu:
     def __init__(
-        self, idx: int, event_buffer: BackwardRingbuffer, pt_buffer: AuxRingbuffer
+        self, idx: int, event_buffer: Ringbuffer, pt_buffer: Ringbuffer
     ) -> None:
         self.idx = idx
         self.event_buffer = event_buffer
@@ -384,8 +431,10 @@ class Cpu:
         return self._itrace_start_event
 
     def traces(self) -> bytearray:
-        aux_begin = self.pt_buffer.aux_buf.addr
-        aux_end = self.pt_buffer.aux_buf.addr + self.pt_buffer.aux_buf.size
+        aux_buf = self.pt_buffer.aux_buf
+        assert aux_buf is not None
+        aux_begin = aux_buf.addr
+        aux_end = aux_buf.addr + aux_buf.size
         for ev in self.pt_buffer.events():
             if ev.type == PerfRecord.PERF_RECORD_ITRACE_START:
                 self._itrace_start_event = ev
@@ -407,34 +456,60 @@ class Cpu:
 
         self.event_buffer.stop()
 
+    def resume(self) -> None:
+        self.event_buffer.resume()
+
+        self.pt_buffer.resume()
+
     def close(self) -> None:
         self.pt_buffer.close()
         self.event_buffer.close()
 
 
 class Snapshot:
-    def __init__(self, pid: int = -1) -> None:
+    def __init__(
+        self,
+        pid: int = -1,
+        pt_config: Optional[PtConfig] = None,
+        address_filters: Optional[List[AddressFilter]] = None,
+        cgroup: Optional[str] = None,
+    ) -> None:
         self.stopped = False
         self.cpus = []  # type: List[Cpu]
+        self.pt_caps = PtCaps.read()
+        self.pt_config = PtConfig() if pt_config is None else pt_config
+        self.pt_config.validate(self.pt_caps)
+        self.address_filters = [] if address_filters is None else address_filters
+        # all processes of the cgroup share the per-cpu buffers
+        self.cgroup = cgroup
 
         try:
-            self.start(pid)
+            if cgroup is None:
+                self.start(pid)
+            else:
+                cgroup_fd = os.open(cgroup, os.O_RDONLY | os.O_DIRECTORY)
+                try:
+                    self.start(cgroup_fd, PERF_FLAG_PID_CGROUP)
+                finally:
+                    os.close(cgroup_fd)
         except Exception:
             self.close()
             raise
 
-    def start(self, pid: int) -> None:
+    def start(self, pid: int, flags: int = 0) -> None:
         assert not self.stopped
         event_buffers = []  # type: List[BackwardRingbuffer]
         pt_buffers = []  # type: List[AuxRingbuffer]
 
         cpu_idx = cpus_online()
         for idx in cpu_idx:
-            event_buffers.append(BackwardRingbuffer(idx, pid))
+            event_buffers.append(BackwardRingbuffer(idx, pid, flags))
 
         # gather dummy events before pt events
         for idx in cpu_idx:
-            pt_buffers.append(AuxRingbuffer(idx, pid))
+            pt_buffers.append(
+                AuxRingbuffer(idx, self.pt_config, pid, self.address_filters, flags)
+            )
 
         for idx in cpu_idx:
             self.cpus.append(Cpu(idx, event_buffers[idx], pt_buffers[idx]))
@@ -450,6 +525,12 @@ class Snapshot:
             cpu.stop()
         self.stopped = True
 
+    def resume(self) -> None:
+        assert self.stopped
+        for cpu in self.cpus:
+            cpu.resume()
+        self.stopped = False
+
     def tsc_conversion(self) -> TscConversion:
         return self.cpus[0].event_buffer.tsc_conversion()
 
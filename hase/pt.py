@@ -2,6 +2,7 @@ import bisect
 import ctypes as ct
 import functools
 import logging
+from collections import Counter
 from contextlib import contextmanager
 from enum import IntEnum
 from typing import Any, Dict, Generator, List, Optional, Set, Tuple, Union
@@ -340,10 +341,18 @@ def merge_same_core_switches(schedule: List[ScheduleEntry]) -> List[ScheduleEntr
 
 
 class Chunk:
-    def __init__(self, start: int, stop: int, instructions: List[Instruction]) -> None:
+    def __init__(
+        self,
+        start: int,
+        stop: int,
+        instructions: List[Instruction],
+        cr3: Optional[int] = None,
+    ) -> None:
         self.start = start
         self.stop = stop
         self.instructions = instructions
+        # address space of the instructions, None if no PIP packet was seen yet
+        self.cr3 = cr3
 
     def saw_tsc_update(self) -> bool:
         return self.start != self.stop
@@ -357,9 +366,39 @@ class Chunk:
         )
 
 
+# the lowest bits of cr3 are the pcid, with page table isolation the user and
+# the kernel page tables of a process are next to each other
+ADDRESS_SPACE_MASK = ~0x1FFF
+
+
+def process_cr3(chunks: List[Chunk]) -> Optional[int]:
+    """
+    Address space most of the instructions of `chunks` were executed in
+    """
+    counts = Counter()  # type: Counter
+    for chunk in chunks:
+        if chunk.cr3 is not None:
+            counts[chunk.cr3] += len(chunk.instructions)
+    if len(counts) == 0:
+        return None
+    return counts.most_common(1)[0][0]
+
+
 def correlate_traces(
-    traces: List[List[Chunk]], schedule: List[ScheduleEntry], pid: int, tid: int
+    traces: List[List[Chunk]],
+    schedule: List[ScheduleEntry],
+    pid: int,
+    tid: int,
+    shared: bool = False,
 ) -> List[Instruction]:
+    """
+    Assigns the chunks of every core to the schedule and returns the
+    instructions of process `pid`. Traces `shared` by the processes of a
+    cgroup contain other processes as well: their schedule entries are
+    dropped, and so are chunks executed in another address space than the
+    one of `pid`, i.e. when the kernel switched between two processes of the
+    cgroup without disabling tracing.
+    """
     schedule_per_core = []  # type: List[List[ScheduleEntry]]
     for _ in range(len(traces)):
         schedule_per_core.append([])
@@ -407,11 +446,23 @@ def correlate_traces(
         assert len(trace) == 0
     instructions = []
 
+    cr3 = None  # type: Optional[int]
+    if shared:
+        cr3 = process_cr3(
+            [chunk for entry in schedule if entry.pid == pid for chunk in entry.chunks]
+        )
+    correlated = 0
     for entry in schedule:
         for i, chunk in enumerate(entry.chunks):
+            correlated += len(chunk.instructions)
+            if entry.pid != pid:
+                continue
+            if cr3 is not None and chunk.cr3 is not None and chunk.cr3 != cr3:
+                l.debug("drop %s of another address space", chunk)
+                continue
             instructions.extend(chunk.instructions)
 
-    assert len(instructions) == instruction_count
+    assert correlated == instruction_count
     return instructions
 
 
@@ -423,12 +474,25 @@ def _check_error(status: int) -> int:
 
 
 class Chunker:
-    def __init__(self, decoder: ffi.CData, conversion: TscConversion) -> None:
+    def __init__(
+        self, decoder: ffi.CData, conversion: TscConversion, skip_errors: bool = False
+    ) -> None:
+        """
+        With `skip_errors` trace that cannot be decoded is skipped up to the
+        next synchronization point. Traces shared by a cgroup contain
+        processes whose memory is not part of the report.
+        """
         self._decoder = decoder
         self._conversion = conversion
+        self._skip_errors = skip_errors
         self._event = ffi.new("struct pt_event *")
         self._instruction = ffi.new("struct pt_insn *")
         self._status = 0
+        self._chunks = []  # type: List[Chunk]
+        self._instructions = []  # type: List[Instruction]
+        self._enable_tsc = None  # type: Optional[int]
+        self._latest_tsc = None  # type: Optional[int]
+        self._cr3 = None  # type: Optional[int]
 
     def _events(self) -> Generator[ffi.CData, None, None]:
         while self._status & lib.pts_event_pending:
@@ -450,68 +514,100 @@ class Chunker:
         if self._status != -lib.pts_eos:
             yield
 
-    def _append_chunk(
-        self,
-        chunks: List[Chunk],
-        enable_tsc: int,
-        disable_tsc: int,
-        instructions: List[Instruction],
-    ) -> None:
-        chunks.append(
+    def _append_chunk(self, disable_tsc: int) -> None:
+        assert self._enable_tsc is not None
+        self._chunks.append(
             Chunk(
-                self._conversion.tsc_to_perf_time(enable_tsc),
+                self._conversion.tsc_to_perf_time(self._enable_tsc),
                 self._conversion.tsc_to_perf_time(disable_tsc),
-                instructions,
+                self._instructions,
+                self._cr3,
             )
         )
+        self._instructions = []
+        self._enable_tsc = None
+
+    def _switch_address_space(self, cr3: int, tsc: int) -> None:
+        # PIP packet: another process might run from here on
+        cr3 &= ADDRESS_SPACE_MASK
+        if cr3 == self._cr3:
+            return
+        if len(self._instructions) != 0:
+            self._append_chunk(tsc)
+            self._enable_tsc = tsc
+        self._cr3 = cr3
+
+    def _decode(self) -> None:
+        while self._status != lib.pts_eos:
+            for event in self._events():
+                self._latest_tsc = event.tsc
+                if event.type == lib.ptev_enabled:
+                    self._enable_tsc = event.tsc
+                elif (
+                    event.type == lib.ptev_async_disabled
+                    or event.type == lib.ptev_disabled
+                ):
+                    if len(self._instructions) == 0:
+                        self._enable_tsc = None
+                        continue
+                    assert self._enable_tsc and event.tsc
+                    self._append_chunk(event.tsc)
+                elif event.type == lib.ptev_paging:
+                    self._switch_address_space(event.variant.paging.cr3, event.tsc)
+                elif event.type == lib.ptev_async_paging:
+                    self._switch_address_space(
+                        event.variant.async_paging.cr3, event.tsc
+                    )
+            if self._status == -lib.pts_eos:
+                break
+
+            pt_instr = self._fetch_instruction()
+            if pt_instr.iclass != lib.ptic_error:
+                if self._enable_tsc is None:
+                    self._enable_tsc = self._latest_tsc
+                self._instructions.append(
+                    Instruction(
+                        int(pt_instr.ip),
+                        int(pt_instr.size),
+                        InstructionClass(pt_instr.iclass),
+                    )
+                )
 
-    def chunks(self) -> List[Chunk]:
-        chunks = []  # type: List[Chunk]
-
-        enable_tsc = None  # type: Optional[int]
-        latest_tsc = None  # type: Optional[int]
+    def _resync(self) -> bool:
+        """
+        Drops the instructions since the last chunk and continues at the next
+        synchronization point, False at the end of the trace
+        """
+        self._instructions = []
+        self._enable_tsc = None
+        self._cr3 = None
+        try:
+            return any(True for _ in self._sync_forward())
+        except PtError:
+            return False
 
-        instructions = []  # type: List[Instruction]
+    def chunks(self) -> List[Chunk]:
+        self._chunks = []
 
         for _ in self._sync_forward():
-            while self._status != lib.pts_eos:
-                for event in self._events():
-                    latest_tsc = event.tsc
-                    if event.type == lib.ptev_enabled:
-                        enable_tsc = event.tsc
-                    elif (
-                        event.type == lib.ptev_async_disabled
-                        or event.type == lib.ptev_disabled
-                    ):
-                        if len(instructions) == 0:
-                            enable_tsc = None
-                            continue
-                        assert enable_tsc and event.tsc
-                        self._append_chunk(chunks, enable_tsc, event.tsc, instructions)
-                        instructions = []
-                        enable_tsc = None
-                if self._status == -lib.pts_eos:
+            while True:
+                try:
+                    self._decode()
                     break
-
-                pt_instr = self._fetch_instruction()
-                if pt_instr.iclass != lib.ptic_error:
-                    if enable_tsc is None:
-                        enable_tsc = latest_tsc
-                    instructions.append(
-                        Instruction(
-                            int(pt_instr.ip),
-                            int(pt_instr.size),
-                            InstructionClass(pt_instr.iclass),
-                        )
-                    )
-
-        if len(instructions) != 0:
-            assert enable_tsc is not None and latest_tsc is not None
+                except PtError as e:
+                    if not self._skip_errors:
+                        raise
+                    l.debug("skip trace that cannot be decoded: %s", e)
+                    if not self._resync():
+                        break
+
+        if len(self._instructions) != 0:
+            assert self._enable_tsc is not None and self._latest_tsc is not None
             l.warning(
                 "no final disable pt event found in stream, was the stream truncated?"
             )
-            self._append_chunk(chunks, enable_tsc, latest_tsc, instructions)
-        return chunks
+            self._append_chunk(self._latest_tsc)
+        return self._chunks
 
 
 @contextmanager
@@ -552,7 +648,14 @@ def decode(
     time_zero: int,
     time_shift: int,
     time_mult: int,
+    mtc_freq: int,
+    nom_freq: int,
+    shared: bool = False,
 ) -> List[Instruction]:
+    """
+    With `shared` the traces were recorded for all processes of a cgroup, see
+    `correlate_traces`
+    """
 
     assert len(trace_paths) > 0
 
@@ -564,6 +667,8 @@ def decode(
     decoder_config.cpu_stepping = cpu_stepping
     decoder_config.cpuid_0x15_eax = cpuid_0x15_eax
     decoder_config.cpuid_0x15_ebx = cpuid_0x15_ebx
+    decoder_config.mtc_freq = mtc_freq
+    decoder_config.nom_freq = nom_freq
     decoder_config.shared_object_count = len(loader.shared_objects)
     shared_objects = []
     for i, m in enumerate(loader.shared_objects):
@@ -588,14 +693,14 @@ def decode(
         c_trace_path = ffi.new("char[]", trace_path.encode("utf-8"))
         decoder_config.trace_path = c_trace_path
         with decoder(decoder_config) as d:
-            c = Chunker(d, tsc_conversion)
+            c = Chunker(d, tsc_conversion, skip_errors=shared)
             traces.append(c.chunks())
 
     schedule = get_thread_schedule(perf_event_paths, start_thread_ids, start_times)
 
     schedule = merge_same_core_switches(schedule)
 
-    instructions = correlate_traces(traces, schedule, pid, tid)
+    instructions = correlate_traces(traces, schedule, pid, tid, shared)
     cfg = build_cfg(instructions, loader)
     check_cfg(cfg, instructions)
     return instructions
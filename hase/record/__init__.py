@@ -5,25 +5,33 @@ import os
 import resource
 import shutil
 import subprocess
-import time
 from contextlib import ExitStack
 from pathlib import Path
+from queue import Full, Queue
 from signal import SIGUSR2
-from tempfile import NamedTemporaryFile, TemporaryDirectory
-from types import FrameType
-from typing import IO, Any, Dict, List, Optional, Tuple, Union
-
-from .. import pwn_wrapper
+from tempfile import TemporaryDirectory
+from threading import Thread
+from typing import IO, Any, Callable, Dict, List, Optional, Tuple, Union
+
+from .. import archive
+from ..binary_store import STORE_NAME, BinaryStore
+from ..compression import decompress_core
+from ..core_file import PF_X
+from ..core_file import Coredump as CoreFile
+from ..errors import HaseError
 from ..perf import IncreasePerfBuffer, Perf, Trace
-from .coredumps import Coredump, Handler
+from ..perf.pt_config import AddressFilter, PtConfig, pt_profile
+from .coredumps import Coredump, CoredumpQueue, Handler, RecordedCore
+from .event_loop import EventLoop
+from .minimize import minimize_core
+from .processor_trace import build_address_filters, check_features
 from .ptrace import ptrace_detach, ptrace_me
-from .signal_handler import SignalHandler
 
 l = logging.getLogger(__name__)
 
 DEFAULT_LOG_DIR = Path("/var/lib/hase")
 
-PROT_EXEC = 4
+DEFAULT_MAX_PENDING = 16
 
 
 class TimeoutExpired(Exception):
@@ -33,7 +41,7 @@ class TimeoutExpired(Exception):
 class Recording:
     def __init__(
         self,
-        coredump: Optional[Coredump],
+        coredump: Optional[RecordedCore],
         trace: Trace,
         exit_status: int,
         rusage: Optional[Tuple[Any, ...]] = None,
@@ -47,92 +55,204 @@ class Recording:
 
 
 class RecordProcess(ExitStack):
-    def __init__(self, pid: int, record_paths: "RecordPaths"):
+    def __init__(
+        self,
+        pid: int,
+        record_paths: "RecordPaths",
+        worker: "ReportWorker",
+        loop: EventLoop,
+        pt_config: Optional[PtConfig] = None,
+        address_filters: Optional[List[AddressFilter]] = None,
+        cgroup: Optional[str] = None,
+    ):
         super().__init__()
+        self.pid = pid
+        self.loop = loop
         self._coredump_handler = Handler(
-            str(record_paths.coredump),
-            str(record_paths.fifo),
-            str(record_paths.manifest),
+            str(record_paths.spool_dir),
+            worker.max_pending,
             log_path=str(record_paths.log_path.joinpath("coredump.log")),
         )
         self._increase_buffer = IncreasePerfBuffer(100 * 1024)
-        self._perf = Perf(pid)
-        self._signal_handler = SignalHandler(SIGUSR2, self.received_coredump)
+        self._perf = Perf(pid, pt_config, address_filters, cgroup)
 
-        # work around missing nonlocal keyword in python2 with a list
-        self._got_coredump = [False]
+        self._got_coredump = False
         self._record_paths = record_paths
+        self._worker = worker
+        self._coredumps = None  # type: Optional[CoredumpQueue]
+        self.recordings = []  # type: List[Recording]
+
+    def received_coredump(self) -> None:
+        # sent by the core_pattern script before the core is written
+        self._got_coredump = True
+        self.poll()
 
-    def received_coredump(self, signum: int, frame_type: FrameType) -> None:
-        self._got_coredump[0] = True
+    def completed_coredump(self) -> None:
+        assert self._coredumps is not None
+        self._coredumps.drain()
+        self.poll()
+
+    @property
+    def got_coredump(self) -> bool:
+        return self._got_coredump
+
+    def is_target(self, metadata: Dict[str, Any]) -> bool:
+        # core_pattern is system wide
+        return metadata["global_pid"] == self.pid
 
     def __enter__(self) -> "RecordProcess":
         super().__enter__()
-        self._coredump = self.enter_context(self._coredump_handler)
+        # must be handled before the core_pattern script is installed
+        self.loop.add_signal_handler(SIGUSR2, self.received_coredump)
+        self._coredumps = self.enter_context(self._coredump_handler)
+        self.loop.add_reader(self._coredumps.fileno(), self.completed_coredump)
+        self.callback(self.loop.remove_reader, self._coredumps.fileno())
         self.enter_context(self._increase_buffer)
-        self.enter_context(self._signal_handler)
         self.enter_context(self._perf)
         write_pid_file(self._record_paths.pid_file)
         return self
 
-    def result(self) -> Tuple[Optional[Coredump], Trace]:
-        if not self._got_coredump[0]:
-            coredump = None
+    def poll(self, wait: bool = False) -> None:
+        """
+        Hand crashes collected by coredump_handler to the report worker.
+        With `wait`, crashes that are still being written are waited for.
+        """
+        if not self._got_coredump:
+            return
+        assert self._coredumps is not None
+        if wait:
+            coredumps = self._coredumps.wait()
         else:
-            coredump = self._coredump
+            coredumps = self._coredumps.ready()
+
+        for coredump in coredumps:
+            try:
+                metadata = coredump.metadata()
+                pid = metadata["global_pid"]
+            except (OSError, ValueError, KeyError) as e:
+                l.warning("drop incomplete coredump %s: %s", coredump, e)
+                coredump.remove()
+                continue
+            if not self.is_target(metadata):
+                l.info("ignore coredump of untraced process %d", pid)
+                coredump.remove()
+                continue
+            paths = self._record_paths.for_crash(coredump)
+            trace = self.snapshot(paths.perf_directory)
+            recording = Recording(coredump, trace, 0)
+            if self._worker.submit(Job(recording, paths)):
+                self.recordings.append(recording)
+
+    def result(
+        self, exit_status: int = 0, rusage: Optional[Tuple[Any, ...]] = None
+    ) -> Recording:
+        self.poll(wait=True)
+        if len(self.recordings) > 0:
+            recording = self.recordings[-1]
+            recording.exit_status = exit_status
+            recording.rusage = rusage
+            return recording
 
         self._record_paths.perf_directory.mkdir(parents=True, exist_ok=True)
         trace = self._perf.write(str(self._record_paths.perf_directory))
+        return Recording(None, trace, exit_status, rusage)
 
-        return (coredump, trace)
+    def snapshot(self, perf_directory: Path) -> Trace:
+        """
+        Write the current trace buffers to `perf_directory` and continue tracing
+        """
+        perf_directory.mkdir(parents=True, exist_ok=True)
+        trace = self._perf.write(str(perf_directory))
+        self._perf.resume()
+        return trace
 
 
 def record_child_pid(
-    pid: int, record_paths: "RecordPaths", timeout: Optional[int] = None
+    pid: int,
+    record_paths: "RecordPaths",
+    worker: "ReportWorker",
+    timeout: Optional[int] = None,
+    pt_config: Optional[PtConfig] = None,
+    address_filters: Optional[List[AddressFilter]] = None,
 ) -> Recording:
 
-    if timeout is None:
-        options = 0
+    def expired() -> None:
+        raise TimeoutExpired("process did not finish within {} seconds".format(timeout))
+
+    with EventLoop() as loop:
+        record = RecordProcess(
+            pid, record_paths, worker, loop, pt_config, address_filters
+        )
+        with record:
+            loop.watch_process(pid, loop.stop)
+            if timeout is not None:
+                loop.call_later(timeout, expired)
+            ptrace_detach(pid)
+            # crashes are collected by the loop while the process runs
+            loop.run()
+            _, exit_code, rusage = os.wait4(pid, 0)
+            return record.result(exit_code, rusage)
+
+
+def record_other_pid(
+    pid: int,
+    record_paths: "RecordPaths",
+    worker: "ReportWorker",
+    pt_config: Optional[PtConfig] = None,
+    address_filters: Optional[List[AddressFilter]] = None,
+) -> Recording:
+    with EventLoop() as loop:
+        record = RecordProcess(
+            pid, record_paths, worker, loop, pt_config, address_filters
+        )
+        with record:
+            loop.watch_process(pid, loop.stop)
+            print("recording started")
+            try:
+                loop.run()
+            except KeyboardInterrupt:
+                pass
+            return record.result()
+
+
+def target_executable(target: Union[List[str], int]) -> str:
+    if isinstance(target, list):
+        return shutil.which(target[0]) or target[0]
     else:
-        options = os.WNOHANG
+        return os.readlink("/proc/%d/exe" % target)
 
-    record = RecordProcess(pid, record_paths)
 
-    with record:
-        ptrace_detach(pid)
-        start = time.time()
+def spawn(
+    command: List[str],
+    stdin: Optional[IO[Any]] = None,
+    stdout: Optional[IO[Any]] = None,
+    stderr: Optional[IO[Any]] = None,
+    working_directory: Optional[Path] = None,
+    extra_env: Optional[Dict[str, str]] = None,
+) -> int:
+    """
+    Start `command` stopped by ptrace, so we can start tracing before it runs
+    """
+    env = None
+    if extra_env is not None:
+        env = os.environ.copy()
+        env.update(extra_env)
 
-        while True:
-            pid, exit_code, rusage = os.wait4(pid, options)
-            if pid != 0:
-                break
-            elif timeout is not None and time.time() - start <= 0:
-                raise TimeoutExpired(
-                    "process did not finish within {} seconds".format(timeout)
-                )
-            time.sleep(0.10)
-        coredump, trace = record.result()
-        return Recording(coredump, trace, exit_code, rusage)
-
-
-def record_other_pid(pid: int, record_paths: "RecordPaths") -> Recording:
-    record = RecordProcess(pid, record_paths)
-    with record:
-        print("recording started")
-        while True:
-            try:
-                os.kill(pid, 0)
-                time.sleep(0.10)
-            except OSError:
-                break
-            except KeyboardInterrupt:
-                break
-        coredump, trace = record.result()
-        return Recording(coredump, trace, 0, None)
+    proc = subprocess.Popen(
+        command,
+        preexec_fn=ptrace_me,
+        stdin=stdin,
+        stdout=stdout,
+        stderr=stderr,
+        cwd=None if working_directory is None else str(working_directory),
+        env=env,
+    )
+    return proc.pid
 
 
 def _record(
     record_paths: "RecordPaths",
+    worker: "ReportWorker",
     target: Union[List[str], int],
     stdin: Optional[IO[Any]] = None,
     stdout: Optional[IO[Any]] = None,
@@ -140,26 +260,23 @@ def _record(
     working_directory: Optional[Path] = None,
     timeout: Optional[int] = None,
     extra_env: Optional[Dict[str, str]] = None,
+    pt_config: Optional[PtConfig] = None,
+    ip_filter: Optional[List[str]] = None,
 ) -> Recording:
 
-    env = None
-    if extra_env is not None:
-        env = os.environ.copy()
-        env.update(extra_env)
+    address_filters = build_address_filters(
+        ip_filter or [], target_executable(target), check_features()
+    )
 
     if isinstance(target, list):
-        proc = subprocess.Popen(
-            target,
-            preexec_fn=ptrace_me,
-            stdin=stdin,
-            stdout=stdout,
-            stderr=stderr,
-            cwd=None if working_directory is None else str(working_directory),
-            env=extra_env,
+        pid = spawn(target, stdin, stdout, stderr, working_directory, extra_env)
+        return record_child_pid(
+            pid, record_paths, worker, timeout, pt_config, address_filters
         )
-        return record_child_pid(proc.pid, record_paths, timeout)
     else:
-        return record_other_pid(target, record_paths)
+        return record_other_pid(
+            target, record_paths, worker, pt_config, address_filters
+        )
 
 
 def write_pid_file(pid_file: Optional[str]) -> None:
@@ -173,9 +290,17 @@ class ExitEvent:
 
 
 class Job:
-    def __init__(self, recording: Recording, record_paths: "RecordPaths") -> None:
+    def __init__(
+        self,
+        recording: Recording,
+        record_paths: "RecordPaths",
+        done: Optional[Callable[["Job"], None]] = None,
+    ) -> None:
         self.recording = recording
         self.record_paths = record_paths
+        # called by the worker thread once it handled the job, not if `submit`
+        # dropped it
+        self.done = done
 
     def core_file(self) -> Optional[str]:
         if self.recording.coredump is None:
@@ -193,6 +318,93 @@ class Job:
         shutil.rmtree(str(self.record_paths.perf_directory), ignore_errors=True)
 
 
+class ReportWorker:
+    """
+    Archives crash reports in background threads while recording continues
+    """
+
+    def __init__(
+        self,
+        max_pending: int = DEFAULT_MAX_PENDING,
+        threads: int = 2,
+        core_context: Optional[int] = None,
+        binary_store: Optional[BinaryStore] = None,
+        compressor: Optional[Any] = None,
+    ) -> None:
+        self.max_pending = max_pending
+        self.core_context = core_context
+        self.binary_store = binary_store
+        self.compressor = compressor
+        self.queue = Queue(maxsize=max_pending)  # type: Queue
+        self.threads = [
+            Thread(target=self.run, name="report-worker-%d" % i, daemon=True)
+            for i in range(threads)
+        ]
+
+    def __enter__(self) -> "ReportWorker":
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def __exit__(self, type: Any, value: Any, traceback: Any) -> None:
+        # finish all queued reports before we exit
+        for _ in self.threads:
+            self.queue.put(ExitEvent())
+        for thread in self.threads:
+            thread.join()
+
+    def submit(self, job: Job) -> bool:
+        try:
+            self.queue.put_nowait(job)
+            return True
+        except Full:
+            l.warning("%d reports pending, drop %s", self.max_pending, job.core_file())
+            job.remove()
+            return False
+
+    def report_archive(
+        self, record_paths: "RecordPaths", coredump: Dict[str, Any]
+    ) -> Path:
+        """
+        Where `store` will write the report of the process described by the
+        `coredump` section of a manifest
+        """
+        compressor = self.compressor or archive.compressor()
+        return record_paths.report_archive(
+            coredump["executable"],
+            coredump["time"],
+            coredump["global_pid"],
+            coredump.get("snapshot", False),
+            compressor.suffix,
+        )
+
+    def store(self, recording: Recording, record_paths: "RecordPaths") -> str:
+        return store_report(
+            recording,
+            record_paths,
+            self.core_context,
+            self.binary_store,
+            self.compressor,
+        )
+
+    def run(self) -> None:
+        while True:
+            job = self.queue.get()
+            if isinstance(job, ExitEvent):
+                return
+            try:
+                job.recording.report_path = self.store(job.recording, job.record_paths)
+            except Exception:
+                l.exception("failed to store report for %s", job.core_file())
+            finally:
+                job.remove()
+                if job.done is not None:
+                    try:
+                        job.done(job)
+                    except Exception:
+                        l.exception("failed to finish job for %s", job.core_file())
+
+
 class RecordPaths:
     def __init__(self, path: Path, log_path: Path, pid_file: Optional[str]) -> None:
         self.path = path
@@ -202,14 +414,25 @@ class RecordPaths:
         self.state_dir = self.path
         self.perf_directory = self.path.joinpath("traces")
         self.coredump = self.path.joinpath("core")
-
-        self.fifo = self.path.joinpath("fifo")
         self.manifest = self.path.joinpath("manifest.json")
+        # coredump_handler creates one directory per crash in here
+        self.spool_dir = self.path.joinpath("crashes")
 
-    def report_archive(self, executable: str, timestamp: str) -> Path:
-        return self.log_path.joinpath(
-            "%s-%s.tar.gz" % (os.path.basename(executable), timestamp)
-        )
+    def for_crash(self, coredump: Coredump) -> "RecordPaths":
+        return RecordPaths(coredump.path, self.log_path, None)
+
+    def report_archive(
+        self,
+        executable: str,
+        timestamp: str,
+        pid: int,
+        snapshot: bool = False,
+        suffix: str = ".tar.gz",
+    ) -> Path:
+        # several processes of the same executable may crash within one second
+        kind = "-snapshot" if snapshot else ""
+        name = "%s%s-%s-%d" % (os.path.basename(executable), kind, timestamp, pid)
+        return self.log_path.joinpath(name + suffix)
 
 
 def serialize_trace(trace: Trace, state_dir: Path) -> Dict[str, Any]:
@@ -239,88 +462,118 @@ def serialize_trace(trace: Trace, state_dir: Path) -> Dict[str, Any]:
         cpu_stepping=trace.cpu_stepping,
         cpuid_0x15_eax=trace.cpuid_0x15_eax,
         cpuid_0x15_ebx=trace.cpuid_0x15_ebx,
+        pt_config=trace.pt_config.to_dict(),
+        nom_freq=trace.nom_freq,
+        address_filters=[f.to_dict() for f in trace.address_filters],
+        cgroup=trace.cgroup,
+    )
+
+
+def mapped_binaries(manifest: Dict[str, Any], core_file: str) -> List[str]:
+    binaries = manifest["coredump"].get("mapped_binaries")
+    if binaries is not None:
+        return binaries
+    with CoreFile(decompress_core(core_file)) as core:
+        return [m.path for m in core.mappings if m.flags & PF_X]
+
+
+def minimize_report_core(
+    core_file: str, core_context: int, manifest: Dict[str, Any]
+) -> str:
+    full_core = decompress_core(core_file)
+    minimized = full_core + ".min"
+    try:
+        size, kept = minimize_core(full_core, minimized, core_context)
+    finally:
+        # minimizing needs random access, the decompressed copy of a zstd
+        # core is removed right away
+        if full_core != core_file:
+            os.unlink(full_core)
+    manifest["coredump"]["minimized"] = dict(
+        context_pages=core_context, size=size, kept=kept
     )
+    return minimized
 
 
-def store_report(recording: Recording, record_paths: "RecordPaths") -> str:
+def store_report(
+    recording: Recording,
+    record_paths: "RecordPaths",
+    core_context: Optional[int] = None,
+    binary_store: Optional[BinaryStore] = None,
+    compressor: Optional[Any] = None,
+) -> str:
+    """
+    With `core_context` the core is minimized, see `minimize.minimize_core`.
+    Binaries are not archived but added to `binary_store`, which defaults to
+    the store in the log directory.
+    """
+    if binary_store is None:
+        binary_store = BinaryStore(record_paths.log_path.joinpath(STORE_NAME))
+    if compressor is None:
+        compressor = archive.compressor()
     assert recording.coredump is not None
     core_file = recording.coredump.get()
     state_dir = record_paths.state_dir
     manifest_path = str(record_paths.manifest)
 
-    with NamedTemporaryFile() as template:
-
-        def append(path: str) -> None:
-            template.write(str(Path(path).relative_to(state_dir)).encode("utf-8"))
-            template.write(b"\0")
+    members = []  # type: List[str]
 
-        append(manifest_path)
+    def append(path: str) -> None:
+        members.append(str(Path(path).relative_to(state_dir)))
 
-        if Path(manifest_path).exists():
-            manifest = json.load(open(manifest_path))
-        else:
-            manifest = {}
+    append(manifest_path)
 
-        binaries = manifest["binaries"] = []
-
-        paths = set()
-        for obj in pwn_wrapper.Coredump(str(core_file)).mappings:
-            if (
-                (obj.flags & PROT_EXEC)
-                and obj.path.startswith("/")
-                and os.path.exists(obj.path)
-            ):
-                paths.add(obj.path)
+    if Path(manifest_path).exists():
+        manifest = json.load(open(manifest_path))
+    else:
+        manifest = {}
 
-        for path in paths:
-            # FIXME check if elf, only create parent directory once
-            archive_path = state_dir.joinpath("binaries", path[1:])
-            archive_path.parent.mkdir(parents=True, exist_ok=True)
+    binaries = manifest["binaries"] = []
+    blobs = manifest["blobs"] = {}
 
-            shutil.copyfile(path, str(archive_path))
+    paths = set()
+    for path in mapped_binaries(manifest, core_file):
+        if path.startswith("/") and os.path.exists(path):
+            paths.add(path)
 
-            binaries.append(str(archive_path.relative_to(state_dir)))
-            append(str(archive_path))
+    for path in paths:
+        binary_path = os.path.join("binaries", path[1:])
+        binaries.append(binary_path)
+        # replay.unpack links the blob to binary_path
+        blobs[binary_path] = binary_store.add(path)
 
-        if core_file is not None:
-            coredump = manifest["coredump"]
-            coredump["executable"] = os.path.join("binaries", coredump["executable"])
-            coredump["file"] = str(Path(core_file).relative_to(state_dir))
-            append(core_file)
+    if core_context is not None:
+        core_file = minimize_report_core(core_file, core_context, manifest)
 
-        trace = serialize_trace(recording.trace, state_dir)
+    coredump = manifest["coredump"]
+    coredump["executable"] = os.path.join("binaries", coredump["executable"])
+    coredump["file"] = str(Path(core_file).relative_to(state_dir))
+    append(core_file)
 
-        for cpu in trace["cpus"]:
-            append(str(state_dir.joinpath(cpu["event_path"])))
-            append(str(state_dir.joinpath(cpu["trace_path"])))
+    trace = serialize_trace(recording.trace, state_dir)
 
-        manifest["trace"] = trace
+    for cpu in trace["cpus"]:
+        append(str(state_dir.joinpath(cpu["event_path"])))
+        append(str(state_dir.joinpath(cpu["trace_path"])))
 
-        with open(manifest_path, "w") as manifest_file:
-            json.dump(manifest, manifest_file, indent=4)
+    manifest["trace"] = trace
 
-        template.flush()
+    with open(manifest_path, "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=4)
 
-        archive_path = record_paths.report_archive(
-            coredump["executable"], coredump["time"]
-        )
+    archive_path = record_paths.report_archive(
+        coredump["executable"],
+        coredump["time"],
+        coredump["global_pid"],
+        coredump.get("snapshot", False),
+        compressor.suffix,
+    )
 
-        l.info("creating archive %s", archive_path)
-        subprocess.check_call(
-            [
-                "tar",
-                "--null",
-                "-C",
-                str(record_paths.state_dir),
-                "-T",
-                str(template.name),
-                "-czf",
-                str(archive_path),
-            ]
-        )
-        l.info("built archive %s", archive_path)
-        os.unlink(manifest_path)
-        return str(archive_path)
+    l.info("creating archive %s", archive_path)
+    archive.write_archive(archive_path, state_dir, members, compressor)
+    l.info("built archive %s", archive_path)
+    os.unlink(manifest_path)
+    return str(archive_path)
 
 
 def record(
@@ -335,23 +588,35 @@ def record(
     working_directory: Optional[Path] = None,
     timeout: Optional[int] = None,
     extra_env: Optional[Dict[str, str]] = None,
+    pt_config: Optional[PtConfig] = None,
+    ip_filter: Optional[List[str]] = None,
+    max_pending: int = DEFAULT_MAX_PENDING,
+    core_context: Optional[int] = None,
+    compressor: Optional[Any] = None,
 ) -> Optional[Recording]:
     try:
         record_paths = RecordPaths(record_path, log_path, pid_file)
-        recording = _record(
-            record_paths,
-            target,
-            stdin=stdin,
-            stdout=stdout,
-            stderr=stderr,
-            working_directory=working_directory,
-            timeout=timeout,
-            extra_env=extra_env,
+        worker = ReportWorker(
+            max_pending,
+            core_context=core_context,
+            binary_store=BinaryStore(log_path.joinpath(STORE_NAME)),
+            compressor=compressor,
         )
-        if recording.coredump is None:
-            return recording
-        recording.report_path = store_report(recording, record_paths)
-
+        with worker:
+            recording = _record(
+                record_paths,
+                worker,
+                target,
+                stdin=stdin,
+                stdout=stdout,
+                stderr=stderr,
+                working_directory=working_directory,
+                timeout=timeout,
+                extra_env=extra_env,
+                pt_config=pt_config,
+                ip_filter=ip_filter,
+            )
+        # the worker has stored all reports once it exited
         return recording
     except KeyboardInterrupt:
         pass
@@ -361,6 +626,63 @@ def record(
     return None
 
 
+def flight_record_command(
+    args: argparse.Namespace, record_path: Path, log_path: Path
+) -> None:
+    from .flight_recorder import SnapshotLimits, flight_record
+
+    record_paths = RecordPaths(record_path, log_path, args.pid_file)
+    limits = SnapshotLimits(args.min_snapshot_interval, args.max_snapshots)
+    try:
+        worker = ReportWorker(
+            args.max_pending_reports,
+            core_context=args.core_context,
+            binary_store=BinaryStore(log_path.joinpath(STORE_NAME)),
+            compressor=archive.compressor(args.archive_format, args.archive_level),
+        )
+        with worker:
+            flight_record(
+                record_paths,
+                worker,
+                args.args,
+                limits,
+                interval=args.snapshot_interval,
+                control_socket=args.control_socket,
+                pt_config=pt_profile(args.pt_profile),
+                ip_filter=args.ip_filter,
+            )
+    except KeyboardInterrupt:
+        l.info("execution was interrupted by user")
+
+
+def supervise_command(
+    args: argparse.Namespace, record_path: Path, log_path: Path
+) -> None:
+    from .supervisor import supervise
+
+    if args.ip_filter:
+        # supervised processes run different executables and share one set
+        # of trace buffers
+        raise HaseError("--ip-filter cannot be combined with --pid or --cgroup")
+
+    record_paths = RecordPaths(record_path, log_path, args.pid_file)
+    worker = ReportWorker(
+        args.max_pending_reports,
+        core_context=args.core_context,
+        binary_store=BinaryStore(log_path.joinpath(STORE_NAME)),
+        compressor=archive.compressor(args.archive_format, args.archive_level),
+    )
+    with worker:
+        supervise(
+            record_paths,
+            worker,
+            args.pids,
+            cgroup_path=args.cgroup,
+            control_socket=args.control_socket,
+            pt_config=pt_profile(args.pt_profile),
+        )
+
+
 def record_command(args: argparse.Namespace) -> None:
 
     log_path = Path(args.log_dir)
@@ -371,13 +693,23 @@ def record_command(args: argparse.Namespace) -> None:
     command = args.args
 
     with TemporaryDirectory() as tempdir:
-        record(
-            target=command,
-            record_path=Path(tempdir),
-            log_path=log_path,
-            pid_file=args.pid_file,
-            limit=args.limit,
-        )
+        if args.flight_recorder:
+            flight_record_command(args, Path(tempdir), log_path)
+        elif args.pids or args.cgroup is not None:
+            supervise_command(args, Path(tempdir), log_path)
+        else:
+            record(
+                target=command,
+                record_path=Path(tempdir),
+                log_path=log_path,
+                pid_file=args.pid_file,
+                limit=args.limit,
+                pt_config=pt_profile(args.pt_profile),
+                ip_filter=args.ip_filter,
+                max_pending=args.max_pending_reports,
+                core_context=args.core_context,
+                compressor=archive.compressor(args.archive_format, args.archive_level),
+            )
 
     if args.rusage_file is not None:
         usage = tuple(resource.getrusage(resource.RUSAGE_CHILDREN))
@@ -0,0 +1,54 @@
+import logging
+import os
+import socket
+from typing import Any, Callable, Optional
+
+from .event_loop import EventLoop
+
+l = logging.getLogger(__name__)
+
+
+class ControlSocket:
+    """
+    Unix socket accepting one line commands. `handler` gets the command and
+    returns the reply.
+    """
+
+    def __init__(self, path: str, loop: EventLoop, handler: Callable[[str], str]):
+        self.path = path
+        self.loop = loop
+        self.handler = handler
+        self._socket = None  # type: Optional[socket.socket]
+
+    def __enter__(self) -> "ControlSocket":
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.bind(self.path)
+        self._socket.listen(5)
+        self._socket.setblocking(False)
+        self.loop.add_reader(self._socket.fileno(), self.accept)
+        return self
+
+    def __exit__(self, type: Any, value: Any, traceback: Any) -> None:
+        if self._socket is not None:
+            self.loop.remove_reader(self._socket.fileno())
+            self._socket.close()
+            self._socket = None
+            os.unlink(self.path)
+
+    def accept(self) -> None:
+        assert self._socket is not None
+        while True:
+            try:
+                conn, _ = self._socket.accept()
+            except BlockingIOError:
+                return
+            with conn:
+                conn.settimeout(1)
+                try:
+                    command = conn.recv(128).decode("utf-8", "replace").strip()
+                    reply = self.handler(command)
+                    conn.sendall((reply + "\n").encode("utf-8"))
+                except OSError as e:
+                    l.warning("control socket: %s", e)
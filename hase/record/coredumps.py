@@ -1,15 +1,25 @@
+import json
 import logging
 import os
 import resource
+import shutil
 import sys
+import time
 
 # TODO python3
 from pipes import quote
 from tempfile import NamedTemporaryFile
-from typing import Any, Optional, Tuple
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 from ..path import which
-from .coredump_handler import EXTRA_CORE_DUMP_PARAMETER, RECV_MESSAGE
+from ..coredump_handler import (
+    CORE_NAME,
+    EXTRA_CORE_DUMP_PARAMETER,
+    INCOMING_PREFIX,
+    MANIFEST_NAME,
+    notify_path,
+)
 
 l = logging.getLogger(__name__)
 
@@ -34,45 +44,125 @@ COREDUMP_FILTER_PATH = "/proc/self/coredump_filter"
 #        Dump shared DAX pages.
 
 
-class Coredump:
-    def __init__(self, core_file: str, result_path: str) -> None:
-        self.core_file = core_file
-        self.result_path = result_path
+class RecordedCore:
+    """
+    Core file of a recording, which is removed once the report is stored
+    """
 
     def get(self) -> str:
-        l.info("check for result %s", self.result_path)
-        self.result_file = open(self.result_path)
-        msg = self.result_file.read(len(RECV_MESSAGE))
-        assert msg == RECV_MESSAGE, "got '%s' from fifo, expected: '%s'" % (
-            msg,
-            RECV_MESSAGE,
-        )
-        return self.core_file
+        raise NotImplementedError()
+
+    def remove(self) -> None:
+        raise NotImplementedError()
+
+
+class Coredump(RecordedCore):
+    """
+    A crash collected by coredump_handler into its own directory
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.manifest = path.joinpath(MANIFEST_NAME)
+
+    def get(self) -> str:
+        # the core might be compressed, coredump_handler records the file name
+        name = self.metadata().get("file", CORE_NAME)
+        return str(self.path.joinpath(name))
+
+    def metadata(self) -> Dict[str, Any]:
+        with open(str(self.manifest)) as f:
+            return json.load(f)["coredump"]
+
+    @property
+    def pid(self) -> int:
+        return self.metadata()["global_pid"]
 
     def remove(self) -> None:
-        os.unlink(self.core_file)
-        if self.result_file is not None:
-            self.result_file.close()
-        os.unlink(self.result_path)
+        shutil.rmtree(str(self.path), ignore_errors=True)
+
+    def __repr__(self) -> str:
+        return "<Coredump %s>" % self.path
+
+
+class CoredumpQueue:
+    def __init__(self, spool_dir: Path, notify_fd: Optional[int] = None) -> None:
+        self.spool_dir = spool_dir
+        self.notify_fd = notify_fd
+        self._seen = set()  # type: Set[str]
+
+    def fileno(self) -> int:
+        """
+        Readable once coredump_handler completed a crash, see `drain`
+        """
+        assert self.notify_fd is not None
+        return self.notify_fd
+
+    def drain(self) -> None:
+        assert self.notify_fd is not None
+        while True:
+            try:
+                if not os.read(self.notify_fd, 4096):
+                    return
+            except BlockingIOError:
+                return
+
+    def ready(self) -> List[Coredump]:
+        """
+        Returns crashes completely written since the last call, oldest first
+        """
+        names = sorted(
+            name
+            for name in os.listdir(str(self.spool_dir))
+            if not name.startswith(INCOMING_PREFIX) and name not in self._seen
+        )
+        self._seen.update(names)
+        return [Coredump(self.spool_dir.joinpath(name)) for name in names]
+
+    def pending(self) -> int:
+        """
+        Number of crashes still being written by coredump_handler
+        """
+        return sum(
+            1
+            for name in os.listdir(str(self.spool_dir))
+            if name.startswith(INCOMING_PREFIX)
+        )
+
+    def wait(self, timeout: float = 30.0) -> List[Coredump]:
+        """
+        Wait until coredump_handler finished writing all pending crashes
+        """
+        deadline = time.time() + timeout
+        while self.pending() > 0 and time.time() < deadline:
+            time.sleep(0.05)
+        return self.ready()
 
 
 class Handler:
     def __init__(
         self,
-        core_file: str,
-        fifo_path: str,
-        manifest_path: str,
+        spool_dir: str,
+        max_pending: int = 16,
         log_path: str = "/tmp/coredump.log",
     ) -> None:
         self.previous_pattern = None  # type: Optional[str]
         self.old_core_rlimit = None  # type: Optional[Tuple[int, int]]
         self.handler_script = None  # type: Optional[Any]
-        self.core_file = core_file
-        self.fifo_path = fifo_path
-        self.manifest_path = manifest_path
+        self.notify_fd = None  # type: Optional[int]
+        self.spool_dir = spool_dir
+        self.max_pending = max_pending
         self.log_path = log_path
 
-    def __enter__(self) -> Coredump:
+    def __enter__(self) -> CoredumpQueue:
+        os.makedirs(self.spool_dir, exist_ok=True)
+        fifo = notify_path(self.spool_dir)
+        if os.path.exists(fifo):
+            os.unlink(fifo)
+        os.mkfifo(fifo, 0o600)
+        # opened read-write, so that we never see EOF between two crashes
+        self.notify_fd = os.open(fifo, os.O_RDWR | os.O_NONBLOCK)
+
         kill_command = which("kill")
         assert kill_command is not None
 
@@ -90,7 +180,7 @@ exec 2>&1
 
 export PYTHONPATH={pythonpath}
 
-exec {python} -m hase.record.coredump_handler {fifo_path} {core_file} {manifest_path} "$@"
+exec {python} -m hase.coredump_handler {spool_dir} {max_pending} "$@"
 """
 
         script_content = script_template.format(
@@ -98,10 +188,9 @@ exec {python} -m hase.record.coredump_handler {fifo_path} {core_file} {manifest_
             pid=os.getpid(),
             python=quote(sys.executable),
             pythonpath=":".join(sys.path),
-            fifo_path=quote(self.fifo_path),
-            core_file=quote(self.core_file),
+            spool_dir=quote(self.spool_dir),
+            max_pending=self.max_pending,
             log_path=quote(self.log_path),
-            manifest_path=quote(self.manifest_path),
         )
 
         self.handler_script.write(script_content)
@@ -123,7 +212,7 @@ exec {python} -m hase.record.coredump_handler {fifo_path} {core_file} {manifest_
             filter_file.write("0xff\n")
             filter_file.flush()
 
-            return Coredump(self.core_file, self.fifo_path)
+            return CoredumpQueue(Path(self.spool_dir), self.notify_fd)
 
     def __exit__(self, exc_type: Any, exc_value: Any, traceback: Any) -> None:
         assert self.previous_pattern is not None
@@ -133,3 +222,7 @@ exec {python} -m hase.record.coredump_handler {fifo_path} {core_file} {manifest_
             resource.setrlimit(resource.RLIMIT_CORE, self.old_core_rlimit)
         if self.handler_script is not None:
             os.unlink(self.handler_script.name)
+        if self.notify_fd is not None:
+            os.close(self.notify_fd)
+            os.unlink(notify_path(self.spool_dir))
+            self.notify_fd = None
@@ -0,0 +1,190 @@
+import ctypes as ct
+import errno
+import heapq
+import logging
+import os
+import selectors
+import signal
+import time
+from types import FrameType
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .ptrace import libc
+from .signal_handler import SignalHandler
+
+l = logging.getLogger(__name__)
+
+# x86_64, os.pidfd_open is only available since python 3.9
+SYS_PIDFD_OPEN = 434
+
+# processes are polled at this interval if the kernel has no pidfds (< 5.3)
+POLL_INTERVAL = 0.1
+
+Callback = Callable[[], None]
+
+
+def pidfd_open(pid: int) -> Optional[int]:
+    """
+    Returns a file descriptor that becomes readable once `pid` exits, or None
+    if pidfds are not supported
+    """
+    if hasattr(os, "pidfd_open"):
+        try:
+            return os.pidfd_open(pid)  # type: ignore
+        except OSError as e:
+            if e.errno == errno.ENOSYS:
+                return None
+            raise
+    fd = libc.syscall(SYS_PIDFD_OPEN, pid, 0)
+    if fd >= 0:
+        return fd
+    err = ct.get_errno()
+    if err == errno.ENOSYS:
+        return None
+    raise OSError(err, os.strerror(err))
+
+
+def process_exited(pid: int) -> bool:
+    try:
+        # does not reap children, so wait4 still gets the exit status
+        options = os.WEXITED | os.WNOHANG | os.WNOWAIT
+        return os.waitid(os.P_PID, pid, options) is not None
+    except ChildProcessError:
+        pass
+    try:
+        os.kill(pid, 0)
+        return False
+    except ProcessLookupError:
+        return True
+
+
+class EventLoop:
+    """
+    Runs callbacks when file descriptors become readable, signals arrive,
+    watched processes exit or timers expire. Signals are delivered through
+    `signal.set_wakeup_fd`, so callbacks never run in signal handler context.
+    """
+
+    def __init__(self) -> None:
+        self.selector = selectors.DefaultSelector()
+        # deadline, sequence number, callback
+        self._timers = []  # type: List[Tuple[float, int, Callback]]
+        self._sequence = 0
+        self._signals = {}  # type: Dict[int, List[Callback]]
+        self._signal_handlers = []  # type: List[SignalHandler]
+        self._pidfds = {}  # type: Dict[int, int]
+        self._wakeup = None  # type: Optional[Tuple[int, int]]
+        self._old_wakeup_fd = -1
+        self._stopped = False
+
+    def __enter__(self) -> "EventLoop":
+        read_fd, write_fd = os.pipe()
+        os.set_blocking(read_fd, False)
+        os.set_blocking(write_fd, False)
+        self._wakeup = (read_fd, write_fd)
+        self._old_wakeup_fd = signal.set_wakeup_fd(write_fd)
+        self.add_reader(read_fd, self._dispatch_signals)
+        return self
+
+    def __exit__(self, type: Any, value: Any, traceback: Any) -> None:
+        for handler in reversed(self._signal_handlers):
+            handler.__exit__(type, value, traceback)
+        signal.set_wakeup_fd(self._old_wakeup_fd)
+        for pidfd in list(self._pidfds.values()):
+            self.remove_reader(pidfd)
+            os.close(pidfd)
+        self._pidfds.clear()
+        if self._wakeup is not None:
+            self.remove_reader(self._wakeup[0])
+            os.close(self._wakeup[0])
+            os.close(self._wakeup[1])
+            self._wakeup = None
+        self.selector.close()
+
+    def add_reader(self, fd: int, callback: Callback) -> None:
+        self.selector.register(fd, selectors.EVENT_READ, callback)
+
+    def remove_reader(self, fd: int) -> None:
+        self.selector.unregister(fd)
+
+    def call_later(self, delay: float, callback: Callback) -> None:
+        self._sequence += 1
+        deadline = time.monotonic() + delay
+        heapq.heappush(self._timers, (deadline, self._sequence, callback))
+
+    def add_signal_handler(self, signum: int, callback: Callback) -> None:
+        if signum not in self._signals:
+            self._signals[signum] = []
+            handler = SignalHandler(signum, self._received_signal)
+            handler.__enter__()
+            self._signal_handlers.append(handler)
+        self._signals[signum].append(callback)
+
+    def _received_signal(self, signum: int, frame_type: FrameType) -> None:
+        # the signal number is written to the wakeup fd by the interpreter
+        pass
+
+    def _dispatch_signals(self) -> None:
+        assert self._wakeup is not None
+        try:
+            data = os.read(self._wakeup[0], 4096)
+        except BlockingIOError:
+            return
+        # the same signal might be pending several times
+        for signum in sorted(set(data)):
+            for callback in self._signals.get(signum, []):
+                callback()
+
+    def watch_process(self, pid: int, callback: Callback) -> None:
+        """
+        Call `callback` once when `pid` exited. Children are not reaped.
+        """
+        try:
+            pidfd = pidfd_open(pid)
+        except ProcessLookupError:
+            self.call_later(0, callback)
+            return
+        if pidfd is None:
+            self._poll_process(pid, callback)
+            return
+
+        def exited() -> None:
+            self.remove_reader(pidfd)
+            os.close(pidfd)
+            del self._pidfds[pid]
+            callback()
+
+        self._pidfds[pid] = pidfd
+        self.add_reader(pidfd, exited)
+
+    def _poll_process(self, pid: int, callback: Callback) -> None:
+        if process_exited(pid):
+            callback()
+        else:
+            self.call_later(POLL_INTERVAL, lambda: self._poll_process(pid, callback))
+
+    def stop(self) -> None:
+        self._stopped = True
+
+    def _timeout(self) -> Optional[float]:
+        if len(self._timers) == 0:
+            return None
+        return max(self._timers[0][0] - time.monotonic(), 0)
+
+    def _run_timers(self) -> None:
+        now = time.monotonic()
+        while self._timers and self._timers[0][0] <= now and not self._stopped:
+            _, _, callback = heapq.heappop(self._timers)
+            callback()
+
+    def run(self) -> None:
+        """
+        Process events until `stop` is called
+        """
+        self._stopped = False
+        while not self._stopped:
+            for key, _ in self.selector.select(self._timeout()):
+                key.data()
+                if self._stopped:
+                    return
+            self._run_timers()
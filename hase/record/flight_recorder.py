@@ -0,0 +1,257 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from signal import SIGUSR1
+from typing import Any, Dict, List, Optional, Union
+
+from .. import timestamp
+from ..errors import HaseError
+from ..archive import is_archive
+from ..perf.pt_config import PtConfig
+from . import (
+    RecordPaths,
+    RecordProcess,
+    Job,
+    Recording,
+    ReportWorker,
+    build_address_filters,
+    check_features,
+    spawn,
+    target_executable,
+)
+from .control_socket import ControlSocket
+from .coredumps import RecordedCore
+from .event_loop import EventLoop
+from .live_core import PF_X, dump_core, frozen, read_mappings
+from .ptrace import ptrace_detach
+
+l = logging.getLogger(__name__)
+
+SNAPSHOT_COMMAND = "snapshot"
+
+
+class LiveCoredump(RecordedCore):
+    """
+    Same interface as `coredumps.Coredump` for cores written by `live_core`
+    """
+
+    def __init__(self, core_file: str) -> None:
+        self.core_file = core_file
+
+    def get(self) -> str:
+        return self.core_file
+
+    def remove(self) -> None:
+        os.unlink(self.core_file)
+
+
+class SnapshotLimits:
+    def __init__(self, min_interval: float = 10.0, max_snapshots: int = 10) -> None:
+        # minimum number of seconds between two snapshots
+        self.min_interval = min_interval
+        # older snapshot archives are deleted once this number is exceeded
+        self.max_snapshots = max_snapshots
+
+
+def live_manifest(pid: int) -> Dict[str, Any]:
+    # mirrors the metadata coredump_handler gets from the kernel
+    stat = os.stat("/proc/%d" % pid)
+    executable = os.readlink("/proc/%d/exe" % pid)
+    binaries = set(
+        m.path for m in read_mappings(pid) if m.flags & PF_X and m.path.startswith("/")
+    )
+    coredump = dict(
+        executable=executable[1:],
+        uid=stat.st_uid,
+        gid=stat.st_gid,
+        containerized_tid=pid,
+        global_tid=pid,
+        containerized_pid=pid,
+        global_pid=pid,
+        signal=0,
+        time=timestamp.now(),
+        snapshot=True,
+        mapped_binaries=sorted(binaries),
+    )
+    return dict(coredump=coredump)
+
+
+class FlightRecorder:
+    """
+    Takes snapshots of the trace buffers and a live core of the traced
+    process without stopping the recording. Snapshots are triggered by
+    SIGUSR1, by writing `snapshot` to the control socket or periodically.
+    """
+
+    def __init__(
+        self,
+        record: RecordProcess,
+        worker: ReportWorker,
+        pid: int,
+        record_paths: RecordPaths,
+        limits: SnapshotLimits,
+        loop: EventLoop,
+        interval: Optional[float] = None,
+        control_socket: Optional[str] = None,
+    ) -> None:
+        self.record = record
+        self.worker = worker
+        self.pid = pid
+        self.record_paths = record_paths
+        self.limits = limits
+        self.loop = loop
+        self.interval = interval
+        self.control_socket = control_socket
+
+        self._control = None  # type: Optional[ControlSocket]
+        self._last_snapshot = None  # type: Optional[float]
+
+    def __enter__(self) -> "FlightRecorder":
+        self.loop.add_signal_handler(SIGUSR1, self.received_signal)
+        if self.interval is not None:
+            self.loop.call_later(self.interval, self.timer_expired)
+        if self.control_socket is not None:
+            self._control = ControlSocket(self.control_socket, self.loop, self.command)
+            self._control.__enter__()
+        return self
+
+    def __exit__(self, type: Any, value: Any, traceback: Any) -> None:
+        if self._control is not None:
+            self._control.__exit__(type, value, traceback)
+
+    def received_signal(self) -> None:
+        self.snapshot("signal")
+
+    def timer_expired(self) -> None:
+        assert self.interval is not None
+        self.loop.call_later(self.interval, self.timer_expired)
+        self.snapshot("timer")
+
+    def command(self, command: str) -> str:
+        if command != SNAPSHOT_COMMAND:
+            return "error unknown command '%s'" % command
+        archive = self.snapshot("socket")
+        if archive is None:
+            return "skipped"
+        return "ok %s" % archive
+
+    def rate_limited(self, now: float) -> bool:
+        return (
+            self._last_snapshot is not None
+            and now - self._last_snapshot < self.limits.min_interval
+        )
+
+    def snapshot(self, reason: str) -> Optional[str]:
+        if self.record.got_coredump:
+            # the process is dying, the crash report supersedes snapshots
+            l.info("snapshot (%s) skipped: process crashed", reason)
+            return None
+        now = time.time()
+        if self.rate_limited(now):
+            l.info("snapshot (%s) skipped: rate limited", reason)
+            return None
+        self._last_snapshot = now
+
+        # snapshots are archived in the background, each needs its own directory
+        self.record_paths.path.mkdir(parents=True, exist_ok=True)
+        directory = tempfile.mkdtemp(
+            prefix="snapshot-", dir=str(self.record_paths.path)
+        )
+        paths = RecordPaths(Path(directory), self.record_paths.log_path, None)
+        try:
+            core_file = str(paths.coredump)
+            with frozen(self.pid) as registers:
+                trace = self.record.snapshot(paths.perf_directory)
+                dump_core(self.pid, core_file, registers)
+                manifest = live_manifest(self.pid)
+            with open(str(paths.manifest), "w") as f:
+                json.dump(manifest, f, indent=4, sort_keys=True)
+        except (OSError, HaseError) as e:
+            shutil.rmtree(directory, ignore_errors=True)
+            l.warning("snapshot (%s) failed: %s", reason, e)
+            return None
+
+        archive = self.worker.report_archive(paths, manifest["coredump"])
+        recording = Recording(LiveCoredump(core_file), trace, 0)
+        if not self.worker.submit(Job(recording, paths, done=self.stored)):
+            shutil.rmtree(directory, ignore_errors=True)
+            return None
+        l.info("snapshot (%s) queued for %s", reason, archive)
+        return str(archive)
+
+    def stored(self, job: Job) -> None:
+        # runs in the worker thread
+        shutil.rmtree(str(job.record_paths.path), ignore_errors=True)
+        self.prune()
+
+    def prune(self) -> None:
+        # only snapshots of our process, other recorders may share the log directory
+        pattern = "*-snapshot-*-%d.*" % self.pid
+        archives = []
+        for p in self.record_paths.log_path.glob(pattern):
+            try:
+                if is_archive(p):
+                    archives.append((p.stat().st_mtime, p))
+            except OSError:
+                # removed by a concurrent prune
+                pass
+        archives.sort()
+        excess = len(archives) - self.limits.max_snapshots
+        for _, archive in archives[: max(excess, 0)]:
+            l.info("remove old snapshot %s", archive)
+            try:
+                archive.unlink()
+            except OSError:
+                pass
+
+
+def flight_record(
+    record_paths: RecordPaths,
+    worker: ReportWorker,
+    target: Union[List[str], int],
+    limits: SnapshotLimits,
+    interval: Optional[float] = None,
+    control_socket: Optional[str] = None,
+    pt_config: Optional[PtConfig] = None,
+    ip_filter: Optional[List[str]] = None,
+) -> Recording:
+    """
+    Like `record` but keeps tracing until the process exits and takes
+    snapshots on demand.
+    """
+    address_filters = build_address_filters(
+        ip_filter or [], target_executable(target), check_features()
+    )
+    if isinstance(target, list):
+        pid = spawn(target)
+        is_child = True
+    else:
+        pid = target
+        is_child = False
+
+    exit_code = 0
+    rusage = None
+    with EventLoop() as loop:
+        record = RecordProcess(
+            pid, record_paths, worker, loop, pt_config, address_filters
+        )
+        recorder = FlightRecorder(
+            record, worker, pid, record_paths, limits, loop, interval, control_socket
+        )
+        with record, recorder:
+            loop.watch_process(pid, loop.stop)
+            if is_child:
+                ptrace_detach(pid)
+            print("flight recorder started")
+            try:
+                loop.run()
+            except KeyboardInterrupt:
+                pass
+            else:
+                if is_child:
+                    _, exit_code, rusage = os.wait4(pid, 0)
+            return record.result(exit_code, rusage)
@@ -0,0 +1,319 @@
+import ctypes as ct
+import errno
+import logging
+import os
+import struct
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import IO, Dict, Generator, List
+
+from ..errors import HaseError
+
+l = logging.getLogger(__name__)
+
+libc = ct.CDLL("libc.so.6", use_errno=True)
+libc.ptrace.restype = ct.c_long
+libc.ptrace.argtypes = [ct.c_long, ct.c_long, ct.c_void_p, ct.c_void_p]
+
+PTRACE_GETREGS = 12
+PTRACE_DETACH = 17
+PTRACE_SEIZE = 0x4206
+PTRACE_INTERRUPT = 0x4207
+WALL = 0x40000000
+
+ET_CORE = 4
+EM_X86_64 = 62
+PT_LOAD = 1
+PT_NOTE = 4
+PF_X = 1
+PF_W = 2
+PF_R = 4
+
+NT_PRSTATUS = 1
+NT_PRPSINFO = 3
+NT_AUXV = 6
+NT_FILE = 0x46494C45
+
+PAGE_SIZE = 4096
+
+ELF_HEADER = struct.Struct("<16sHHIQQQIHHHHHH")
+PROGRAM_HEADER = struct.Struct("<IIQQQQQQ")
+# si_signo, si_code, si_errno, pr_cursig, pr_sigpend, pr_sighold,
+# pr_pid, pr_ppid, pr_pgrp, pr_sid, 4 x struct timeval
+PRSTATUS_HEADER = struct.Struct("<iiih2xQQiiii64x")
+# pr_state, pr_sname, pr_zomb, pr_nice, pr_flag, pr_uid, pr_gid,
+# pr_pid, pr_ppid, pr_pgrp, pr_sid, pr_fname, pr_psargs
+PRPSINFO = struct.Struct("<bcbb4xQIIiiii16s80s")
+
+
+class user_regs_struct(ct.Structure):
+    _fields_ = [
+        (name, ct.c_ulonglong)
+        for name in [
+            "r15",
+            "r14",
+            "r13",
+            "r12",
+            "rbp",
+            "rbx",
+            "r11",
+            "r10",
+            "r9",
+            "r8",
+            "rax",
+            "rcx",
+            "rdx",
+            "rsi",
+            "rdi",
+            "orig_rax",
+            "rip",
+            "cs",
+            "eflags",
+            "rsp",
+            "ss",
+            "fs_base",
+            "gs_base",
+            "ds",
+            "es",
+            "fs",
+            "gs",
+        ]
+    ]
+
+
+class Mapping:
+    def __init__(
+        self, start: int, stop: int, flags: int, offset: int, path: str
+    ) -> None:
+        self.start = start
+        self.stop = stop
+        self.flags = flags
+        self.offset = offset
+        self.path = path
+
+
+def _ptrace(request: int, pid: int, addr: int, data: int) -> int:
+    res = libc.ptrace(request, pid, addr, data)
+    if res == -1:
+        err = ct.get_errno()
+        raise OSError(err, "ptrace(%d, %d): %s" % (request, pid, os.strerror(err)))
+    return res
+
+
+def threads(pid: int) -> List[int]:
+    tids = [int(tid) for tid in os.listdir("/proc/%d/task" % pid)]
+    # main thread first, the kernel does the same for the crashing thread
+    tids.sort(key=lambda tid: (tid != pid, tid))
+    return tids
+
+
+@contextmanager
+def frozen(pid: int) -> Generator[Dict[int, bytes], None, None]:
+    """
+    Stop all threads of `pid` and yield their general purpose registers.
+    Threads are resumed when the context is left.
+    """
+    attached = []  # type: List[int]
+    registers = OrderedDict()  # type: Dict[int, bytes]
+    try:
+        for tid in threads(pid):
+            try:
+                _ptrace(PTRACE_SEIZE, tid, 0, 0)
+            except OSError as e:
+                # thread exited in the meantime
+                if e.errno == errno.ESRCH:
+                    continue
+                raise
+            attached.append(tid)
+            _ptrace(PTRACE_INTERRUPT, tid, 0, 0)
+            os.waitpid(tid, WALL)
+            regs = user_regs_struct()
+            _ptrace(PTRACE_GETREGS, tid, 0, ct.addressof(regs))
+            registers[tid] = bytes(regs)
+        if len(registers) == 0:
+            raise HaseError("process %d has no threads left" % pid)
+        yield registers
+    finally:
+        for tid in attached:
+            try:
+                _ptrace(PTRACE_DETACH, tid, 0, 0)
+            except OSError:
+                l.warning("failed to detach from thread %d", tid)
+
+
+def read_mappings(pid: int) -> List[Mapping]:
+    mappings = []
+    with open("/proc/%d/maps" % pid) as f:
+        for line in f:
+            fields = line.split(None, 5)
+            start, stop = (int(v, 16) for v in fields[0].split("-"))
+            perms = fields[1]
+            flags = 0
+            if perms[0] == "r":
+                flags |= PF_R
+            if perms[1] == "w":
+                flags |= PF_W
+            if perms[2] == "x":
+                flags |= PF_X
+            path = fields[5].strip() if len(fields) > 5 else ""
+            mappings.append(Mapping(start, stop, flags, int(fields[2], 16), path))
+    return mappings
+
+
+def _note(name: bytes, note_type: int, desc: bytes) -> bytes:
+    name += b"\0"
+
+    def pad(data: bytes) -> bytes:
+        return data + b"\0" * (-len(data) % 4)
+
+    header = struct.pack("<III", len(name), len(desc), note_type)
+    return header + pad(name) + pad(desc)
+
+
+def _proc_status(pid: int) -> Dict[str, str]:
+    status = {}
+    with open("/proc/%d/status" % pid) as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            status[key] = value.strip()
+    return status
+
+
+def _prstatus(pid: int, tid: int, regs: bytes) -> bytes:
+    status = _proc_status(pid)
+    ppid = int(status.get("PPid", "0"))
+    header = PRSTATUS_HEADER.pack(
+        0, 0, 0, 0, 0, 0, tid, ppid, os.getpgid(pid), os.getsid(pid)
+    )
+    return header + regs + struct.pack("<i4x", 0)
+
+
+def _prpsinfo(pid: int) -> bytes:
+    status = _proc_status(pid)
+    with open("/proc/%d/cmdline" % pid, "rb") as f:
+        psargs = f.read().replace(b"\0", b" ").strip()
+    uid = int(status["Uid"].split()[0])
+    gid = int(status["Gid"].split()[0])
+    return PRPSINFO.pack(
+        0,
+        b"R",
+        0,
+        0,
+        0,
+        uid,
+        gid,
+        pid,
+        int(status.get("PPid", "0")),
+        os.getpgid(pid),
+        os.getsid(pid),
+        status["Name"].encode("utf-8")[:15],
+        psargs[:79],
+    )
+
+
+def _file_note(mappings: List[Mapping]) -> bytes:
+    files = [m for m in mappings if m.path.startswith("/")]
+    desc = struct.pack("<QQ", len(files), PAGE_SIZE)
+    for m in files:
+        desc += struct.pack("<QQQ", m.start, m.stop, m.offset // PAGE_SIZE)
+    for m in files:
+        desc += m.path.encode("utf-8") + b"\0"
+    return desc
+
+
+def _copy_memory(mem: IO[bytes], core: IO[bytes], mapping: Mapping) -> int:
+    """
+    Returns the number of bytes that could be copied
+    """
+    if not mapping.flags & PF_R:
+        return 0
+    size = mapping.stop - mapping.start
+    chunk_size = 1024 * 1024
+    copied = 0
+    try:
+        mem.seek(mapping.start)
+        while copied < size:
+            data = mem.read(min(chunk_size, size - copied))
+            if not data:
+                break
+            core.write(data)
+            copied += len(data)
+    except OSError:
+        # e.g. [vvar] or [vsyscall] are not readable via /proc/pid/mem
+        pass
+    return copied
+
+
+def write_core(pid: int, path: str) -> None:
+    with frozen(pid) as registers:
+        dump_core(pid, path, registers)
+
+
+def dump_core(pid: int, path: str, registers: Dict[int, bytes]) -> None:
+    """
+    Write an ELF core file of a process stopped by `frozen()`.
+    The layout mirrors what the kernel produces (see fs/binfmt_elf.c), so that
+    replay can handle crash cores and live cores the same way.
+    """
+    mappings = read_mappings(pid)
+
+    notes = b""
+    for tid, regs in registers.items():
+        notes += _note(b"CORE", NT_PRSTATUS, _prstatus(pid, tid, regs))
+        if tid == pid:
+            notes += _note(b"CORE", NT_PRPSINFO, _prpsinfo(pid))
+            with open("/proc/%d/auxv" % pid, "rb") as auxv:
+                notes += _note(b"CORE", NT_AUXV, auxv.read())
+            notes += _note(b"CORE", NT_FILE, _file_note(mappings))
+
+    phnum = len(mappings) + 1
+    notes_offset = ELF_HEADER.size + phnum * PROGRAM_HEADER.size
+    data_offset = notes_offset + len(notes)
+    data_offset += -data_offset % PAGE_SIZE
+
+    program_headers = [
+        PROGRAM_HEADER.pack(PT_NOTE, 0, notes_offset, 0, 0, len(notes), 0, 0)
+    ]
+
+    with open(path, "wb") as core, open("/proc/%d/mem" % pid, "rb", 0) as mem:
+        core.seek(notes_offset)
+        core.write(notes)
+        offset = data_offset
+        for m in mappings:
+            core.seek(offset)
+            size = _copy_memory(mem, core, m)
+            program_headers.append(
+                PROGRAM_HEADER.pack(
+                    PT_LOAD,
+                    m.flags,
+                    offset,
+                    m.start,
+                    0,
+                    size,
+                    m.stop - m.start,
+                    PAGE_SIZE,
+                )
+            )
+            offset += size
+
+        ident = b"\x7fELF" + bytes([2, 1, 1, 0]) + b"\0" * 8
+        core.seek(0)
+        core.write(
+            ELF_HEADER.pack(
+                ident,
+                ET_CORE,
+                EM_X86_64,
+                1,
+                0,
+                ELF_HEADER.size,
+                0,
+                0,
+                ELF_HEADER.size,
+                PROGRAM_HEADER.size,
+                phnum,
+                0,
+                0,
+                0,
+            )
+        )
+        core.write(b"".join(program_headers))
@@ -0,0 +1,106 @@
+import logging
+from array import array
+from typing import Dict, Iterable, List, Set, Tuple
+
+from ..core_file import AT_SYSINFO_EHDR, PAGE_SIZE, Coredump, Segment
+
+l = logging.getLogger(__name__)
+
+# pages kept around every address found in registers or on the stack
+DEFAULT_CONTEXT_PAGES = 16
+
+
+def _mark(pages: Set[int], segment: Segment, address: int, context: int) -> None:
+    page = (address - segment.vaddr) // PAGE_SIZE
+    first = max(page - context, 0)
+    last = min(page + context + 1, segment.pages)
+    pages.update(range(first, last))
+
+
+def select_pages(core: Coredump, context: int) -> Dict[int, Set[int]]:
+    """
+    Returns the pages to keep by segment index, other segments are dropped
+    """
+    files = core.files()
+    file_starts = set(f[0] for f in files)
+    file_ends = set(f[1] for f in files)
+    vdso = core.auxv.get(AT_SYSINFO_EHDR, 0)
+    whole = set()  # type: Set[int]
+    for idx, s in enumerate(core.segments):
+        # code, data, the .bss right after it and the vdso are needed by the
+        # loader and to resolve globals
+        if s.vaddr in file_starts or s.vaddr in file_ends or s.vaddr == vdso:
+            whole.add(idx)
+
+    seeds = set()  # type: Set[int]
+    for regs in core.thread_registers():
+        seeds.update(regs.values())
+        idx = core.segment_index(regs["rsp"])
+        if idx == -1:
+            continue
+        # live part of the stack, including argv/env of the main thread
+        whole.add(idx)
+        stack = core.segments[idx]
+        start = regs["rsp"] & ~7
+        end = min(stack.vaddr + stack.filesz, stack.end)
+        words = array("Q")
+        if end > start:
+            with core.view(start, end - start) as view:
+                words.frombytes(view)
+        seeds.update(words)
+
+    pages = {}  # type: Dict[int, Set[int]]
+    for idx in whole:
+        pages[idx] = set(range(core.segments[idx].pages))
+    for address in seeds:
+        idx = core.segment_index(address)
+        if idx == -1 or idx in whole:
+            continue
+        _mark(pages.setdefault(idx, set()), core.segments[idx], address, context)
+    return pages
+
+
+def _runs(pages: Iterable[int]) -> List[Tuple[int, int]]:
+    runs = []  # type: List[Tuple[int, int]]
+    for page in sorted(pages):
+        if runs and runs[-1][1] == page:
+            runs[-1] = (runs[-1][0], page + 1)
+        else:
+            runs.append((page, page + 1))
+    return runs
+
+
+def minimize_core(
+    path: str, output: str, context: int = DEFAULT_CONTEXT_PAGES
+) -> Tuple[int, int]:
+    """
+    Write a sparse copy of the core at `path` to `output`, which only
+    contains the memory needed for replay. Dropped pages read as zeros.
+    Returns the number of data bytes before and after.
+    """
+    with Coredump(path) as core:
+        pages = select_pages(core, context)
+        total = sum(s.filesz for s in core.segments)
+        kept = 0
+        headers_end = min(
+            [s.offset for s in core.segments if s.filesz > 0] or [len(core.data)]
+        )
+        with open(output, "wb") as out:
+            # elf header, program headers and notes are copied as is
+            out.write(core.data[:headers_end])
+            for idx, segment in enumerate(core.segments):
+                for first, last in _runs(pages.get(idx, [])):
+                    start = segment.offset + first * PAGE_SIZE
+                    stop = segment.offset + min(last * PAGE_SIZE, segment.filesz)
+                    out.seek(start)
+                    out.write(core.data[start:stop])
+                    kept += stop - start
+            out.truncate(len(core.data))
+    l.info(
+        "minimized %s: kept %d of %d bytes (%d context pages)",
+        path,
+        kept,
+        total,
+        context,
+    )
+    return total, kept
@@ -1,12 +1,29 @@
-from pathlib import Path
+import os
+import struct
+from typing import List, Tuple
 
-PT_ROOT = Path("/sys/bus/event_source/devices/intel_pt")
+from ..errors import HaseError
+from ..perf.pt_config import PT_ROOT, AddressFilter, PtCaps
+
+ELF_MAGIC = b"\x7fELF"
+ELFCLASS64 = 2
+PT_LOAD = 1
+PF_X = 1
+
+# name used on the command line to refer to the traced executable
+MAIN_EXECUTABLE = "main"
 
 
 class PtFeatures:
-    def __init__(self, supported: bool = False, ip_filtering: bool = False) -> None:
+    def __init__(
+        self,
+        supported: bool = False,
+        ip_filtering: bool = False,
+        num_address_ranges: int = 0,
+    ) -> None:
         self.supported = supported
         self.ip_filtering = ip_filtering
+        self.num_address_ranges = num_address_ranges
 
     @property
     def large_record_buffer(self) -> bool:
@@ -19,6 +36,62 @@ def check_features() -> PtFeatures:
     if not PT_ROOT.exists():
         return PtFeatures()
 
-    with open(str(PT_ROOT.joinpath("caps", "ip_filtering"))) as f:
-        ip_filtering = int(f.read()) != 0
-        return PtFeatures(supported=True, ip_filtering=ip_filtering)
+    caps = PtCaps.read(PT_ROOT)
+    return PtFeatures(
+        supported=True,
+        ip_filtering=caps.ip_filtering,
+        num_address_ranges=caps.num_address_ranges,
+    )
+
+
+def executable_segments(path: str) -> List[Tuple[int, int]]:
+    """
+    Returns (file offset, size) of all executable PT_LOAD segments
+    """
+    with open(path, "rb") as f:
+        ident = f.read(16)
+        if ident[:4] != ELF_MAGIC or ident[4] != ELFCLASS64:
+            raise HaseError("%s is not a 64-bit elf file" % path)
+        f.seek(0x20)
+        (phoff,) = struct.unpack("<Q", f.read(8))
+        f.seek(0x36)
+        phentsize, phnum = struct.unpack("<HH", f.read(4))
+
+        segments = []
+        for i in range(phnum):
+            f.seek(phoff + i * phentsize)
+            p_type, p_flags, p_offset, _, _, p_filesz = struct.unpack(
+                "<IIQQQQ", f.read(40)
+            )
+            if p_type == PT_LOAD and p_flags & PF_X:
+                segments.append((p_offset, p_filesz))
+        return segments
+
+
+def build_address_filters(
+    binaries: List[str], executable: str, features: PtFeatures
+) -> List[AddressFilter]:
+    """
+    Translate the user supplied binaries (or `main` for the traced executable)
+    into PT address filters covering their code.
+    """
+    if len(binaries) == 0:
+        return []
+
+    if not features.ip_filtering:
+        raise HaseError("this cpu does not support ip filtering with intel pt")
+
+    filters = []
+    for binary in binaries:
+        if binary == MAIN_EXECUTABLE:
+            binary = executable
+        path = os.path.realpath(binary)
+        for offset, size in executable_segments(path):
+            filters.append(AddressFilter(path, offset, size))
+
+    if len(filters) > features.num_address_ranges:
+        raise HaseError(
+            "%d address ranges requested, but the cpu only supports %d"
+            % (len(filters), features.num_address_ranges)
+        )
+    return filters
@@ -0,0 +1,170 @@
+import logging
+import os
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set
+
+from ..coredump_handler import cgroup
+from ..errors import HaseError
+from ..perf.pt_config import PtConfig
+from . import RecordPaths, RecordProcess, Recording, ReportWorker
+from .control_socket import ControlSocket
+from .event_loop import EventLoop
+
+l = logging.getLogger(__name__)
+
+CGROUP_ROOT = Path("/sys/fs/cgroup")
+
+
+def move_to_cgroup(path: Path, pid: int) -> None:
+    with open(str(path.joinpath("cgroup.procs")), "w") as f:
+        f.write(str(pid))
+
+
+class TargetCgroup:
+    """
+    cgroup (v2) of the supervised processes. Without `path` a cgroup is
+    created and processes are moved back to their original cgroup when they
+    are removed.
+    """
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.owned = path is None
+        if path is None:
+            self.path = CGROUP_ROOT.joinpath("hase-record-%d" % os.getpid())
+        else:
+            self.path = Path(path).resolve()
+        # pid -> cgroup the process was moved from
+        self.origins = {}  # type: Dict[int, str]
+
+    @property
+    def name(self) -> str:
+        # as in /proc/<pid>/cgroup
+        return "/" + str(self.path.relative_to(CGROUP_ROOT))
+
+    def __enter__(self) -> "TargetCgroup":
+        if not CGROUP_ROOT.joinpath("cgroup.controllers").exists():
+            raise HaseError("cgroup v2 is not mounted at %s" % CGROUP_ROOT)
+        if self.owned:
+            self.path.mkdir()
+        elif not self.path.joinpath("cgroup.procs").exists():
+            raise HaseError("%s is not a cgroup" % self.path)
+        return self
+
+    def __exit__(self, type: Any, value: Any, traceback: Any) -> None:
+        for pid in list(self.origins.keys()):
+            try:
+                self.remove(pid)
+            except OSError:
+                pass
+        if self.owned:
+            try:
+                self.path.rmdir()
+            except OSError as e:
+                l.warning("cannot remove cgroup %s: %s", self.path, e)
+
+    def add(self, pid: int) -> None:
+        origin = cgroup(str(pid))
+        if origin is None:
+            raise HaseError("process %d not found" % pid)
+        move_to_cgroup(self.path, pid)
+        self.origins[pid] = origin
+
+    def remove(self, pid: int) -> None:
+        origin = self.origins.pop(pid)
+        move_to_cgroup(CGROUP_ROOT.joinpath(origin.lstrip("/")), pid)
+
+
+class Supervisor(RecordProcess):
+    """
+    Traces all processes of a cgroup with one set of per-cpu buffers instead
+    of one set per process. Processes can be added and removed while
+    recording. Crash reports contain the shared trace, the decoder only keeps
+    the schedule of the crashed process.
+    """
+
+    def __init__(
+        self,
+        target_cgroup: TargetCgroup,
+        record_paths: RecordPaths,
+        worker: ReportWorker,
+        loop: EventLoop,
+        pt_config: Optional[PtConfig] = None,
+    ) -> None:
+        super().__init__(
+            -1, record_paths, worker, loop, pt_config, cgroup=str(target_cgroup.path)
+        )
+        self.target_cgroup = target_cgroup
+        self._watched = set()  # type: Set[int]
+        # stop recording once the last process exited
+        self.stop_when_idle = False
+
+    def is_target(self, metadata: Dict[str, Any]) -> bool:
+        return (
+            metadata["global_pid"] in self.target_cgroup.origins
+            or metadata.get("cgroup") == self.target_cgroup.name
+        )
+
+    def add(self, pid: int) -> None:
+        self.target_cgroup.add(pid)
+        if pid not in self._watched:
+            self._watched.add(pid)
+            self.loop.watch_process(pid, lambda: self.exited(pid))
+        l.info("supervise process %d", pid)
+
+    def remove(self, pid: int) -> None:
+        self.target_cgroup.remove(pid)
+        l.info("stop supervising process %d", pid)
+
+    def exited(self, pid: int) -> None:
+        self._watched.discard(pid)
+        self.target_cgroup.origins.pop(pid, None)
+        if self.stop_when_idle and len(self.target_cgroup.origins) == 0:
+            self.loop.stop()
+
+    def command(self, command: str) -> str:
+        args = command.split()
+        try:
+            if len(args) == 2 and args[0] == "add":
+                self.add(int(args[1]))
+            elif len(args) == 2 and args[0] == "remove":
+                self.remove(int(args[1]))
+            elif args == ["list"]:
+                return "ok " + " ".join(map(str, sorted(self.target_cgroup.origins)))
+            else:
+                return "error unknown command '%s'" % command
+        except (HaseError, OSError, ValueError, KeyError) as e:
+            return "error %s" % e
+        return "ok"
+
+
+def supervise(
+    record_paths: RecordPaths,
+    worker: ReportWorker,
+    pids: List[int],
+    cgroup_path: Optional[str] = None,
+    control_socket: Optional[str] = None,
+    pt_config: Optional[PtConfig] = None,
+) -> List[Recording]:
+    """
+    Record `pids` and/or all processes in `cgroup_path` until all of them
+    exited. With a cgroup or `control_socket` recording continues until it
+    is interrupted.
+    """
+    with EventLoop() as loop, TargetCgroup(cgroup_path) as target_cgroup:
+        supervisor = Supervisor(target_cgroup, record_paths, worker, loop, pt_config)
+        with supervisor, ExitStack() as stack:
+            for pid in pids:
+                supervisor.add(pid)
+            supervisor.stop_when_idle = cgroup_path is None and control_socket is None
+            if control_socket is not None:
+                stack.enter_context(
+                    ControlSocket(control_socket, loop, supervisor.command)
+                )
+            print("supervisor started")
+            try:
+                loop.run()
+            except KeyboardInterrupt:
+                pass
+            supervisor.poll(wait=True)
+            return supervisor.recordings
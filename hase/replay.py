@@ -1,22 +1,33 @@
 import argparse
 import json
 import logging
-import subprocess
 import sys
 from pathlib import Path
 from tempfile import TemporaryDirectory
-from typing import Any, Dict, List, Tuple
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
+from .archive import IndexedArchive, detect_format, extract_archive, read_member
+from .binary_store import BinaryStore
+from .compression import decompress_core
+from .core_file import Coredump
+from .errors import HaseError
 from .gdb import GdbServer
 from .loader import Loader
+from .perf.pt_config import AddressFilter, PtConfig
 from .pt import Instruction, InstructionClass, decode
-from .pwn_wrapper import Coredump
+from .report_cache import CacheEntry, ReportCache
 from .symbex.cdconstraint import general_apply
 from .symbex.evaluate import report_variable
+from .symbex.solver_cache import SolverCache, set_default_cache
 from .symbex.tracer import State, StateManager, Tracer
 
 l = logging.getLogger(__name__)
 
+MANIFEST = "manifest.json"
+
+# reports recorded before the pt configuration was stored in the manifest
+LEGACY_MTC_FREQ = 2
+
 
 def decode_trace(manifest: Dict[str, Any], loader: Loader) -> List[Instruction]:
     coredump = manifest["coredump"]
@@ -30,8 +41,16 @@ def decode_trace(manifest: Dict[str, Any], loader: Loader) -> List[Instruction]:
     pid = coredump["global_pid"]
     tid = coredump["global_tid"]
 
+    if "pt_config" in trace:
+        pt_config = PtConfig.from_dict(trace["pt_config"])
+        mtc_freq = pt_config.mtc_period
+    else:
+        mtc_freq = LEGACY_MTC_FREQ
+
     for cpu in trace["cpus"]:
-        assert pid == cpu["start_pid"], "only one pid is allowed at the moment"
+        # buffers shared by a cgroup contain other processes, see correlate_traces
+        if trace.get("cgroup") is None:
+            assert pid == cpu["start_pid"], "only one pid is allowed at the moment"
         trace_paths.append(cpu["trace_path"])
         perf_event_paths.append(cpu["event_path"])
         start_thread_ids.append(cpu["start_tid"])
@@ -54,23 +73,85 @@ def decode_trace(manifest: Dict[str, Any], loader: Loader) -> List[Instruction]:
         time_shift=trace["time_shift"],
         time_mult=trace["time_mult"],
         sample_type=trace["sample_type"],
+        mtc_freq=mtc_freq,
+        nom_freq=trace.get("nom_freq", 0),
+        shared=trace.get("cgroup") is not None,
     )
 
 
-def unpack(report: str, archive_root: Path) -> Dict[str, Any]:
-    subprocess.check_call(["tar", "-xzf", report, "-C", str(archive_root)])
+def traced_ranges(
+    manifest: Dict[str, Any], loader: Loader
+) -> Optional[List[Tuple[int, int]]]:
+    """
+    Address ranges covered by the pt address filters, None if the whole process
+    was traced.
+    """
+    filters = manifest["trace"].get("address_filters", [])
+    if len(filters) == 0:
+        return None
+    ranges = []  # type: List[Tuple[int, int]]
+    for f in filters:
+        address_filter = AddressFilter.from_dict(f)
+        ranges.extend(
+            loader.address_ranges(
+                address_filter.path, address_filter.offset, address_filter.size
+            )
+        )
+    return sorted(ranges)
+
+
+def read_manifest(report: str) -> Dict[str, Any]:
+    return json.loads(read_member(report, MANIFEST).decode("utf-8"))
+
+
+def unpack(
+    report: str, archive_root: Path, binary_store: Optional[BinaryStore] = None
+) -> Dict[str, Any]:
+    if detect_format(report) == "indexed":
+        # only members referenced by the manifest are extracted
+        with IndexedArchive(report) as indexed:
+            manifest = json.loads(indexed.read(MANIFEST).decode("utf-8"))
+            return resolve_manifest(
+                manifest,
+                archive_root,
+                binary_store or BinaryStore.for_report(report),
+                lambda name: str(indexed.extract(name, archive_root)),
+            )
 
-    manifest_path = archive_root.joinpath("manifest.json")
+    extract_archive(report, archive_root)
+
+    manifest_path = archive_root.joinpath(MANIFEST)
     with open(str(manifest_path)) as f:
         manifest = json.load(f)
+    return resolve_manifest(
+        manifest,
+        archive_root,
+        binary_store or BinaryStore.for_report(report),
+        lambda name: str(archive_root.joinpath(name)),
+    )
+
+
+def resolve_manifest(
+    manifest: Dict[str, Any],
+    archive_root: Path,
+    binary_store: BinaryStore,
+    member: Callable[[str], str],
+) -> Dict[str, Any]:
+    """
+    Replace the relative paths in `manifest` with paths below `archive_root`,
+    `member` returns the path of an archive member.
+    """
+    # older reports contain the binaries in the archive
+    for path, key in manifest.get("blobs", {}).items():
+        binary_store.materialize(key, archive_root.joinpath(path))
 
     for cpu in manifest["trace"]["cpus"]:
-        cpu["event_path"] = str(archive_root.joinpath(cpu["event_path"]))
-        cpu["trace_path"] = str(archive_root.joinpath(cpu["trace_path"]))
+        cpu["event_path"] = member(cpu["event_path"])
+        cpu["trace_path"] = member(cpu["trace_path"])
 
     coredump = manifest["coredump"]
     coredump["executable"] = str(archive_root.joinpath(coredump["executable"]))
-    coredump["file"] = str(archive_root.joinpath(coredump["file"]))
+    coredump["file"] = decompress_core(member(coredump["file"]))
 
     return manifest
 
@@ -82,68 +163,164 @@ def unpack(report: str, archive_root: Path) -> Dict[str, Any]:
 #             print(loader.find_location(instr.ip))
 
 
-def create_tracer(report: str, archive_root: Path) -> Tracer:
-    manifest = unpack(report, archive_root)
+def create_tracer(
+    report: str,
+    archive_root: Path,
+    binary_store: Optional[BinaryStore] = None,
+    manifest: Optional[Dict[str, Any]] = None,
+    **tracer_options: Any
+) -> Tracer:
+    """
+    Pass `manifest` if the report was already unpacked to `archive_root`,
+    `tracer_options` are passed to `Tracer`
+    """
+    if manifest is None:
+        manifest = unpack(report, archive_root, binary_store)
 
     coredump = Coredump(manifest["coredump"]["file"])
     vdso_x64 = archive_root.joinpath("vdso")
 
-    with open(str(vdso_x64), "wb+") as f:
-        f.write(coredump.vdso.data)
+    if not vdso_x64.exists():
+        vdso = coredump.vdso
+        if vdso is None:
+            raise HaseError("coredump has no [vdso] mapping")
+        with open(str(vdso_x64), "wb+") as f:
+            f.write(vdso.data)
     sysroot = archive_root.joinpath("binaries")
     executable = manifest["coredump"]["executable"]
     loader = Loader(executable, coredump.mappings, sysroot, vdso_x64)
     trace = decode_trace(manifest, loader)
 
-    return Tracer(executable, trace, coredump, loader, name=report)
+    return Tracer(
+        executable,
+        trace,
+        coredump,
+        loader,
+        name=report,
+        traced_ranges=traced_ranges(manifest, loader),
+        **tracer_options
+    )
 
 
 class Replay:
-    def __init__(self, report: str) -> None:
+    def __init__(
+        self,
+        report: str,
+        binary_store: Optional[BinaryStore] = None,
+        cache: Optional[ReportCache] = None,
+        **tracer_options: Any
+    ) -> None:
         self.report = report
-        self._tempdir = TemporaryDirectory()
-        self.tempdir = Path(self._tempdir.name)
+        self.binary_store = binary_store
+        self.cache = cache
+        self.tracer_options = tracer_options
+        self._tempdir = None  # type: Optional[TemporaryDirectory]
+        self._cache_entry = None  # type: Optional[CacheEntry]
+        self.tracer = None  # type: Optional[Tracer]
 
     def __enter__(self) -> "Replay":
-        self.tracer = create_tracer(self.report, self.tempdir)
+        self.tracer = self.create_tracer()
         return self
 
+    def get_tracer(self) -> Tracer:
+        if self.tracer is None:
+            self.tracer = self.create_tracer()
+        return self.tracer
+
+    def create_tracer(self) -> Tracer:
+        if self.cache is None:
+            self._tempdir = TemporaryDirectory()
+            self.tempdir = Path(self._tempdir.name)
+            return create_tracer(
+                self.report, self.tempdir, self.binary_store, **self.tracer_options
+            )
+
+        self._cache_entry = self.cache.acquire(self.report)
+        self.tempdir = self._cache_entry.path
+        manifest = self.cache.unpack(
+            self._cache_entry,
+            lambda root: unpack(self.report, root, self.binary_store),
+        )
+        return create_tracer(
+            self.report,
+            self.tempdir,
+            self.binary_store,
+            manifest,
+            **self.tracer_options
+        )
+
     def __exit__(self, exc_type: Any, exc_value: Any, traceback: Any) -> None:
         self.cleanup()
 
     @property
     def executable(self) -> str:
-        return self.tracer.executable
+        return self.get_tracer().executable
 
     def run(self) -> Tuple[StateManager, List[Any]]:
-        if self.tracer is None:
-            self.tracer = create_tracer(self.report, self.tempdir)
-        states = self.tracer.run()
+        states = self.get_tracer().run()
         final_state = states.major_states[-1].simstate
         assert final_state is not None
         return states, []
 
     def cleanup(self) -> None:
-        self._tempdir.cleanup()
-
-
-def replay_trace(report: str) -> Replay:
-    return Replay(report)
+        if self._tempdir is not None:
+            self._tempdir.cleanup()
+            self._tempdir = None
+        if self._cache_entry is not None:
+            self._cache_entry.release()
+            self._cache_entry = None
+
+
+def replay_trace(
+    report: str,
+    binary_store: Optional[BinaryStore] = None,
+    use_cache: bool = False,
+    **tracer_options: Any
+) -> Replay:
+    """
+    With `use_cache` the report is unpacked into the shared report cache
+    (`report_cache.default_cache_dir`) instead of a temporary directory
+    """
+    cache = ReportCache.default() if use_cache else None
+    return Replay(report, binary_store, cache, **tracer_options)
+
+
+def binary_store_arg(args: argparse.Namespace) -> Optional[BinaryStore]:
+    if args.binary_store is None:
+        return None
+    return BinaryStore(Path(args.binary_store))
 
 
 def replay_command(args: argparse.Namespace, debug_cli: bool = False) -> StateManager:
-    with replay_trace(args.report) as rt:
+    if args.solver_cache is not None:
+        set_default_cache(SolverCache(path=Path(args.solver_cache)))
+    with replay_trace(
+        args.report,
+        binary_store_arg(args),
+        not args.no_cache,
+        block_step=not args.single_step,
+        unicorn=args.unicorn,
+        window=args.window,
+        sat_interval=args.sat_interval,
+        memory_budget=None
+        if args.memory_budget is None
+        else args.memory_budget * 1024 * 1024,
+        checkpoints=args.checkpoints,
+        crash_density=args.crash_density,
+        max_latency=args.max_latency,
+    ) as rt:
         states, constraints = rt.run()
         if debug_cli:
+            tracer = rt.get_tracer()
             if (
                 states.major_states[-1].simstate.reg_concrete("rsp")
-                == rt.tracer.coredump.registers["rsp"]
+                == tracer.coredump.registers["rsp"]
             ):
-                general_apply(rt.tracer, states)
+                general_apply(tracer, states)
             gdbs = GdbServer(
                 states,
-                rt.tracer.executable,
-                rt.tracer.cdanalyzer,
+                tracer.executable,
+                tracer.cdanalyzer,
                 states.major_states[-1],
             )
             assert states.last_main_state is not None
@@ -157,7 +334,5 @@ def replay_command(args: argparse.Namespace, debug_cli: bool = False) -> StateMa
 
 
 def unpack_command(args: argparse.Namespace) -> None:
-    with Replay(args.report):
-        with TemporaryDirectory() as tempdir:
-            manifest = unpack(args.report, Path(tempdir))
-            json.dump(manifest, sys.stdout, sort_keys=True, indent=4)
+    # only the manifest is read, nothing is extracted
+    json.dump(read_manifest(args.report), sys.stdout, sort_keys=True, indent=4)
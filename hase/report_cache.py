@@ -0,0 +1,172 @@
+import fcntl
+import json
+import logging
+import os
+import shutil
+from pathlib import Path
+from typing import IO, Any, Callable, Dict, List, Tuple
+
+from .binary_store import sha256
+
+l = logging.getLogger(__name__)
+
+DEFAULT_MAX_SIZE = 10 * 1024 * 1024 * 1024
+
+LOCK = ".lock"
+COMPLETE = ".complete"
+MANIFEST = ".manifest.json"
+HASHES = "hashes"
+
+
+def default_cache_dir() -> Path:
+    root = os.environ.get("HASE_CACHE_DIR")
+    if root is not None:
+        return Path(root)
+    xdg = os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+    return Path(xdg).joinpath("hase", "reports")
+
+
+def _disk_usage(path: Path) -> int:
+    size = 0
+    for root, _, files in os.walk(str(path)):
+        for name in files:
+            st = os.lstat(os.path.join(root, name))
+            # hardlinked binaries are owned by the binary store
+            if st.st_nlink == 1:
+                size += st.st_blocks * 512
+    return size
+
+
+class CacheEntry:
+    """
+    An unpacked report. While the entry is held, its shared lock prevents
+    eviction by other replays.
+    """
+
+    def __init__(self, path: Path, lock_file: IO[Any]) -> None:
+        self.path = path
+        self.lock_file = lock_file
+
+    @property
+    def complete(self) -> bool:
+        return self.path.joinpath(COMPLETE).exists()
+
+    def manifest(self) -> Dict[str, Any]:
+        with open(str(self.path.joinpath(MANIFEST))) as f:
+            return json.load(f)
+
+    def release(self) -> None:
+        fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+        self.lock_file.close()
+
+
+class ReportCache:
+    """
+    Unpacked reports shared by all replays, keyed by the sha256 of the archive.
+    Least recently used entries are removed once `max_size` is exceeded.
+    """
+
+    def __init__(self, root: Path, max_size: int = DEFAULT_MAX_SIZE) -> None:
+        self.root = root
+        self.max_size = max_size
+
+    @classmethod
+    def default(cls) -> "ReportCache":
+        max_size = int(os.environ.get("HASE_CACHE_SIZE", DEFAULT_MAX_SIZE))
+        return cls(default_cache_dir(), max_size)
+
+    def report_hash(self, report: str) -> str:
+        # hashing large archives is slow, remember the hash of unchanged files
+        st = os.stat(report)
+        stat_key = "%d-%d-%d-%d" % (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+        memo = self.root.joinpath(HASHES, stat_key)
+        try:
+            return memo.read_text()
+        except OSError:
+            pass
+        digest = sha256(report)
+        memo.parent.mkdir(parents=True, exist_ok=True)
+        memo.write_text(digest)
+        return digest
+
+    def acquire(self, report: str) -> CacheEntry:
+        path = self.root.joinpath(self.report_hash(report))
+        lock_path = str(path.joinpath(LOCK))
+        while True:
+            path.mkdir(parents=True, exist_ok=True)
+            try:
+                lock_file = open(lock_path, "a+")
+            except FileNotFoundError:
+                # evicted between mkdir and open
+                continue
+            fcntl.flock(lock_file, fcntl.LOCK_SH)
+            # the entry might have been evicted before we got the lock
+            try:
+                same = os.stat(lock_path).st_ino == os.fstat(lock_file.fileno()).st_ino
+            except FileNotFoundError:
+                same = False
+            if same:
+                break
+            lock_file.close()
+        # mtime of the lock file orders entries for eviction
+        os.utime(lock_path)
+        return CacheEntry(path, lock_file)
+
+    def unpack(
+        self, entry: CacheEntry, fill: Callable[[Path], Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        """
+        Returns the cached manifest or unpacks the report with `fill`
+        """
+        if entry.complete:
+            l.info("use cached report %s", entry.path)
+            return entry.manifest()
+
+        fcntl.flock(entry.lock_file, fcntl.LOCK_EX)
+        try:
+            # another replay might have finished it meanwhile
+            if not entry.complete:
+                self._clear(entry.path)
+                manifest = fill(entry.path)
+                with open(str(entry.path.joinpath(MANIFEST)), "w") as f:
+                    json.dump(manifest, f)
+                entry.path.joinpath(COMPLETE).touch()
+        finally:
+            fcntl.flock(entry.lock_file, fcntl.LOCK_SH)
+        self.evict()
+        return entry.manifest()
+
+    def _clear(self, path: Path) -> None:
+        # leftovers of an interrupted unpack
+        for child in path.iterdir():
+            if child.name == LOCK:
+                continue
+            if child.is_dir() and not child.is_symlink():
+                shutil.rmtree(str(child))
+            else:
+                child.unlink()
+
+    def entries(self) -> List[Tuple[float, Path]]:
+        entries = []
+        for path in self.root.iterdir():
+            lock = path.joinpath(LOCK)
+            if path.name != HASHES and lock.exists():
+                entries.append((lock.stat().st_mtime, path))
+        return sorted(entries)
+
+    def evict(self) -> None:
+        entries = self.entries()
+        sizes = dict((path, _disk_usage(path)) for _, path in entries)
+        total = sum(sizes.values())
+        for _, path in entries:
+            if total <= self.max_size:
+                return
+            with open(str(path.joinpath(LOCK)), "a+") as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # in use by a replay
+                    continue
+                l.info("evict cached report %s", path)
+                shutil.rmtree(str(path))
+            total -= sizes[path]
@@ -2,7 +2,11 @@ from typing import Any, Dict, List, Optional, Tuple
 
 from pygdbmi.gdbcontroller import GdbController
 
-from ..pwn_wrapper import ELF, Coredump
+from ..core_file import Coredump, Mapping
+from ..errors import HaseError
+from ..pwn_wrapper import ELF
+
+CALLEE_SAVED_REGISTERS = ["rbx", "rbp", "r12", "r13", "r14", "r15"]
 
 
 class CoredumpGDB:
@@ -137,6 +141,10 @@ class CoredumpGDB:
         rbp_value = self.get_reg("rbp")
         return rsp_value, rbp_value
 
+    def get_frame_registers(self, n: int, names: List[str]) -> Dict[str, int]:
+        self.write_request("select-frame {}".format(n))
+        return {name: self.get_reg(name) for name in names}
+
     def get_func_range(self, name: str) -> List[int]:
         # FIXME: Not a good idea. Maybe some gdb extension?
         r1 = self.write_request("print &{}".format(name))
@@ -170,22 +178,29 @@ class CoredumpAnalyzer:
         self.argv = [self.read_argv(i) for i in range(self.argc)]
         self.argv_addr = [self.read_argv_addr(i) for i in range(self.argc)]
 
-    def read_stack(self, addr: int, length: int = 0x1) -> str:
+    @property
+    def stack(self) -> Mapping:
+        stack = self.coredump.stack
+        if stack is None:
+            raise HaseError("coredump has no [stack] mapping")
+        return stack
+
+    def read_stack(self, addr: int, length: int = 0x1) -> bytes:
         # NOTE: a op b op c will invoke weird typing
-        assert self.coredump.stack.start <= addr < self.coredump.stack.stop
-        offset = addr - self.coredump.stack.start
-        return self.coredump.stack.data[offset : offset + length]
+        assert self.stack.start <= addr < self.stack.stop
+        offset = addr - self.stack.start
+        return self.stack.data[offset : offset + length]
 
-    def read_argv(self, n: int) -> str:
+    def read_argv(self, n: int) -> bytes:
         assert 0 <= n < self.coredump.argc
         return self.coredump.string(self.coredump.argv[n])
 
-    def read_argv_addr(self, n: int) -> str:
+    def read_argv_addr(self, n: int) -> int:
         assert 0 <= n < self.coredump.argc
         return self.coredump.argv[n]
 
     @property
-    def env(self) -> Dict[str, str]:
+    def env(self) -> Dict[str, int]:
         return self.coredump.env
 
     @property
@@ -194,11 +209,11 @@ class CoredumpAnalyzer:
 
     @property
     def stack_start(self) -> int:
-        return self.coredump.stack.start
+        return self.stack.start
 
     @property
     def stack_stop(self) -> int:
-        return self.coredump.stack.stop
+        return self.stack.stop
 
     def call_argv(self, name: str) -> Optional[List[Optional[int]]]:
         for bt in self.backtrace:
@@ -220,3 +235,32 @@ class CoredumpAnalyzer:
             if bt["func"] == name:
                 return self.gdb.get_stack_base(int(bt["index"]))
         return (None, None)
+
+    def entry_registers(
+        self, name: str, return_address: int
+    ) -> Optional[Dict[str, int]]:
+        """
+        Registers known at the entry of `name` if the call that returns to
+        `return_address` is still on the stack of the crash: rsp and the
+        callee-saved registers as unwound by gdb (registers gdb could not
+        unwind are missing)
+        """
+        for bt in self.backtrace:
+            if bt["func"] != name:
+                continue
+            caller = int(bt["index"]) + 1
+            if caller >= len(self.backtrace):
+                continue
+            registers = self.gdb.get_frame_registers(
+                caller, ["rsp"] + CALLEE_SAVED_REGISTERS
+            )
+            # the call pushed the return address
+            rsp = registers["rsp"] - 8
+            try:
+                if self.coredump.u64(rsp) != return_address:
+                    continue
+            except HaseError:
+                continue
+            registers["rsp"] = rsp
+            return {k: v for k, v in registers.items() if v != 0}
+        return None
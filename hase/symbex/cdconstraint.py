@@ -2,7 +2,8 @@ from typing import Any, List, Tuple
 
 from claripy.ast.bool import Bool
 
-from ..pwn_wrapper import Coredump
+from ..core_file import Coredump
+from .solver_cache import default_cache
 from .state import SimState, State, StateManager
 from .tracer import Tracer
 
@@ -12,12 +13,18 @@ def add_stack_constraints(
 ) -> List[Bool]:
     coredump_constraints = []  # type: List[Bool]
 
-    for addr in range(final_rsp, init_rsp + 1):
-        value = state.memory.load(addr, 1, endness="Iend_LE")
-        if value.variables == frozenset():
+    # most of the stack is concrete, only words with symbolic bytes are
+    # constrained byte by byte
+    for word in range(final_rsp, init_rsp + 1, 8):
+        size = min(8, init_rsp + 1 - word)
+        if state.memory.load(word, size).variables == frozenset():
             continue
-        cmem = coredump.stack[addr]
-        coredump_constraints.append(value == cmem)
+        cmem = coredump.read(word, size)
+        for i in range(size):
+            value = state.memory.load(word + i, 1, endness="Iend_LE")
+            if value.variables == frozenset():
+                continue
+            coredump_constraints.append(value == cmem[i])
     return coredump_constraints
 
 
@@ -41,7 +48,7 @@ def apply_constraints(state: "State", constraints: List[Bool]) -> None:
         for c in constraints:
             old_solver = state.simstate.solver._solver.branch()
             state.simstate.solver.add(c)
-            if not state.simstate.solver.satisfiable():
+            if not default_cache().satisfiable(state.simstate):
                 print("Unsatisfiable coredump constraints: {}".format(c))
                 state.simstate.solver._stored_solver = old_solver
         state.had_coredump_constraints = True
@@ -0,0 +1,118 @@
+from typing import Any, List, Optional, Tuple
+
+import claripy
+from angr import SimStatePlugin
+from angr.state_plugins.symbolic_memory import SimSymbolicMemory
+from angr.storage.memory_object import SimMemoryObject
+
+from ..core_file import PAGE_SIZE, Coredump
+
+
+class CrashValue(claripy.Annotation):
+    """
+    Marks values read from the coredump: the memory content at the crash,
+    which is not necessarily the content at the time it was read
+    """
+
+    @property
+    def eliminatable(self) -> bool:
+        return False
+
+    @property
+    def relocatable(self) -> bool:
+        return True
+
+
+def is_crash_value(value: claripy.ast.Base) -> bool:
+    return any(isinstance(a, CrashValue) for a in value.annotations)
+
+
+class CoredumpMemory(SimSymbolicMemory):
+    """
+    Memory that has not been written before reads the content of the
+    coredump instead of becoming a new symbolic variable. Memory backed by the
+    loaded binaries is not affected. Pages are read from the mapped core on
+    first access, nothing is copied upfront.
+
+    `ranges` ([start, stop)) limits the addresses read from the core, with
+    `annotate` the values are marked as `CrashValue`.
+    """
+
+    def __init__(
+        self,
+        coredump: Optional[Coredump] = None,
+        ranges: Optional[List[Tuple[int, int]]] = None,
+        annotate: bool = False,
+        **kwargs: Any
+    ) -> None:
+        super().__init__(**kwargs)
+        self.coredump = coredump
+        self.ranges = ranges
+        self.annotate = annotate
+
+    @SimStatePlugin.memo
+    def copy(self, memo: Any) -> "CoredumpMemory":
+        c = super().copy(memo)
+        c.coredump = self.coredump
+        c.ranges = self.ranges
+        c.annotate = self.annotate
+        return c
+
+    def core_ranges(self, address: int, size: int) -> List[Tuple[int, int]]:
+        """
+        Parts of [address, address + size) that are read from the core
+        """
+        assert self.coredump is not None
+        dumped = self.coredump.dumped_ranges(address, size)
+        if self.ranges is None:
+            return dumped
+        ranges = []
+        for start, stop in dumped:
+            for allowed_start, allowed_stop in self.ranges:
+                if max(start, allowed_start) < min(stop, allowed_stop):
+                    ranges.append(
+                        (max(start, allowed_start), min(stop, allowed_stop))
+                    )
+        return sorted(ranges)
+
+    def _load_core_pages(self, start: int, stop: int) -> SimMemoryObject:
+        # read whole pages, bytes that are already present are not replaced
+        low = start & ~(PAGE_SIZE - 1)
+        high = (stop + PAGE_SIZE - 1) & ~(PAGE_SIZE - 1)
+        for range_start, range_stop in self.core_ranges(low, high - low):
+            if range_start <= start and stop <= range_stop:
+                low, high = range_start, range_stop
+                break
+        assert self.coredump is not None
+        with self.coredump.view(low, high - low) as view:
+            data = claripy.BVV(bytes(view))
+        if self.annotate:
+            data = data.annotate(CrashValue())
+        mo = SimMemoryObject(data, low, byte_width=self.state.arch.byte_width)
+        self.mem.store_memory_object(mo, overwrite=False)
+        return mo
+
+    def _fill_missing(
+        self, addr: Any, num_bytes: int, inspect: bool = True, events: bool = True
+    ) -> SimMemoryObject:
+        if self.coredump is None or self.category != "mem" or not isinstance(addr, int):
+            return super()._fill_missing(addr, num_bytes, inspect, events)
+
+        chunks = []
+        address = addr
+        end = addr + num_bytes
+        for start, stop in self.core_ranges(addr, num_bytes) + [(end, end)]:
+            if address < start:
+                # not in the core, i.e. unmapped or never dumped
+                mo = super()._fill_missing(address, start - address, inspect, events)
+                chunks.append(mo.bytes_at(address, start - address))
+            if start < stop:
+                mo = self._load_core_pages(start, stop)
+                chunks.append(mo.bytes_at(start, stop - start))
+            address = stop
+
+        if len(chunks) == 1:
+            return mo
+        return SimMemoryObject(
+            claripy.Concat(*chunks), addr, byte_width=self.state.arch.byte_width
+        )
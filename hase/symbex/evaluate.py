@@ -1,3 +1,4 @@
+from .solver_cache import default_cache
 from .state import SimState
 from ..gdb import GdbServer
 from typing import Any, Dict, Tuple
@@ -7,7 +8,7 @@ def eval_value(state: SimState, value: Any) -> str:
     if value.uninitialized:
         return "uninitialized"
     try:
-        v = hex(state.solver.eval(value))
+        v = hex(default_cache().eval(state, value))
     except Exception:
         v = "symbolic"
     return v
@@ -32,7 +33,7 @@ def eval_variable(state: SimState, loc: int, addr: Any, size: int) -> Tuple[str,
                 result += "** "
                 continue
             try:
-                v = hex(state.solver.eval(value))[2:]
+                v = hex(default_cache().eval(state, value))[2:]
                 if len(v) == 1:
                     v = "0" + v
             except Exception:
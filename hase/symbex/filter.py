@@ -2,12 +2,13 @@ import logging
 import time
 from bisect import bisect
 from collections import defaultdict
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 from angr import Project, SimProcedure
+from capstone import x86_const
 
 from ..progress_log import ProgressLog
-from ..pt import Instruction
+from ..pt import Instruction, InstructionClass
 from .hook import common_prefix, common_suffix, unsupported_symbols
 
 if False:  # for mypy
@@ -41,6 +42,39 @@ def symbol_name(symbol: Optional[FakeSymbol]) -> str:
         return symbol.name
 
 
+def omit_ranges(omitted_section: List[List[int]]) -> Tuple[List[int], List[int]]:
+    """
+    Starts and ends of the merged [start, start + size) ranges, sorted
+    """
+    starts = []  # type: List[int]
+    ends = []  # type: List[int]
+    for start, size in sorted((r[0], r[1]) for r in omitted_section if r[1] > 0):
+        if ends and start <= ends[-1]:
+            ends[-1] = max(ends[-1], start + size)
+        else:
+            starts.append(start)
+            ends.append(start + size)
+    return starts, ends
+
+
+class AddressClass:
+    """
+    Properties of an address tested by `FilterTrace.analyze_trace`
+    """
+
+    __slots__ = ["plt_vdso", "ld", "omit", "main", "function"]
+
+    def __init__(
+        self, plt_vdso: bool, ld: bool, omit: bool, main: bool, function: Any
+    ) -> None:
+        self.plt_vdso = plt_vdso
+        self.ld = ld
+        self.omit = omit
+        self.main = main
+        # FIXME type should be a union of the actual type and FakeSymbol
+        self.function = function
+
+
 class FilterBase:
     def __init__(
         self,
@@ -64,10 +98,19 @@ class FilterBase:
 
         self.syms = {}  # type: Dict[Any, List[int]]
         self.syms_dict = {}  # type: Dict[Any, Dict[int, Any]]
+        # first name of every plt entry
+        self.plt_names = {}  # type: Dict[int, str]
         for lib in self.project.loader.all_elf_objects:
             self.syms_dict[lib] = lib.symbols_by_addr.copy()
             self.syms[lib] = list(self.syms_dict[lib].keys())
             self.syms[lib].sort()
+            for addr, name in lib.reverse_plt.items():
+                self.plt_names.setdefault(addr, name)
+        self.objects = sorted(self.syms.keys(), key=lambda lib: lib.min_addr)
+        self.object_starts = [lib.min_addr for lib in self.objects]
+        self.omit_starts, self.omit_ends = omit_ranges(self.omitted_section)
+        # addresses are classified once, see `classify`
+        self.classes = {}  # type: Dict[int, AddressClass]
 
     def add_hook_omit_symbol(self, fname: str, name: str, ip: int) -> None:
         l.info("Adding new hook: {} with old hook {}".format(fname, name))
@@ -84,24 +127,47 @@ class FilterBase:
                 r = [0, 0]
             self.omitted_section.append(r)
 
-    def test_plt_vdso(self, addr: int) -> bool:
+    def classify(self, addr: int) -> AddressClass:
+        cls = self.classes.get(addr)
+        if cls is not None:
+            return cls
+        loader = self.project.loader
         # NOTE: .plt or .plt.got
-        section = self.project.loader.find_section_containing(addr)
+        section = loader.find_section_containing(addr)
         if section:
-            return section.name.startswith(".plt")
+            plt_vdso = section.name.startswith(".plt")
         else:
             # NOTE: unrecognizable section, regard as vDSO
-            return True
+            plt_vdso = True
+        obj = loader.find_object_containing(addr)
+        pos = bisect(self.omit_starts, addr) - 1
+        cls = AddressClass(
+            plt_vdso,
+            obj == loader.linux_loader_object,
+            pos >= 0 and addr < self.omit_ends[pos],
+            obj == loader.main_object,
+            self.lookup_function(addr, plt_vdso),
+        )
+        self.classes[addr] = cls
+        return cls
+
+    def classify_trace(self, trace: List[Instruction]) -> List[AddressClass]:
+        """
+        Classes of all instructions, every distinct address is classified once
+        """
+        for ip in {instruction.ip for instruction in trace}:
+            self.classify(ip)
+        classes = self.classes
+        return [classes[instruction.ip] for instruction in trace]
+
+    def test_plt_vdso(self, addr: int) -> bool:
+        return self.classify(addr).plt_vdso
 
     def test_ld(self, addr: int) -> bool:
-        o = self.project.loader.find_object_containing(addr)
-        return o == self.project.loader.linux_loader_object
+        return self.classify(addr).ld
 
     def test_omit(self, addr: int) -> bool:
-        for sec in self.omitted_section:
-            if sec[0] <= addr < sec[0] + sec[1]:
-                return True
-        return False
+        return self.classify(addr).omit
 
     def test_hook_name(self, fname: str, ip: int) -> bool:
         if fname in self.hooked_addon.keys():
@@ -114,10 +180,7 @@ class FilterBase:
         return True
 
     def solve_name_plt(self, addr: int) -> str:
-        for lib in self.project.loader.all_elf_objects:
-            if addr in lib.reverse_plt.keys():
-                return lib.reverse_plt[addr]
-        return ""
+        return self.plt_names.get(addr, "")
 
     def find_matching_name(self, fname: str) -> Tuple[bool, Optional[str]]:
         for name in self.hooked_symname:
@@ -131,21 +194,35 @@ class FilterBase:
                     return True, name
         return False, None
 
-    # FIXME return type should be a union of the actual type and FakeSymbol
-    def find_function(self, addr: int) -> Optional[FakeSymbol]:
-        for lib, symx in self.syms.items():
+    def object_containing(self, addr: int) -> Any:
+        pos = bisect(self.object_starts, addr) - 1
+        if pos >= 0 and self.objects[pos].contains_addr(addr):
+            return self.objects[pos]
+        # objects might overlap
+        for lib in self.syms:
             if lib.contains_addr(addr):
-                # NOTE: angr cannot solve plt symbol name
-                if self.test_plt_vdso(addr):
-                    name = self.solve_name_plt(addr)
-                    if name:
-                        sym = FakeSymbol(name, addr)
-                        return sym
-                idx = bisect(symx, addr) - 1
-                entry = symx[idx]
-                return self.syms_dict[lib][entry]
+                return lib
         return None
 
+    def lookup_function(self, addr: int, plt_vdso: bool) -> Optional[FakeSymbol]:
+        lib = self.object_containing(addr)
+        if lib is None:
+            return None
+        # NOTE: angr cannot solve plt symbol name
+        if plt_vdso:
+            name = self.solve_name_plt(addr)
+            if name:
+                sym = FakeSymbol(name, addr)
+                return sym
+        symx = self.syms[lib]
+        idx = bisect(symx, addr) - 1
+        entry = symx[idx]
+        return self.syms_dict[lib][entry]
+
+    # FIXME return type should be a union of the actual type and FakeSymbol
+    def find_function(self, addr: int) -> Optional[FakeSymbol]:
+        return self.classify(addr).function
+
     def test_function_entry(self, addr: int) -> Tuple[bool, str]:
         sym = self.find_function(addr)
         if sym and sym.rebased_addr == addr:
@@ -164,6 +241,7 @@ class FilterTrace(FilterBase):
         omitted_section: List[List[int]],
         static_link: bool,
         name: str = "(unamed)",
+        traced_ranges: Optional[List[Tuple[int, int]]] = None,
     ) -> None:
         super().__init__(project, trace, hooked_symbol, gdb, omitted_section)
 
@@ -172,6 +250,10 @@ class FilterTrace(FilterBase):
         self.hook_entry = []  # type: List[Tuple[int, Instruction, str]]
         self.static_link = static_link
         self.name = name
+        # address ranges of pt ip filters, None if everything was traced
+        self.traced_ranges = traced_ranges
+        # indices into the filtered trace where a call went to untraced code
+        self.untraced_calls = set()  # type: Set[int]
         self.analyze_trace()
 
     def entry_check(self) -> None:
@@ -218,16 +300,14 @@ class FilterTrace(FilterBase):
             total_steps=trace_len,
             kill_limit=60 * 20,
         )
+        classes = self.classify_trace(self.trace)
         for (idx, instruction) in enumerate(self.trace):
             progress_log.update(idx)
+            cls = classes[idx]
             if idx > 0:
                 previous_instr = self.trace[idx - 1]
             present = True
-            if (
-                self.test_plt_vdso(instruction.ip)
-                or self.test_ld(instruction.ip)
-                or self.test_omit(instruction.ip)
-            ):
+            if cls.plt_vdso or cls.ld or cls.omit:
                 present = False
             # NOTE: if already in hooked function, leaving to parent
             # FIXME: gcc optimization will lead to main->func1->(set rbp)func2->main
@@ -237,7 +317,7 @@ class FilterTrace(FilterBase):
             # Or find scope outside hooked_libs
             if is_current_hooked:
                 if present:
-                    sym = self.find_function(instruction.ip)
+                    sym = cls.function
                     recursive_level = 4
                     if sym == hooked_parent:
                         is_current_hooked = False
@@ -277,9 +357,9 @@ class FilterTrace(FilterBase):
                 if not self.static_link:
                     if (
                         is_current_hooked
-                        and not self.test_plt_vdso(instruction.ip)
-                        and not self.test_ld(instruction.ip)
-                        and self.project.loader.find_object_containing(instruction.ip) == self.project.loader.main_object
+                        and not cls.plt_vdso
+                        and not cls.ld
+                        and cls.main
                     ):
                         is_current_hooked = False
                         hooked_parent = None
@@ -291,7 +371,7 @@ class FilterTrace(FilterBase):
                 flg, fname = self.test_function_entry(instruction.ip)
                 if flg and previous_instr is not None:
                     # NOTE: function entry, testing is hooked
-                    sym = self.find_function(instruction.ip)
+                    sym = cls.function
                     parent = self.find_function(previous_instr.ip)
                     parent_addr = previous_instr.ip
                     self.call_parent[sym] = (parent, parent_addr)
@@ -335,7 +415,7 @@ class FilterTrace(FilterBase):
                         hook_idx = idx
                         hook_addr = self.trace[idx - 1 : idx - 4 : -1]
                 else:
-                    if self.test_omit(instruction.ip):
+                    if cls.omit:
                         is_current_hooked = True
                         first_meet = False
                         assert previous_instr is not None
@@ -345,9 +425,9 @@ class FilterTrace(FilterBase):
             if (
                 is_current_hooked
                 and not first_meet
-                and not self.test_plt_vdso(instruction.ip)
-                and not self.test_ld(instruction.ip)
-                and not self.test_omit(instruction.ip)
+                and not cls.plt_vdso
+                and not cls.ld
+                and not cls.omit
             ):
                 present = True
                 first_meet = True
@@ -356,6 +436,66 @@ class FilterTrace(FilterBase):
             if present:
                 self.new_trace.append(instruction)
                 self.trace_idx.append(idx)
+        self.analyze_untraced_calls()
+
+    def analyze_untraced_calls(self) -> None:
+        """
+        With ip filtering the callee of a call into an untraced binary leaves
+        no instructions behind: the trace continues at the return address.
+        These gaps are expected and must not be treated as divergence.
+        """
+        self.untraced_calls = set()
+        if self.traced_ranges is None:
+            return
+        hooked = set(self.hook_target.keys())
+        hooked.update(idx for idx, _, _ in self.hook_entry)
+        for i in range(len(self.new_trace) - 1):
+            call = self.new_trace[i]
+            if call.iclass != InstructionClass.ptic_call:
+                continue
+            if self.new_trace[i + 1].ip != call.ip + call.size:
+                continue
+            between = range(self.trace_idx[i] + 1, self.trace_idx[i + 1] + 1)
+            if any(idx in hooked for idx in between):
+                continue
+            # only plt stubs may have been executed in between
+            if not all(
+                self.test_plt_vdso(self.trace[idx].ip) for idx in between[:-1]
+            ):
+                continue
+            # a traced callee without instructions is a loss of trace
+            target = self.call_target(call)
+            if target is not None and not self.is_traced(target):
+                self.untraced_calls.add(i)
+
+    def call_target(self, call: Instruction) -> Optional[int]:
+        """
+        Destination of a direct call, calls of plt stubs resolve to the
+        imported function. None for indirect calls and unresolved imports.
+        """
+        try:
+            insn = self.project.factory.block(call.ip, num_inst=1).capstone.insns[0]
+        except Exception:
+            return None
+        operands = insn.insn.operands
+        if len(operands) != 1 or operands[0].type != x86_const.X86_OP_IMM:
+            return None
+        target = operands[0].imm  # type: int
+        name = self.plt_names.get(target)
+        if name is None:
+            return target
+        symbol = self.project.loader.find_symbol(name)
+        if symbol is None:
+            return None
+        return symbol.rebased_addr
+
+    def is_traced(self, addr: int) -> bool:
+        # the cpu supports only a few address filters
+        assert self.traced_ranges is not None
+        return any(start <= addr < stop for start, stop in self.traced_ranges)
+
+    def is_untraced_call(self, index: int) -> bool:
+        return index in self.untraced_calls
 
     def filtered_trace(
         self, update: bool = False
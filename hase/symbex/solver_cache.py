@@ -0,0 +1,229 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import claripy
+from angr import SimState
+
+l = logging.getLogger(__name__)
+
+DEFAULT_SIZE = 100000
+# constraint sets of this many recent states are remembered, they are extended
+# by the constraints of the following steps
+CONTEXTS = 64
+# only that many constraints may be added to a remembered constraint set
+MAX_EXTENSION = 8
+SYMBOLIC_LEAVES = {"BVS", "BoolS", "FPS"}
+SCHEMA = "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT)"
+
+
+class Context:
+    """
+    Canonical digest of a list of constraints. Variables are renamed in the
+    order they occur, so the digest does not depend on the counters claripy
+    adds to variable names. `memo` has the digest of every node seen so far.
+    """
+
+    def __init__(
+        self,
+        digest: bytes = b"",
+        names: Optional[Dict[str, str]] = None,
+        memo: Optional[Dict[int, bytes]] = None,
+    ) -> None:
+        self.digest = digest
+        self.names = {} if names is None else names
+        self.memo = {} if memo is None else memo
+
+    def node_digest(self, ast: claripy.ast.Base, memo: Dict[int, bytes]) -> bytes:
+        """
+        New nodes are added to `memo`, which may be a child of `self.memo`
+        """
+        stack = [(ast, False)]
+        while stack:
+            node, expanded = stack.pop()
+            key = hash(node)
+            if key in memo or key in self.memo:
+                continue
+            children = [a for a in node.args if isinstance(a, claripy.ast.Base)]
+            if not expanded and children:
+                stack.append((node, True))
+                # reversed, so that variables are named from left to right
+                stack.extend((child, False) for child in reversed(children))
+                continue
+            args = node.args
+            if node.op in SYMBOLIC_LEAVES:
+                name = self.names.get(args[0])
+                if name is None:
+                    name = self.names[args[0]] = "v%d" % len(self.names)
+                args = (name,) + args[1:]
+            h = hashlib.sha256(node.op.encode("utf-8"))
+            h.update(repr(node.length).encode("utf-8"))
+            for arg in args:
+                if isinstance(arg, claripy.ast.Base):
+                    h.update(memo.get(hash(arg)) or self.memo[hash(arg)])
+                else:
+                    h.update(repr(arg).encode("utf-8"))
+            memo[key] = h.digest()
+        return memo.get(hash(ast)) or self.memo[hash(ast)]
+
+    def extend(self, constraints: List[claripy.ast.Bool]) -> "Context":
+        context = Context(self.digest, dict(self.names), dict(self.memo))
+        # chained, so extending gives the same digest as starting from scratch
+        for constraint in constraints:
+            digest = context.node_digest(constraint, context.memo)
+            context.digest = hashlib.sha256(context.digest + digest).digest()
+        return context
+
+    def query_digest(self, expression: Optional[claripy.ast.Base]) -> bytes:
+        if expression is None:
+            return self.digest
+        # variables only occurring in the expression are not remembered
+        context = Context(self.digest, dict(self.names), self.memo)
+        digest = context.node_digest(expression, {})
+        return hashlib.sha256(self.digest + digest).digest()
+
+
+def constraint_key(constraints: List[claripy.ast.Bool]) -> Tuple[int, ...]:
+    return tuple(hash(c) for c in constraints)
+
+
+class SolverCache:
+    """
+    Results of solver queries keyed by the canonical digest of the constraints
+    of a state and the queried expression. The most recently used results are
+    kept in memory, with `path` they are also stored in a sqlite database
+    shared by all replays. The cache can be used from several threads.
+    """
+
+    def __init__(self, size: int = DEFAULT_SIZE, path: Optional[Path] = None) -> None:
+        self.size = size
+        self.results = OrderedDict()  # type: OrderedDict
+        self.contexts = OrderedDict()  # type: OrderedDict
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.RLock()
+        self.path = path
+        self.db = None  # type: Optional[sqlite3.Connection]
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self.db = sqlite3.connect(str(path), check_same_thread=False)
+            with self.db:
+                self.db.execute(SCHEMA)
+
+    def close(self) -> None:
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def stats(self) -> Dict[str, int]:
+        return dict(hits=self.hits, misses=self.misses, size=len(self.results))
+
+    def context(self, constraints: List[claripy.ast.Bool]) -> Context:
+        key = constraint_key(constraints)
+        context = self.contexts.get(key)
+        if context is None:
+            # usually the previous step had the same constraints but the last
+            parent = Context()
+            parent_size = 0
+            for size in range(len(key) - 1, max(len(key) - MAX_EXTENSION, 0) - 1, -1):
+                if key[:size] in self.contexts:
+                    parent = self.contexts[key[:size]]
+                    parent_size = size
+                    break
+            context = parent.extend(constraints[parent_size:])
+            self.contexts[key] = context
+            if len(self.contexts) > CONTEXTS:
+                self.contexts.popitem(last=False)
+        else:
+            self.contexts.move_to_end(key)
+        return context
+
+    def key(
+        self, kind: str, state: SimState, expression: Optional[claripy.ast.Base]
+    ) -> str:
+        context = self.context(state.solver.constraints)
+        return kind + ":" + context.query_digest(expression).hex()
+
+    def lookup(self, key: str) -> Optional[Any]:
+        if key in self.results:
+            self.results.move_to_end(key)
+            self.hits += 1
+            return self.results[key]
+        if self.db is not None:
+            row = self.db.execute(
+                "SELECT value FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                self.hits += 1
+                value = json.loads(row[0])
+                self.remember(key, value, persist=False)
+                return value
+        self.misses += 1
+        return None
+
+    def remember(self, key: str, value: Any, persist: bool = True) -> None:
+        self.results[key] = value
+        if len(self.results) > self.size:
+            self.results.popitem(last=False)
+        if persist and self.db is not None:
+            with self.db:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO results VALUES (?, ?)",
+                    (key, json.dumps(value)),
+                )
+
+    def eval(self, state: SimState, expression: claripy.ast.Base) -> Any:
+        """
+        Same as `state.solver.eval(expression)`
+        """
+        if not expression.symbolic:
+            return state.solver.eval(expression)
+        with self.lock:
+            key = self.key("eval", state, expression)
+            value = self.lookup(key)
+        if value is None:
+            value = state.solver.eval(expression)
+            with self.lock:
+                self.remember(key, value)
+        return value
+
+    def satisfiable(self, state: SimState) -> bool:
+        """
+        Same as `state.solver.satisfiable()`
+        """
+        with self.lock:
+            key = self.key("sat", state, None)
+            value = self.lookup(key)
+        if value is None:
+            value = state.solver.satisfiable()
+            with self.lock:
+                self.remember(key, value)
+        return value
+
+
+_default = None  # type: Optional[SolverCache]
+
+
+def default_cache() -> SolverCache:
+    """
+    Cache shared by the replays of this process. If HASE_SOLVER_CACHE is set,
+    results are also stored in this file.
+    """
+    global _default
+    if _default is None:
+        path = os.environ.get("HASE_SOLVER_CACHE")
+        _default = SolverCache(path=None if path is None else Path(path))
+    return _default
+
+
+def set_default_cache(cache: SolverCache) -> None:
+    global _default
+    if _default is not None and _default is not cache:
+        _default.close()
+    _default = cache
@@ -1,13 +1,12 @@
-import ctypes as ct
-from typing import List
+from typing import Dict, List, Tuple, Union
 
 from angr import Project, SimState
 from angr import sim_options as so
-from archinfo import Endness
 
+from ..core_file import PF_W, Coredump
 from ..pt import Instruction, InstructionClass
-from ..pwn_wrapper import Coredump
 from .cdanalyzer import CoredumpAnalyzer
+from .core_memory import CoredumpMemory
 from .rspsolver import solve_rsp
 
 ADD_OPTIONS = {
@@ -34,31 +33,115 @@ REMOVE_SIMPLIFICATIONS = {
     # so.ALL_FILES_EXIST, # the problem is, when having this, simfd either None or exist, no If
 } | so.simplification
 
+# so.UNICORN itself is only set while the tracer executes concrete segments,
+# see Tracer.execute_concrete
+UNICORN_OPTIONS = {so.UNICORN_SYM_REGS_SUPPORT, so.UNICORN_TRACK_BBL_ADDRS}
 
-def _setup_argv(state: SimState, coredump: Coredump) -> SimState:
-    # argv follows argc
-    argv_addr = coredump.argc_address + ct.sizeof(ct.c_int)
+# registers of the window start state that are symbolic unless they are known
+WINDOW_REGISTERS = [
+    "rax",
+    "rbx",
+    "rcx",
+    "rdx",
+    "rsi",
+    "rdi",
+    "rbp",
+    "r8",
+    "r9",
+    "r10",
+    "r11",
+    "r12",
+    "r13",
+    "r14",
+    "r15",
+]
+
+
+def initial_stack(coredump: Coredump) -> List[Tuple[int, int]]:
+    """
+    argc, argv, the environment and the auxiliary vector, which the kernel
+    put on the stack before the program started
+    """
     # TODO: if argv is modified by users, this won't help
-    for i, arg in enumerate(coredump.argv):
-        state.memory.store(argv_addr + i * 8, arg, endness=Endness.LE)
-        state.memory.store(arg, coredump.string(arg)[::-1], endness=Endness.LE)
+    if coredump.argc_address is None or coredump.stack is None:
+        return []
+    return [(coredump.argc_address, coredump.stack.stop)]
 
 
 def create_start_state(
-    project: Project, trace: List[Instruction], cdanalyzer: CoredumpAnalyzer
+    project: Project,
+    trace: List[Instruction],
+    cdanalyzer: CoredumpAnalyzer,
+    unicorn: bool = False,
 ) -> SimState:
     start_address = trace[0].ip
+    add_options = ADD_OPTIONS | UNICORN_OPTIONS if unicorn else ADD_OPTIONS
 
     coredump = cdanalyzer.coredump
-    args = [coredump.argc]
+    args = [coredump.argc]  # type: List[Union[int, bytes]]
     args += [coredump.string(argv) for argv in coredump.argv]
+    memory = CoredumpMemory(
+        coredump=coredump,
+        ranges=initial_stack(coredump),
+        memory_backer=project.loader.memory,
+        memory_id="mem",
+    )
     state = project.factory.call_state(
         start_address,
         *args,
-        add_options=ADD_OPTIONS,
-        remove_options=REMOVE_SIMPLIFICATIONS
+        add_options=add_options,
+        remove_options=REMOVE_SIMPLIFICATIONS,
+        plugins=dict(memory=memory)
     )
     rsp, _ = solve_rsp(state, cdanalyzer)
     state.regs.rsp = rsp
-    _setup_argv(state, coredump)
+    return state
+
+
+def _load_writable_mappings(state: SimState, coredump: Coredump) -> None:
+    # data and bss of the binaries are backed by the loader, but the content
+    # at the crash is closer to the state inside the window
+    for mapping in coredump.mappings:
+        if not mapping.path.startswith("/") or not mapping.flags & PF_W:
+            continue
+        size = mapping.stop - mapping.start
+        for start, stop in coredump.dumped_ranges(mapping.start, size):
+            state.memory.store(start, coredump.read(start, stop - start))
+
+
+def create_window_state(
+    project: Project,
+    trace: List[Instruction],
+    coredump: Coredump,
+    registers: Dict[str, int],
+    unicorn: bool = False,
+) -> SimState:
+    """
+    Start state for a trace that begins shortly before the crash, see
+    `Tracer.select_window`. `registers` are the registers known at trace[0],
+    the others are symbolic. Memory reads the content of the coredump until
+    it is written, these values are marked as `CrashValue`.
+    """
+    add_options = ADD_OPTIONS | UNICORN_OPTIONS if unicorn else ADD_OPTIONS
+    memory = CoredumpMemory(
+        coredump=coredump,
+        annotate=True,
+        memory_backer=project.loader.memory,
+        memory_id="mem",
+    )
+    state = project.factory.blank_state(
+        addr=trace[0].ip,
+        add_options=add_options,
+        remove_options=REMOVE_SIMPLIFICATIONS,
+        plugins=dict(memory=memory),
+    )
+    for name in WINDOW_REGISTERS:
+        value = registers.get(name)
+        if value is None:
+            value = state.solver.BVS("window_" + name, 64)
+        setattr(state.regs, name, value)
+    state.regs.rsp = registers["rsp"]
+    # the thread pointer does not change
+    state.regs.fs = coredump.registers["fs_base"]
+    _load_writable_mappings(state, coredump)
     return state
@@ -1,5 +1,9 @@
 import bisect
-from typing import Any, List, Optional, Tuple
+import logging
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 
 from angr import SimState
 from claripy.ast.bv import BV
@@ -7,6 +11,63 @@ from cle import ELF
 
 from ..annotate import Addr2line
 from ..pt import Instruction
+from .solver_cache import default_cache
+
+l = logging.getLogger(__name__)
+
+# recomputed states that are kept, least recently used ones are evicted
+MAX_RECOMPUTED = 1000
+# a recomputed state becomes a checkpoint, if it is that far away from the
+# previous one and its segment was recomputed that often
+PROMOTE_DISTANCE = 50
+PROMOTE_ACCESSES = 2
+# estimated memory of one page of a state, memory objects take more space
+# than the bytes they represent
+PAGE_COST = 4 * 4096
+# states on either side of the active one that are computed in the background
+PREFETCH_RADIUS = 16
+# major states recorded by `Tracer.run`
+CHECKPOINTS = 200
+# the gap between the first checkpoints is that many times larger than the
+# gap between the checkpoints right before the crash
+CRASH_DENSITY = 8.0
+
+
+def checkpoint_indices(
+    length: int, count: int = CHECKPOINTS, density: float = CRASH_DENSITY
+) -> List[int]:
+    """
+    Indices of about `count` checkpoints in a trace of `length` instructions.
+    Gaps grow linearly with the distance from the end of the trace, with
+    `density` 1 the checkpoints are evenly spaced.
+    """
+    count = max(1, min(count, length))
+    weights = [1 + (density - 1) * i / max(count - 1, 1) for i in range(count)]
+    scale = length / sum(weights)
+    indices = {0}
+    position = float(length)
+    for weight in weights:
+        position -= weight * scale
+        indices.add(max(0, int(round(position))))
+    return sorted(indices)
+
+
+def simstate_pages(simstate: Optional[SimState]) -> Set[int]:
+    """
+    Pages of memory and registers. Pages are shared between states until they
+    are written, so they are identified by the object.
+    """
+    pages = set()  # type: Set[int]
+    if simstate is None:
+        return pages
+    for name in ("memory", "registers"):
+        mem = getattr(getattr(simstate, name, None), "mem", None)
+        pages.update(id(page) for page in getattr(mem, "_pages", {}).values())
+    return pages
+
+
+def state_pages(state: "State") -> Set[int]:
+    return simstate_pages(state.from_simstate) | simstate_pages(state.to_simstate)
 
 
 class Register:
@@ -73,7 +134,7 @@ class State:
         return self.from_simstate
 
     def eval(self, expression: BV) -> Any:
-        return self.simstate.solver.eval(expression)
+        return default_cache().eval(self.simstate, expression)
 
     def __repr__(self) -> str:
         if self.from_instruction is None:
@@ -108,14 +169,143 @@ class State:
         return a.compute()[self.simstate.addr]
 
 
+class Prefetcher:
+    """
+    Computes the states around the most recently requested one and the
+    midpoints of the adjacent segments between major states in a background
+    thread. A new request or an access to the state manager cancels the work
+    of the previous request.
+    """
+
+    def __init__(self, states: "StateManager", radius: int = PREFETCH_RADIUS) -> None:
+        self.states = states
+        self.radius = radius
+        self.condition = threading.Condition()
+        self.jobs = []  # type: List[int]
+        self.generation = 0
+        self.busy = False
+        self.running = True
+        self.thread = threading.Thread(
+            target=self.run, name="state-prefetch", daemon=True
+        )
+        self.thread.start()
+
+    def jobs_for(self, index: int) -> List[int]:
+        # nearest states first, the step back is the cheapest to go to
+        candidates = []  # type: List[int]
+        for distance in range(1, self.radius + 1):
+            candidates.extend((index + distance, index - distance))
+        major = self.states.major_index
+        pos = bisect.bisect_right(major, index) - 1
+        for p in (pos, pos - 1, pos + 1):
+            if 0 <= p < len(major) - 1:
+                candidates.append((major[p] + major[p + 1]) // 2)
+        length = len(self.states.index_to_state)
+        jobs = []  # type: List[int]
+        for i in candidates:
+            if 0 <= i < length and self.states.index_to_state[i] is None:
+                if i not in jobs:
+                    jobs.append(i)
+        return jobs
+
+    def request(self, index: int) -> None:
+        with self.condition:
+            self.generation += 1
+            self.jobs = self.jobs_for(index)
+            self.condition.notify_all()
+
+    def cancel(self) -> None:
+        with self.condition:
+            self.generation += 1
+            self.jobs = []
+            self.condition.notify_all()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until all requested states are computed
+        """
+        with self.condition:
+            return self.condition.wait_for(
+                lambda: not (self.jobs or self.busy), timeout
+            )
+
+    def close(self) -> None:
+        with self.condition:
+            self.running = False
+            self.generation += 1
+            self.condition.notify_all()
+        self.thread.join()
+
+    def run(self) -> None:
+        while True:
+            with self.condition:
+                while self.running and not self.jobs:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                index = self.jobs.pop(0)
+                generation = self.generation
+                self.busy = True
+
+            def cancelled() -> bool:
+                return self.generation != generation
+
+            try:
+                with self.states.lock:
+                    if not cancelled():
+                        self.states.materialize(index, cancelled)
+            except Exception:
+                l.exception("failed to prefetch state %d", index)
+            finally:
+                with self.condition:
+                    self.busy = False
+                    self.condition.notify_all()
+
+
 class StateManager:
-    def __init__(self, tracer: Any, length: int) -> None:
+    """
+    States recorded by the tracer are checkpoints, the states in between are
+    recomputed from the previous checkpoint when they are accessed. At most
+    `max_recomputed` recomputed states and with `memory_budget` at most that
+    many bytes (estimated, see `memory_usage`) of recomputed states are kept.
+    Segments between checkpoints that are recomputed repeatedly get another
+    checkpoint. `prefetch` computes the neighbours of a state in the
+    background, see `Prefetcher`.
+
+    The time to compute each segment is recorded, see `recompute_cost`. With
+    `max_latency` (seconds) recomputed segments keep a checkpoint whenever the
+    estimated cost since the last one would exceed it, so later accesses to
+    the segment take about `max_latency` at most.
+    """
+
+    def __init__(
+        self,
+        tracer: Any,
+        length: int,
+        max_recomputed: int = MAX_RECOMPUTED,
+        memory_budget: Optional[int] = None,
+        max_latency: Optional[float] = None,
+    ) -> None:
         self.tracer = tracer
         self.index_to_state = [None] * length  # type: List[Optional[State]]
         # Better have something like skip-table
         self.ordered_index = []  # type: List[int]
         self.major_index = []  # type: List[int]
         self.last_main_state = None  # type: Optional[State]
+        self.max_recomputed = max_recomputed
+        self.memory_budget = memory_budget
+        # index -> estimated size, least recently used first
+        self.recomputed = OrderedDict()  # type: OrderedDict
+        self.recomputed_size = 0
+        # recomputed states that became checkpoints
+        self.promoted = set()  # type: Set[int]
+        self.segment_accesses = Counter()  # type: Counter
+        self.max_latency = max_latency
+        # checkpoint -> (executed instructions, seconds)
+        self.segment_costs = {}  # type: Dict[int, Tuple[int, float]]
+        # states are computed by the caller and the prefetch thread
+        self.lock = threading.RLock()
+        self.prefetcher = None  # type: Optional[Prefetcher]
 
     def add(self, state: State) -> None:
         self.index_to_state[state.index] = state
@@ -126,6 +316,150 @@ class StateManager:
         self.add(state)
         bisect.insort_left(self.major_index, state.index)
 
+    def discard_after(self, index: int) -> None:
+        """
+        Forget the states after `index`, i.e. to compute them again
+        """
+        pos = bisect.bisect_right(self.ordered_index, index)
+        for i in self.ordered_index[pos:]:
+            self.index_to_state[i] = None
+        del self.ordered_index[pos:]
+        del self.major_index[bisect.bisect_right(self.major_index, index) :]
+        for i in [i for i in self.recomputed if i > index]:
+            self.recomputed_size -= self.recomputed.pop(i)
+        self.promoted = {i for i in self.promoted if i <= index}
+        for i in [i for i in self.segment_costs if i > index]:
+            del self.segment_costs[i]
+
+    @property
+    def checkpoints(self) -> List[int]:
+        return sorted(set(self.major_index) | self.promoted)
+
+    def memory_usage(self) -> Dict[int, int]:
+        """
+        Estimated memory of every checkpoint in bytes. Pages shared with the
+        previous checkpoint are not counted, recomputed states are counted
+        with the checkpoint they were computed from.
+        """
+        usage = {}  # type: Dict[int, int]
+        previous = set()  # type: Set[int]
+        checkpoints = self.checkpoints
+        for checkpoint in checkpoints:
+            state = self.index_to_state[checkpoint]
+            assert state is not None
+            pages = state_pages(state)
+            usage[checkpoint] = len(pages - previous) * PAGE_COST
+            previous = pages
+        for index in self.recomputed:
+            state = self.index_to_state[index]
+            assert state is not None
+            checkpoint = checkpoints[bisect.bisect_right(checkpoints, index) - 1]
+            usage[checkpoint] += self.recomputed[index]
+        return usage
+
+    def segment(self, index: int) -> int:
+        """
+        Checkpoint the segment containing `index` starts at
+        """
+        checkpoints = self.checkpoints
+        return checkpoints[max(bisect.bisect_right(checkpoints, index) - 1, 0)]
+
+    def record_cost(self, start: int, instructions: int, seconds: float) -> None:
+        if instructions <= 0:
+            return
+        segment = self.segment(start)
+        executed, total = self.segment_costs.get(segment, (0, 0.0))
+        self.segment_costs[segment] = (executed + instructions, total + seconds)
+
+    def step_cost(self, segment: int) -> Optional[float]:
+        """
+        Estimated seconds per instruction, segments that were not measured yet
+        get the average of all segments
+        """
+        if segment in self.segment_costs:
+            executed, seconds = self.segment_costs[segment]
+            return seconds / executed
+        executed = sum(c[0] for c in self.segment_costs.values())
+        if executed == 0:
+            return None
+        return sum(c[1] for c in self.segment_costs.values()) / executed
+
+    def recompute_cost(self, source: int, index: int) -> float:
+        """
+        Estimated seconds to compute the state at `index` from the one at
+        `source`, the number of instructions if nothing was measured yet
+        """
+        checkpoints = self.checkpoints
+        pos = max(bisect.bisect_right(checkpoints, source) - 1, 0)
+        cost = 0.0
+        position = source
+        while position < index:
+            end = index
+            if pos + 1 < len(checkpoints):
+                end = min(checkpoints[pos + 1], index)
+            step_cost = self.step_cost(checkpoints[pos])
+            cost += (end - position) * (1.0 if step_cost is None else step_cost)
+            position = end
+            pos += 1
+        return cost
+
+    def source(self, index: int) -> int:
+        """
+        Nearest stored state before `index`, which the state at `index` is
+        computed from: recomputed, prefetched and promoted states are used as
+        well as checkpoints. See `recompute_cost` for the estimated time.
+        """
+        return self.ordered_index[bisect.bisect_left(self.ordered_index, index) - 1]
+
+    def latency_spacing(self, segment: int) -> Optional[int]:
+        """
+        Instructions between the checkpoints kept while recomputing, None
+        without `max_latency` or before anything was measured
+        """
+        if self.max_latency is None:
+            return None
+        step_cost = self.step_cost(segment)
+        if step_cost is None or step_cost == 0:
+            return None
+        return max(PROMOTE_DISTANCE, int(self.max_latency / step_cost))
+
+    def add_recomputed(self, state: State, previous: Optional[State]) -> None:
+        self.add(state)
+        pages = state_pages(state)
+        if previous is not None:
+            pages -= state_pages(previous)
+        size = len(pages) * PAGE_COST
+        self.recomputed[state.index] = size
+        self.recomputed_size += size
+
+    def use(self, index: int) -> None:
+        if index in self.recomputed:
+            self.recomputed.move_to_end(index)
+
+    def evict(self) -> None:
+        """
+        Drops least recently used recomputed states until the limits are met
+        """
+        while len(self.recomputed) > 1 and (
+            len(self.recomputed) > self.max_recomputed
+            or (
+                self.memory_budget is not None
+                and self.recomputed_size > self.memory_budget
+            )
+        ):
+            index, size = self.recomputed.popitem(last=False)
+            self.recomputed_size -= size
+            self.index_to_state[index] = None
+            del self.ordered_index[bisect.bisect_left(self.ordered_index, index)]
+
+    def promote(self, index: int) -> None:
+        """
+        Keep a recomputed state as checkpoint
+        """
+        if index in self.recomputed:
+            self.recomputed_size -= self.recomputed.pop(index)
+        self.promoted.add(index)
+
     @property
     def major_states(self) -> List[State]:
         states = []
@@ -147,33 +481,85 @@ class StateManager:
     def __len__(self) -> int:
         return len(self.ordered_index)
 
-    def __getitem__(self, index: int) -> Tuple[State, bool]:
+    def prefetch(self, index: int, radius: int = PREFETCH_RADIUS) -> None:
+        """
+        Compute the states around `index` in the background
+        """
+        if self.prefetcher is None:
+            self.prefetcher = Prefetcher(self, radius)
+        self.prefetcher.request(index)
+
+    def stop_prefetch(self) -> None:
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+            self.prefetcher = None
+
+    def materialize(
+        self, index: int, cancelled: Optional[Callable[[], bool]] = None
+    ) -> Optional[Tuple[State, bool]]:
+        """
+        Computes the state at `index` if it is not stored. Returns None if
+        `cancelled` returns True before the state was reached, the states
+        computed so far are kept. The caller holds `lock`.
+        """
         is_new = False
         pos = bisect.bisect_left(self.ordered_index, index)
-        if self.ordered_index[pos] != index:
-            print("Computing new states")
+        if pos == len(self.ordered_index) or self.ordered_index[pos] != index:
+            if cancelled is None:
+                print("Computing new states")
             is_new = True
-            start_pos = self.ordered_index[pos - 1]
+            start_pos = self.source(index)
             state = self.index_to_state[start_pos]
             assert state is not None
             simstate = state.simstate
             diff = index - start_pos
+            spacing = self.latency_spacing(self.segment(start_pos))
+            begin = time.time()
             for i in range(diff):
+                if cancelled is not None and cancelled():
+                    self.record_cost(start_pos, i, time.time() - begin)
+                    return None
                 from_instruction = self.tracer.trace[start_pos + i]
                 to_instruction = self.tracer.trace[start_pos + i + 1]
+                # the position of from_instruction, not of the requested state:
+                # untraced calls are looked up by it
                 from_simstate, simstate = self.tracer.execute(
-                    simstate, from_instruction, to_instruction, index
+                    simstate, from_instruction, to_instruction, start_pos + i
+                )
+                new_state = State(
+                    start_pos + i + 1,
+                    from_instruction,
+                    to_instruction,
+                    from_simstate,
+                    simstate,
                 )
                 if diff - i < 15:
-                    self.add(
-                        State(
-                            start_pos + i + 1,
-                            from_instruction,
-                            to_instruction,
-                            from_simstate,
-                            simstate,
-                        )
-                    )
+                    self.add_recomputed(new_state, state)
+                    state = new_state
+                elif spacing is not None and (i + 1) % spacing == 0:
+                    # keeps the latency of later accesses to this segment low
+                    self.add(new_state)
+                    self.promoted.add(new_state.index)
+            self.record_cost(start_pos, diff, time.time() - begin)
+            # prefetched segments do not count as accessed
+            if diff >= PROMOTE_DISTANCE and cancelled is None:
+                checkpoints = self.checkpoints
+                segment = checkpoints[bisect.bisect_right(checkpoints, index) - 1]
+                self.segment_accesses[segment] += 1
+                if self.segment_accesses[segment] >= PROMOTE_ACCESSES:
+                    del self.segment_accesses[segment]
+                    self.promote(index)
+        self.use(index)
+        self.evict()
         state = self.index_to_state[index]
         assert state is not None
         return state, is_new
+
+    def __getitem__(self, index: int) -> Tuple[State, bool]:
+        # the requested state has priority over prefetching
+        if self.prefetcher is not None:
+            self.prefetcher.cancel()
+        with self.lock:
+            result = self.materialize(index)
+        assert result is not None
+        return result
@@ -4,28 +4,53 @@ import logging
 import time
 from collections import deque
 from pathlib import Path
-from typing import Any, Callable, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 
 import angr
 import archinfo
 from angr import Block, Project, SimState
+from angr import sim_options as so
 from angr.engines.successors import SimSuccessors
 from cle.backends.elf.metaelf import MetaELF
 from capstone import x86_const
 
+from ..core_file import Coredump, Mapping
 from ..errors import HaseError
 from ..loader import Loader
 from ..progress_log import ProgressLog
 from ..pt import Instruction, InstructionClass
-from ..pwn_wrapper import ELF, Coredump, Mapping
+from ..pwn_wrapper import ELF
 from .cdanalyzer import CoredumpAnalyzer
 from .filter import FilterTrace
 from .hook import setup_project_hook
-from .start_state import create_start_state
-from .state import State, StateManager
+from .solver_cache import default_cache
+from .start_state import create_start_state, create_window_state
+from .state import (
+    CHECKPOINTS,
+    CRASH_DENSITY,
+    State,
+    StateManager,
+    checkpoint_indices,
+)
 
 l = logging.getLogger(__name__)
 
+# VEX lifts at most 99 instructions into one block
+MAX_BLOCK_INSTRUCTIONS = 64
+# shorter segments are not worth starting unicorn for
+MIN_CONCRETE_INSTRUCTIONS = 32
+# at most this many steps are executed without checking satisfiability, the
+# states are kept to find the first unsatisfiable one
+MAX_UNCHECKED_STEPS = 50
+# instructions unicorn can execute without help from the symbolic engine
+CONCRETE_CLASSES = {
+    InstructionClass.ptic_other,
+    InstructionClass.ptic_call,
+    InstructionClass.ptic_return,
+    InstructionClass.ptic_jump,
+    InstructionClass.ptic_cond_jump,
+}
+
 
 def constrain_registers(state: State, coredump: Coredump) -> bool:
     # FIXME: if exception caught is omitted by hook?
@@ -66,6 +91,58 @@ def constrain_registers(state: State, coredump: Coredump) -> bool:
     return False
 
 
+def is_alloca(insn: Any) -> bool:
+    # sub rsp, reg
+    return (
+        insn.mnemonic == "sub"
+        and insn.operands[0].reg in (x86_const.X86_REG_RSP, x86_const.X86_REG_RBP)
+        and insn.operands[1].type == 1
+    )
+
+
+class ConcreteSegment:
+    """
+    Statistics of one attempt to execute trace[start:end] with unicorn
+    """
+
+    def __init__(self, start: int, end: int, concrete: bool, seconds: float) -> None:
+        self.start = start
+        self.end = end
+        # False if unicorn left the trace or stopped at symbolic data, the
+        # segment was executed symbolically then
+        self.concrete = concrete
+        self.seconds = seconds
+
+    @property
+    def instructions(self) -> int:
+        return self.end - self.start
+
+    def __repr__(self) -> str:
+        kind = "concrete" if self.concrete else "symbolic"
+        return "<ConcreteSegment %d-%d %s %.3fs>" % (
+            self.start,
+            self.end,
+            kind,
+            self.seconds,
+        )
+
+
+def skip_untraced_call(state: SimState, instruction: Instruction) -> SimState:
+    # The callee was not traced (ip filtering), we continue after the call
+    # and treat the return value as unknown.
+    new_state = state.copy()
+    new_state.regs.ip = instruction.ip
+    new_state.regs.rax = new_state.solver.BVS("untraced_call_rax", 64)
+    new_state.regs.rdx = new_state.solver.BVS("untraced_call_rdx", 64)
+    return new_state
+
+
+def followed_trace(expected: List[int], executed: List[int]) -> bool:
+    # every branch target of the trace was executed in the same order
+    blocks = iter(executed)
+    return all(address in blocks for address in expected)
+
+
 def repair_syscall_jump(state_block: Any, step: SimSuccessors) -> SimState:
     capstone = state_block.capstone
     first_ins = capstone.insns[0].insn
@@ -87,8 +164,49 @@ class Tracer:
         coredump: Coredump,
         loader: Loader,
         name: str = "(unamed)",
+        traced_ranges: Optional[List[Tuple[int, int]]] = None,
+        block_step: bool = True,
+        unicorn: bool = False,
+        window: Optional[int] = None,
+        sat_interval: int = 1,
+        memory_budget: Optional[int] = None,
+        checkpoints: int = CHECKPOINTS,
+        crash_density: float = CRASH_DENSITY,
+        max_latency: Optional[float] = None,
     ) -> None:
+        """
+        With `block_step` straight-line code is executed block by block
+        instead of instruction by instruction, see `straight_line_run`.
+        With `unicorn` concrete parts of the trace are executed natively, see
+        `concrete_checkpoint`.
+        With `window` only about the last `window` instructions of the trace
+        are replayed, see `select_window`.
+        `sat_interval` is the number of steps after which `run` checks that
+        the constraints are satisfiable, 0 checks at conditional jumps only.
+        See `check_unchecked`.
+        `memory_budget` limits the memory of states recomputed after `run`,
+        see `StateManager`.
+        `run` records `checkpoints` major states, `crash_density` times more
+        densely before the crash than at the start, see `checkpoint_indices`.
+        `max_latency` bounds the time to compute a state after `run`, see
+        `StateManager`.
+        """
         self.name = name
+        self.block_step = block_step
+        self.unicorn = unicorn
+        self.concrete_segments = []  # type: List[ConcreteSegment]
+        self.sat_interval = sat_interval
+        self.memory_budget = memory_budget
+        self.checkpoints = checkpoints
+        self.crash_density = crash_density
+        self.max_latency = max_latency
+        self.solver_cache = default_cache()
+        self.sat_checks = 0
+        # steps of `run` whose satisfiability was not checked yet, None if
+        # every step is checked immediately
+        self.unchecked = (
+            None
+        )  # type: Optional[List[Tuple[int, SimState, SimState]]]
         self.executable = executable
         # we keep this for debugging in ipdb
         self.loader = loader
@@ -124,6 +242,13 @@ class Tracer:
             self.project, self.cdanalyzer.gdb
         )
 
+        # index of the first replayed instruction in the trace since main
+        self.window_start = 0
+        window_registers = None  # type: Optional[Dict[str, int]]
+        if window is not None:
+            self.window_start, window_registers = self.select_window(window)
+            self.trace = self.trace[self.window_start :]
+
         self.filter = FilterTrace(
             self.project,
             self.trace,
@@ -132,6 +257,7 @@ class Tracer:
             omitted_section,
             elf.statically_linked,
             name,
+            traced_ranges,
         )
 
         self.old_trace = self.trace
@@ -145,7 +271,14 @@ class Tracer:
         self.hook_plt_idx = list(self.hook_target.keys())
         self.hook_plt_idx.sort()
         self.filter.entry_check()
-        self.start_state = create_start_state(self.project, self.trace, self.cdanalyzer)
+        if window_registers is None:
+            self.start_state = create_start_state(
+                self.project, self.trace, self.cdanalyzer, unicorn
+            )
+        else:
+            self.start_state = create_window_state(
+                self.project, self.trace, self.coredump, window_registers, unicorn
+            )
         self.start_state.inspect.b(
             "call", when=angr.BP_BEFORE, action=self.concretize_indirect_calls
         )
@@ -153,10 +286,48 @@ class Tracer:
             "successor", when=angr.BP_AFTER, action=self.concretize_ip
         )
 
+    def select_window(self, window: int) -> Tuple[int, Optional[Dict[str, int]]]:
+        """
+        Picks the first function entry in the last `window` instructions of
+        the trace, whose call is still on the stack of the crash. Its stack
+        pointer is known from the coredump then. Returns the index of the
+        entry and the registers known there, (0, None) to replay the whole
+        trace if there is no such entry.
+        """
+        loader = self.project.loader
+        names = {bt["func"] for bt in self.cdanalyzer.backtrace}
+        for idx in range(max(1, len(self.trace) - window), len(self.trace)):
+            call = self.trace[idx - 1]
+            ip = self.trace[idx].ip
+            if (
+                call.iclass != InstructionClass.ptic_call
+                or not self.in_main_object(ip)
+                or self.project.is_hooked(ip)
+            ):
+                continue
+            symbol = loader.find_symbol(ip)
+            if symbol is None or symbol.name not in names:
+                continue
+            registers = self.cdanalyzer.entry_registers(
+                symbol.name, call.ip + call.size
+            )
+            if registers is not None:
+                l.info(
+                    "replay the last %d instructions from %s",
+                    len(self.trace) - idx,
+                    symbol.name,
+                )
+                return idx, registers
+        l.warning(
+            "no call in the last %d instructions is on the stack, replay everything",
+            window,
+        )
+        return 0, None
+
     def concretize_indirect_calls(self, state: SimState) -> None:
         assert self.instruction is not None
         if not state.ip.symbolic:
-            ip = state.solver.eval(state.ip)
+            ip = self.solver_cache.eval(state, state.ip)
             assert self.filter.test_plt_vdso(ip) or ip == self.instruction.ip
         state.inspect.function_address = self.instruction.ip
 
@@ -262,16 +433,11 @@ class Tracer:
         # Typical usage: alloca(strlen(x))
         capstone = state_block.capstone
         first_ins = capstone.insns[0].insn
-        if first_ins.mnemonic == "sub":
-            if (
-                first_ins.operands[0].reg
-                in (x86_const.X86_REG_RSP, x86_const.X86_REG_RBP)
-                and first_ins.operands[1].type == 1
-            ):
-                reg_name = first_ins.reg_name(first_ins.operands[1].reg)
-                reg_v = getattr(state.regs, reg_name)
-                if state.solver.symbolic(reg_v):
-                    setattr(state.regs, reg_name, state.libc.max_str_len)
+        if is_alloca(first_ins):
+            reg_name = first_ins.reg_name(first_ins.operands[1].reg)
+            reg_v = getattr(state.regs, reg_name)
+            if state.solver.symbolic(reg_v):
+                setattr(state.regs, reg_name, state.libc.max_str_len)
 
     def repair_jump_ins(
         self,
@@ -293,7 +459,7 @@ class Tracer:
                 mem = state.memory.load(state.regs.rsp, 8)
                 jump_target = 0
                 if not state.solver.symbolic(mem):
-                    jump_target = state.solver.eval(mem)
+                    jump_target = self.solver_cache.eval(state, mem)
                 if jump_target != instruction.ip:
                     return True, "ret"
                 else:
@@ -309,7 +475,7 @@ class Tracer:
                     reg_v = getattr(state.regs, reg_name)
                     if (
                         state.solver.symbolic(reg_v)
-                        or state.solver.eval(reg_v) != instruction.ip
+                        or self.solver_cache.eval(state, reg_v) != instruction.ip
                     ):
                         setattr(state.regs, reg_name, instruction.ip)
                         return True, ins
@@ -329,17 +495,18 @@ class Tracer:
                         if state.solver.symbolic(reg_index):
                             return True, ins
                         else:
-                            target += state.solver.eval(reg_index) * mem.scale
+                            index = self.solver_cache.eval(state, reg_index)
+                            target += index * mem.scale
                     if mem.base:
                         reg_base_name = first_ins.reg_name(mem.base)
                         reg_base = getattr(state.regs, reg_base_name)
                         if state.solver.symbolic(reg_base):
                             return True, ins
                         else:
-                            target += state.solver.eval(reg_base)
+                            target += self.solver_cache.eval(state, reg_base)
                     ip_mem = state.memory.load(target, 8, endness="Iend_LE")
                     if not state.solver.symbolic(ip_mem):
-                        jump_target = state.solver.eval(ip_mem)
+                        jump_target = self.solver_cache.eval(state, ip_mem)
                         if jump_target != instruction.ip:
                             return True, ins
                         else:
@@ -350,7 +517,7 @@ class Tracer:
 
     def repair_ip(self, state: SimState) -> int:
         try:
-            addr = state.solver.eval(state._ip)
+            addr = self.solver_cache.eval(state, state._ip)
             # NOTE: repair IFuncResolver
             if (
                 self.project.loader.find_object_containing(addr)
@@ -409,12 +576,61 @@ class Tracer:
         return False
 
     def repair_satness(self, old_state: SimState, new_state: SimState) -> None:
-        if not new_state.solver.satisfiable():
-            new_state.solver._stored_solver = old_state.solver._solver.branch()
-
-            if not self.debug_unsat:
-                self.debug_sat = old_state
-                self.debug_unsat = new_state
+        self.sat_checks += 1
+        if not self.solver_cache.satisfiable(new_state):
+            self.repair_unsat(old_state, new_state)
+
+    def repair_unsat(self, old_state: SimState, new_state: SimState) -> None:
+        new_state.solver._stored_solver = old_state.solver._solver.branch()
+
+        if not self.debug_unsat:
+            self.debug_sat = old_state
+            self.debug_unsat = new_state
+
+    def sat_check_due(self, index: int) -> bool:
+        """
+        True if satisfiability is checked after step `index` of `run`
+        """
+        assert self.unchecked is not None
+        if len(self.unchecked) >= MAX_UNCHECKED_STEPS:
+            return True
+        if index >= len(self.trace) - 16:
+            # the last states are recorded by `run`
+            return True
+        if self.trace[index].iclass == InstructionClass.ptic_cond_jump:
+            return True
+        return self.sat_interval != 0 and index % self.sat_interval == 0
+
+    def check_unchecked(self) -> Optional[Tuple[int, SimState]]:
+        """
+        Checks the steps executed since the last check. Constraints only grow
+        from one step to the next, so it is enough to check the newest state
+        and all states after the first unsatisfiable one are unsatisfiable
+        too. This step is found by bisection and repaired like in
+        `repair_satness`. Returns the index and the state to continue from, the
+        following steps have to be executed again. None if all states are
+        satisfiable.
+        """
+        assert self.unchecked is not None
+        unchecked = self.unchecked
+        self.unchecked = []
+        if len(unchecked) == 0:
+            return None
+        self.sat_checks += 1
+        if self.solver_cache.satisfiable(unchecked[-1][2]):
+            return None
+        low, high = 0, len(unchecked) - 1
+        while low < high:
+            mid = (low + high) // 2
+            self.sat_checks += 1
+            if self.solver_cache.satisfiable(unchecked[mid][2]):
+                low = mid + 1
+            else:
+                high = mid
+        index, old_state, new_state = unchecked[low]
+        l.debug("step %d is unsatisfiable, execute again from there", index)
+        self.repair_unsat(old_state, new_state)
+        return index + 1, new_state
 
     def repair_ip_at_syscall(self, old_block: Block, new_state: SimState) -> None:
         capstone = old_block.capstone
@@ -424,9 +640,12 @@ class Tracer:
             new_state.regs.ip_at_syscall = new_state.ip
 
     def post_execute(
-        self, old_state: SimState, old_block: Block, state: SimState
+        self, old_state: SimState, old_block: Block, state: SimState, index: int
     ) -> None:
-        self.repair_satness(old_state, state)
+        if self.unchecked is None:
+            self.repair_satness(old_state, state)
+        else:
+            self.unchecked.append((index, old_state, state))
         self.repair_ip_at_syscall(old_block, state)
 
     def execute(
@@ -436,8 +655,17 @@ class Tracer:
         instruction: Instruction,
         index: int,
     ) -> Tuple[SimState, SimState]:
+        """
+        Steps from `previous_instruction` to `instruction`, `index` is the
+        position of `previous_instruction` in the (filtered) trace.
+        """
         self.debug_state.append(state)
         state_block = state.block()  # type: Block
+        if self.filter.is_untraced_call(index):
+            new_state = skip_untraced_call(state, instruction)
+            self.post_execute(state, state_block, new_state, index)
+            return state, new_state
+
         force_jump, force_type = self.repair_jump_ins(
             state, state_block, previous_instruction, instruction
         )
@@ -454,7 +682,7 @@ class Tracer:
             logging.exception("Error while finding successor for {}".format(self.name))
             new_state = state.copy()
             new_state.regs.ip = instruction.ip
-            self.post_execute(state, state_block, new_state)
+            self.post_execute(state, state_block, new_state, index)
             return state, new_state
 
         if force_jump:
@@ -484,7 +712,7 @@ class Tracer:
                 if self.jump_match(
                     old_state, choice, previous_instruction, instruction
                 ):
-                    self.post_execute(old_state, state_block, choice)
+                    self.post_execute(old_state, state_block, choice, index)
                     return old_state, choice
             except angr.SimValueError:
                 logging.exception("Error while jumping in {}".format(self.name))
@@ -496,16 +724,176 @@ class Tracer:
     def valid_address(self, address: int) -> bool:
         return self.project.loader.find_object_containing(address)
 
+    def in_main_object(self, address: int) -> bool:
+        loader = self.project.loader
+        return loader.find_object_containing(address) == loader.main_object
+
+    def needs_symbolic_step(self, index: int, checkpoints: Set[int]) -> bool:
+        """
+        True if `run` records the state of this step or the step needs hooks
+        or repairs of `execute`
+        """
+        length = len(self.trace) - 1
+        instruction = self.trace[index]
+        return (
+            index in checkpoints
+            or length - index < 15
+            or instruction.iclass not in CONCRETE_CLASSES
+            or index in self.hook_target
+            or self.filter.is_untraced_call(index)
+            or self.project.is_hooked(instruction.ip)
+            # last step into the main object before leaving it, see
+            # StateManager.last_main_state
+            or (
+                self.in_main_object(self.trace[index + 1].ip)
+                and not self.in_main_object(self.trace[index + 2].ip)
+            )
+        )
+
+    def straight_line_run(self, start: int, checkpoints: Set[int]) -> int:
+        """
+        Number of instructions from trace[start] on that can be executed as
+        one block, 0 if there are too few. The trace has no branches in
+        between, and none of the instructions is hooked or needs a repair in
+        `execute`. The states `run` records are not skipped. The block ends
+        one instruction before the run, which is single-stepped so its state
+        is recorded like in single-step mode.
+        """
+        trace = self.trace
+        end = start
+        while end - start < MAX_BLOCK_INSTRUCTIONS:
+            instruction = trace[end]
+            if (
+                instruction.iclass != InstructionClass.ptic_other
+                or instruction.ip + instruction.size != trace[end + 1].ip
+                or self.needs_symbolic_step(end, checkpoints)
+            ):
+                break
+            end += 1
+        num_inst = end - start - 1
+        if num_inst < 2:
+            return 0
+
+        block = self.project.factory.block(trace[start].ip, num_inst=num_inst)
+        insns = block.capstone.insns
+        # the lifter might stop early, i.e. at rep prefixes
+        num_inst = min(num_inst, len(insns))
+        for i, insn in enumerate(insns[:num_inst]):
+            if insn.address != trace[start + i].ip or is_alloca(insn.insn):
+                num_inst = i
+                break
+        return num_inst if num_inst >= 2 else 0
+
+    def concrete_checkpoint(self, start: int, checkpoints: Set[int]) -> int:
+        """
+        Index up to which unicorn may execute from trace[start] on, `start`
+        if there is none. It is the last branch target before the next step
+        that needs the symbolic engine, whose address does not occur as
+        branch target earlier in the segment, so unicorn stops there and not
+        in an earlier loop iteration.
+        """
+        trace = self.trace
+        seen = {trace[start].ip}
+        checkpoint = start
+        index = start
+        while not self.needs_symbolic_step(index, checkpoints):
+            index += 1
+            if trace[index - 1].iclass == InstructionClass.ptic_other:
+                continue
+            if trace[index].ip not in seen:
+                seen.add(trace[index].ip)
+                checkpoint = index
+        return checkpoint
+
+    def execute_concrete(
+        self, state: SimState, start: int, end: int
+    ) -> Optional[SimState]:
+        """
+        Executes trace[start:end] with unicorn. Returns None if unicorn did
+        not follow the trace up to trace[end], i.e. because it stopped at
+        symbolic data.
+        """
+        self.debug_state.append(state)
+        self.instruction = self.trace[end]
+        expected = [
+            self.trace[i].ip
+            for i in range(start + 1, end)
+            if self.trace[i - 1].iclass != InstructionClass.ptic_other
+        ]
+        unicorn_state = state.copy()
+        unicorn_state.options.add(so.UNICORN)
+        new_state = None  # type: Optional[SimState]
+        begin = time.time()
+        try:
+            step = self.project.factory.successors(
+                unicorn_state, extra_stop_points=[self.instruction.ip]
+            )
+            for choice in step.successors:
+                if choice.addr == self.instruction.ip and followed_trace(
+                    expected, list(choice.history.recent_bbl_addrs)
+                ):
+                    choice.options.discard(so.UNICORN)
+                    new_state = choice
+                    break
+        except Exception:
+            l.debug("unicorn failed at 0x%x", state.addr, exc_info=True)
+        seconds = time.time() - begin
+        segment = ConcreteSegment(start, end, new_state is not None, seconds)
+        l.debug("%s", segment)
+        self.concrete_segments.append(segment)
+        return new_state
+
+    def execute_block(
+        self, state: SimState, start: int, num_inst: int
+    ) -> Optional[SimState]:
+        """
+        Returns None if the block did not end at the next traced instruction,
+        the caller falls back to single-stepping then
+        """
+        self.debug_state.append(state)
+        self.instruction = self.trace[start + num_inst]
+        try:
+            step = self.project.factory.successors(state, num_inst=num_inst)
+            for choice in step.successors:
+                if choice.addr == self.instruction.ip and self.solver_cache.satisfiable(
+                    choice
+                ):
+                    return choice
+        except Exception:
+            l.debug("cannot execute block at 0x%x", state.addr, exc_info=True)
+        return None
+
+    def check_pending(self, states: StateManager) -> Optional[Tuple[int, SimState]]:
+        """
+        `check_unchecked` for `run`, states recorded after the repaired step
+        are dropped
+        """
+        if self.unchecked is None:
+            return None
+        rewind = self.check_unchecked()
+        if rewind is not None:
+            states.discard_after(rewind[0] - 1)
+        return rewind
+
     def run(self) -> StateManager:
         simstate = self.start_state
-        states = StateManager(self, len(self.trace) + 1)
+        states = StateManager(
+            self,
+            len(self.trace) + 1,
+            memory_budget=self.memory_budget,
+            max_latency=self.max_latency,
+        )
         states.add_major(State(0, None, self.trace[0], None, simstate))
-        self.debug_unsat = None  # type: Optional[SimState]
+        self.debug_unsat = None
         self.debug_state = deque(maxlen=50)  # type: deque
         self.skip_addr = {}  # type: Dict[int, int]
-        cnt = -1
-        interval = max(1, len(self.trace) // 200)
         length = len(self.trace) - 1
+        checkpoints = set(
+            checkpoint_indices(length, self.checkpoints, self.crash_density)
+        )
+        # the cost of every segment is the first estimate for recomputing it
+        segment_start = 0
+        segment_begin = time.time()
 
         l.info("start processing trace")
         progress_log = ProgressLog(
@@ -516,23 +904,58 @@ class Tracer:
         )
 
         # prev_instr.ip == state.ip
-        for previous_idx in range(len(self.trace) - 1):
-            previous_instruction = self.trace[previous_idx]
-            if previous_idx + 1 >= len(self.trace):
-                self.instruction = self.trace[previous_idx]
-            else:
-                self.instruction = self.trace[previous_idx + 1]
-
-            cnt += 1
+        cnt = 0
+        next_gc = 0
+        # unicorn is not tried again before this index
+        symbolic_until = 0
+        self.sat_checks = 0
+        if self.sat_interval != 1:
+            self.unchecked = []
+        while cnt < length:
             progress_log.update(cnt)
-            if not cnt % 500:
+            if cnt >= next_gc:
                 gc.collect()
+                next_gc = cnt + 500
+
+            if self.unicorn and cnt >= symbolic_until:
+                checkpoint = self.concrete_checkpoint(cnt, checkpoints)
+                if checkpoint - cnt >= MIN_CONCRETE_INSTRUCTIONS:
+                    rewind = self.check_pending(states)
+                    if rewind is not None:
+                        cnt, simstate = rewind
+                        continue
+                    new_simstate = self.execute_concrete(simstate, cnt, checkpoint)
+                    if new_simstate is not None:
+                        simstate = new_simstate
+                        cnt = checkpoint
+                        continue
+                symbolic_until = max(checkpoint, cnt + 1)
+
+            if self.block_step:
+                num_inst = self.straight_line_run(cnt, checkpoints)
+                if num_inst != 0:
+                    new_simstate = self.execute_block(simstate, cnt, num_inst)
+                    if new_simstate is not None:
+                        # the new state is satisfiable, so are the ones before
+                        if self.unchecked is not None:
+                            self.unchecked = []
+                        simstate = new_simstate
+                        cnt += num_inst
+                        continue
+
+            previous_instruction = self.trace[cnt]
+            self.instruction = self.trace[cnt + 1]
             assert self.valid_address(self.instruction.ip)
             old_simstate, new_simstate = self.execute(
                 simstate, previous_instruction, self.instruction, cnt
             )
             simstate = new_simstate
-            if cnt % interval == 0 or length - cnt < 15:
+            if cnt in checkpoints or length - cnt < 15:
+                now = time.time()
+                states.record_cost(
+                    segment_start, cnt - segment_start, now - segment_begin
+                )
+                segment_start, segment_begin = cnt, now
                 states.add_major(
                     State(
                         cnt,
@@ -542,10 +965,7 @@ class Tracer:
                         new_simstate,
                     )
                 )
-            if (
-                self.project.loader.find_object_containing(self.instruction.ip)
-                == self.project.loader.main_object
-            ):
+            if self.in_main_object(self.instruction.ip):
                 states.last_main_state = State(
                     cnt,
                     previous_instruction,
@@ -553,6 +973,26 @@ class Tracer:
                     old_simstate,
                     new_simstate,
                 )
+            if self.unchecked is not None and self.sat_check_due(cnt):
+                rewind = self.check_pending(states)
+                if rewind is not None:
+                    cnt, simstate = rewind
+                    continue
+            cnt += 1
+
+        self.unchecked = None
+        l.info("%d satisfiability checks for %d steps", self.sat_checks, length)
+        l.info("solver cache: %s", self.solver_cache.stats())
+
+        if self.unicorn:
+            concrete = [s for s in self.concrete_segments if s.concrete]
+            l.info(
+                "unicorn executed %d of %d instructions in %d segments, %d fell back",
+                sum(s.instructions for s in concrete),
+                length,
+                len(concrete),
+                len(self.concrete_segments) - len(concrete),
+            )
 
         constrain_registers(states.major_states[-1], self.coredump)
 
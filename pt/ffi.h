@@ -11,6 +11,8 @@ struct decoder_config {
   uint8_t cpu_model;
   uint8_t cpu_stepping;
   uint32_t cpuid_0x15_eax, cpuid_0x15_ebx;
+  uint8_t mtc_freq;
+  uint8_t nom_freq;
   size_t shared_object_count;
   struct decoder_shared_object *shared_objects;
 };
@@ -21,7 +21,8 @@ std::tuple<int, std::optional<Setup>> getSetup(struct decoder_config &c) {
   config.cpu.stepping = c.cpu_stepping;
   config.cpuid_0x15_eax = c.cpuid_0x15_eax;
   config.cpuid_0x15_ebx = c.cpuid_0x15_ebx;
-  config.mtc_freq = 2;
+  config.mtc_freq = c.mtc_freq;
+  config.nom_freq = c.nom_freq;
   // trace buffer
   config.begin = nullptr;
   config.end = nullptr;
@@ -0,0 +1,84 @@
+"""
+Benchmarks writing a snapshot, archiving it and replaying it without intel pt:
+the per-cpu buffers are filled from the trace of an existing report.
+
+    python -m tests.benchmark.snapshot_pipeline tests/traces/loopy-*.tar.gz
+"""
+import argparse
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Callable, Dict, List, TypeVar
+
+from hase import archive
+from hase.perf import Perf
+from hase.perf.captured import CapturedSnapshot
+from hase.record import serialize_trace
+from hase.replay import create_tracer, unpack
+
+T = TypeVar("T")
+
+
+def timed(timings: Dict[str, float], name: str, fn: Callable[[], T]) -> T:
+    start = time.perf_counter()
+    result = fn()
+    timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+    return result
+
+
+def run(report: str, repeat: int, replay: bool) -> Dict[str, float]:
+    timings = {}  # type: Dict[str, float]
+    with TemporaryDirectory() as tempdir:
+        root = Path(tempdir)
+        archive_root = root.joinpath("report")
+        archive_root.mkdir()
+        manifest = unpack(report, archive_root)
+        captured = manifest["trace"]
+        for i in range(repeat):
+            state_dir = root.joinpath("state-%d" % i)
+            state_dir.mkdir()
+            snapshot = timed(
+                timings, "fill", lambda: CapturedSnapshot(captured, archive_root)
+            )
+            with Perf(snapshot=snapshot) as perf:
+                trace = timed(timings, "write", lambda: perf.write(str(state_dir)))
+            serialized = serialize_trace(trace, state_dir)
+            members = []  # type: List[str]
+            for cpu in serialized["cpus"]:
+                members += [cpu["event_path"], cpu["trace_path"]]
+            timed(
+                timings,
+                "archive",
+                lambda: archive.write_archive(
+                    root.joinpath("snapshot-%d.hase" % i),
+                    state_dir,
+                    members,
+                    archive.compressor(),
+                ),
+            )
+            if replay:
+                for cpu in serialized["cpus"]:
+                    cpu["event_path"] = str(state_dir.joinpath(cpu["event_path"]))
+                    cpu["trace_path"] = str(state_dir.joinpath(cpu["trace_path"]))
+                manifest["trace"] = serialized
+                timed(
+                    timings,
+                    "replay",
+                    lambda: create_tracer(report, archive_root, manifest=manifest),
+                )
+    return timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("report")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--replay", action="store_true", help="also decode the trace")
+    args = parser.parse_args()
+    timings = run(args.report, args.repeat, args.replay)
+    for name, total in timings.items():
+        print("%-8s %.3fs per run" % (name, total / args.repeat))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import os
+import tarfile
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Dict, Optional
+
+import nose
+from nose.plugins.skip import SkipTest
+
+from hase import archive
+from hase.compression import PAGE_SIZE, zstd_module
+from hase.errors import HaseError
+
+MEMBERS = {
+    "manifest.json": b'{"coredump": {}}',
+    "traces/trace.0": b"\x02\x82" * 1000,
+    # the zero pages become a hole when extracted
+    "core": b"ELF" + b"\0" * (4 * PAGE_SIZE) + b"end",
+}  # type: Dict[str, bytes]
+
+
+def write_members(root: Path) -> None:
+    for name, data in MEMBERS.items():
+        path = root.joinpath(name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(str(path), "wb") as f:
+            f.write(data)
+
+
+def round_trip(name: str, level: Optional[int] = None) -> None:
+    compressor = archive.compressor(name, level)
+    with TemporaryDirectory() as tempdir:
+        root = Path(tempdir)
+        source = root.joinpath("source")
+        write_members(source)
+        path = root.joinpath("report" + compressor.suffix)
+        archive.write_archive(path, source, sorted(MEMBERS.keys()), compressor)
+        nose.tools.ok_(archive.is_archive(path))
+        nose.tools.eq_(archive.detect_format(str(path)), name)
+        # no temporary file is left behind
+        nose.tools.eq_(sorted(p.name for p in root.iterdir()), [path.name, "source"])
+
+        nose.tools.eq_(
+            archive.read_member(str(path), "manifest.json"), MEMBERS["manifest.json"]
+        )
+        with nose.tools.assert_raises(HaseError):
+            archive.read_member(str(path), "missing")
+
+        target = root.joinpath("target")
+        archive.extract_archive(str(path), target)
+        for member, data in MEMBERS.items():
+            with open(str(target.joinpath(member)), "rb") as f:
+                nose.tools.eq_(f.read(), data)
+        core = os.stat(str(target.joinpath("core")))
+        nose.tools.ok_(core.st_blocks * 512 < core.st_size)
+
+
+def test_gzip() -> None:
+    round_trip("gzip")
+
+
+def test_zstd() -> None:
+    if zstd_module() is None:
+        raise SkipTest("Requires zstandard")
+    round_trip("zstd")
+
+
+def test_indexed() -> None:
+    if zstd_module() is not None:
+        round_trip("indexed")
+    # stored uncompressed
+    round_trip("indexed", 0)
+
+
+def test_default_compressor() -> None:
+    expected = "indexed" if zstd_module() is not None else "gzip"
+    nose.tools.eq_(archive.compressor().name, expected)
+
+
+def test_detect_format() -> None:
+    with TemporaryDirectory() as tempdir:
+        root = Path(tempdir)
+        write_members(root)
+        path = root.joinpath("report.tar")
+        with tarfile.open(str(path), "w") as tar:
+            tar.add(str(root.joinpath("manifest.json")), arcname="manifest.json")
+        nose.tools.eq_(archive.detect_format(str(path)), "tar")
+        nose.tools.eq_(
+            archive.read_member(str(path), "manifest.json"), MEMBERS["manifest.json"]
+        )
+
+        truncated = root.joinpath("truncated.hase")
+        with open(str(truncated), "wb") as f:
+            f.write(archive.INDEXED_MAGIC + b"\0" * 64)
+        nose.tools.eq_(archive.detect_format(str(truncated)), "indexed")
+        with nose.tools.assert_raises(HaseError):
+            archive.IndexedArchive(str(truncated))
@@ -0,0 +1,72 @@
+import os
+import shutil
+import sys
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import nose
+
+from hase.binary_store import BinaryStore, build_id, sha256
+from hase.errors import HaseError
+
+EXECUTABLE = os.path.realpath(sys.executable)
+
+
+def test_store_and_materialize() -> None:
+    with TemporaryDirectory() as tempdir:
+        root = Path(tempdir)
+        store = BinaryStore(root.joinpath("blobs"))
+        key = store.add(EXECUTABLE)
+        nose.tools.ok_(key.endswith("sha256-" + sha256(EXECUTABLE)))
+        bid = build_id(EXECUTABLE)
+        if bid is not None:
+            nose.tools.ok_(key.startswith("buildid-" + bid))
+
+        target = root.joinpath("report", "binaries", "python")
+        store.materialize(key, target)
+        nose.tools.eq_(sha256(str(target)), sha256(EXECUTABLE))
+
+        with nose.tools.assert_raises(HaseError):
+            store.materialize("sha256-missing", root.joinpath("missing"))
+
+
+def test_dedup() -> None:
+    with TemporaryDirectory() as tempdir:
+        root = Path(tempdir)
+        copy = str(root.joinpath("copy"))
+        shutil.copy(EXECUTABLE, copy)
+        store = BinaryStore(root.joinpath("blobs"))
+        nose.tools.eq_(store.add(EXECUTABLE), store.add(copy))
+        nose.tools.eq_(len(list(store.root.iterdir())), 1)
+
+        # a store of another recorder finds the existing blob
+        other = BinaryStore(root.joinpath("blobs"))
+        nose.tools.eq_(other.add(copy), store.key(EXECUTABLE))
+        nose.tools.eq_(len(list(store.root.iterdir())), 1)
+
+
+def test_same_build_id() -> None:
+    with TemporaryDirectory() as tempdir:
+        root = Path(tempdir)
+        # e.g. a stripped build: same build-id, different content
+        stripped = str(root.joinpath("stripped"))
+        shutil.copy(EXECUTABLE, stripped)
+        with open(stripped, "ab") as f:
+            f.write(b"\0" * 16)
+        nose.tools.eq_(build_id(stripped), build_id(EXECUTABLE))
+
+        store = BinaryStore(root.joinpath("blobs"))
+        keys = [store.add(EXECUTABLE), store.add(stripped)]
+        nose.tools.ok_(keys[0] != keys[1])
+        for key, path in zip(keys, [EXECUTABLE, stripped]):
+            nose.tools.eq_(sha256(str(store.blob(key))), sha256(path))
+
+
+def test_no_build_id() -> None:
+    with TemporaryDirectory() as tempdir:
+        root = Path(tempdir)
+        script = root.joinpath("script")
+        script.write_bytes(b"#!/bin/sh\n")
+        nose.tools.eq_(build_id(str(script)), None)
+        store = BinaryStore(root.joinpath("blobs"))
+        nose.tools.eq_(store.add(str(script)), "sha256-" + sha256(str(script)))
@@ -0,0 +1,80 @@
+import ctypes as ct
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Any, Dict, List
+
+import nose
+
+from hase.perf import Perf
+from hase.perf.captured import CapturedSnapshot, split_events
+from hase.perf.consts import Libc, PerfRecord, SampleFlags
+from hase.perf.snapshot import event_structs
+
+# filename field of 8 bytes, 128 bytes per event
+EVENT_SIZE = ct.sizeof(event_structs.mmap2_event(-1)) + 8
+
+
+def mmap2_event(filename: bytes, time: int) -> bytes:
+    event = event_structs.mmap2_event(EVENT_SIZE)()
+    event.type = PerfRecord.PERF_RECORD_MMAP2
+    event.size = EVENT_SIZE
+    event.filename = filename
+    event.sample_id.time = time
+    return bytes(event)
+
+
+def captured_trace(root: Path, events: List[bytes]) -> Dict[str, Any]:
+    root.joinpath("cpu-0.perf-events").write_bytes(b"".join(events))
+    root.joinpath("cpu-0.trace").write_bytes(b"\x02\x82" * 1000)
+    cpu = dict(
+        idx=0,
+        event_path="cpu-0.perf-events",
+        trace_path="cpu-0.trace",
+        start_time=42,
+        start_pid=100,
+        start_tid=101,
+    )
+    return dict(
+        cpus=[cpu],
+        time_mult=1,
+        time_shift=2,
+        time_zero=3,
+        sample_type=SampleFlags.PERF_SAMPLE_MASK,
+        cpu_family=6,
+        cpu_model=94,
+        cpu_stepping=3,
+        cpuid_0x15_eax=2,
+        cpuid_0x15_ebx=216,
+    )
+
+
+def test_write_snapshot() -> None:
+    events = [mmap2_event(b"/bin/%02d" % i, i) for i in range(10)]
+    events.insert(5, mmap2_event(b"//anon", 5))
+    with TemporaryDirectory() as tempdir:
+        root = Path(tempdir)
+        snapshot = CapturedSnapshot(captured_trace(root, events), root)
+        out = root.joinpath("out")
+        out.mkdir()
+        with Perf(snapshot=snapshot) as perf:
+            trace = perf.write(str(out))
+        cpu = trace.cpus[0]
+        nose.tools.eq_((cpu.start_time, cpu.start_pid, cpu.start_tid), (42, 100, 101))
+        nose.tools.eq_((trace.time_mult, trace.time_shift, trace.time_zero), (1, 2, 3))
+        # anonymous mappings are filtered
+        written = split_events(Path(cpu.event_path).read_bytes())
+        nose.tools.eq_(written, events[:5] + events[6:])
+        nose.tools.eq_(
+            Path(cpu.trace_path).read_bytes(), root.joinpath("cpu-0.trace").read_bytes()
+        )
+
+
+def test_wrap_around() -> None:
+    events = [mmap2_event(b"/bin/%02d" % i, i) for i in range(50)]
+    with TemporaryDirectory() as tempdir:
+        root = Path(tempdir)
+        trace = captured_trace(root, events)
+        with CapturedSnapshot(trace, root, data_size=Libc.PAGESIZE) as snapshot:
+            written = [bytes(ev) for ev in snapshot.cpus[0].events()]
+        # only the newest events fit into the buffer
+        nose.tools.eq_(written, events[-(Libc.PAGESIZE // EVENT_SIZE) :])
@@ -0,0 +1,92 @@
+import os
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from threading import Thread
+
+import nose
+from nose.plugins.skip import SkipTest
+
+from hase.compression import (
+    CHUNK_SIZE,
+    PAGE_SIZE,
+    SparseWriter,
+    copy_core,
+    decompress_core,
+    read_chunks,
+    zstd_module,
+)
+
+# data, a hole in the middle, more data and a trailing hole
+CORE = (
+    b"\x7fELF" * (PAGE_SIZE // 4)
+    + bytes(2 * CHUNK_SIZE)
+    + b"data" * PAGE_SIZE
+    + bytes(CHUNK_SIZE)
+)
+
+
+def check_sparse(path: str) -> None:
+    with open(path, "rb") as f:
+        nose.tools.eq_(f.read(), CORE)
+    st = os.stat(path)
+    nose.tools.eq_(st.st_size, len(CORE))
+    # only the two data ranges are allocated
+    nose.tools.ok_(st.st_blocks * 512 < CHUNK_SIZE)
+
+
+def copy_from_pipe(path: str, level: int) -> str:
+    read_fd, write_fd = os.pipe()
+
+    def feed() -> None:
+        with os.fdopen(write_fd, "wb") as f:
+            f.write(CORE)
+
+    thread = Thread(target=feed)
+    thread.start()
+    try:
+        return copy_core(read_fd, path, level)
+    finally:
+        thread.join()
+        os.close(read_fd)
+
+
+def test_sparse_writer() -> None:
+    with TemporaryDirectory() as tempdir:
+        path = str(Path(tempdir).joinpath("core"))
+        with open(path, "wb") as f:
+            writer = SparseWriter(f)
+            # chunk boundaries do not need to be page aligned
+            for start in range(0, len(CORE), 3 * PAGE_SIZE + 1):
+                writer.write(CORE[start : start + 3 * PAGE_SIZE + 1])
+            writer.close()
+        check_sparse(path)
+
+
+def test_read_chunks() -> None:
+    read_fd, write_fd = os.pipe()
+    os.write(write_fd, b"x" * (2 * PAGE_SIZE + 1))
+    os.close(write_fd)
+    sizes = [len(chunk) for chunk in read_chunks(read_fd, PAGE_SIZE)]
+    os.close(read_fd)
+    nose.tools.eq_(sizes, [PAGE_SIZE, PAGE_SIZE, 1])
+
+
+def test_copy_core_sparse() -> None:
+    with TemporaryDirectory() as tempdir:
+        path = str(Path(tempdir).joinpath("core"))
+        nose.tools.eq_(copy_from_pipe(path, 0), path)
+        check_sparse(path)
+        # nothing to decompress
+        nose.tools.eq_(decompress_core(path), path)
+
+
+def test_copy_core_zstd() -> None:
+    if zstd_module() is None:
+        raise SkipTest("Requires zstandard")
+    with TemporaryDirectory() as tempdir:
+        path = str(Path(tempdir).joinpath("core"))
+        compressed = copy_from_pipe(path, 3)
+        nose.tools.eq_(compressed, path + ".zst")
+        nose.tools.ok_(os.path.getsize(compressed) < len(CORE))
+        nose.tools.eq_(decompress_core(compressed), path)
+        check_sparse(path)
@@ -0,0 +1,31 @@
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import nose
+
+from hase.core_file import Coredump
+from hase.replay import unpack
+
+from .helper import TEST_TRACES
+
+
+def test_coredump() -> None:
+    report = str(TEST_TRACES.joinpath("loopy-20181009T182008.tar.gz"))
+    with TemporaryDirectory() as tempdir:
+        manifest = unpack(report, Path(tempdir))
+        with Coredump(manifest["coredump"]["file"]) as coredump:
+            # ./loopy a b c d e
+            nose.tools.eq_(coredump.argc, 6)
+            args = [coredump.string(arg) for arg in coredump.argv]
+            nose.tools.eq_(args[1:], [b"a", b"b", b"c", b"d", b"e"])
+            nose.tools.eq_(coredump.u64(coredump.argc_address), 6)
+
+            rsp = coredump.registers["rsp"]
+            nose.tools.ok_(rsp in coredump.stack)
+            nose.tools.eq_(coredump.stack[rsp], coredump.read(rsp, 1))
+            nose.tools.eq_(coredump.vdso.data[:4], b"\x7fELF")
+
+            mapping = coredump.find_mapping(coredump.registers["rip"])
+            nose.tools.ok_(mapping is not None and mapping.path.startswith("/"))
+            with coredump.view(rsp, 8) as view:
+                nose.tools.eq_(bytes(view), coredump.read(rsp, 8))
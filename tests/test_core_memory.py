@@ -0,0 +1,45 @@
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import angr
+import nose
+
+from hase.core_file import Coredump
+from hase.replay import unpack
+from hase.symbex.core_memory import CoredumpMemory, is_crash_value
+from hase.symbex.start_state import initial_stack
+
+from .helper import TEST_TRACES
+
+
+def test_coredump_memory() -> None:
+    report = str(TEST_TRACES.joinpath("loopy-20181009T182008.tar.gz"))
+    with TemporaryDirectory() as tempdir:
+        manifest = unpack(report, Path(tempdir))
+        project = angr.Project(manifest["coredump"]["executable"], auto_load_libs=False)
+        with Coredump(manifest["coredump"]["file"]) as coredump:
+            memory = CoredumpMemory(
+                coredump=coredump,
+                ranges=initial_stack(coredump),
+                annotate=True,
+                memory_backer=project.loader.memory,
+                memory_id="mem",
+            )
+            state = project.factory.blank_state(plugins=dict(memory=memory))
+            argv = state.mem[coredump.argc_address + 8].uint64_t.resolved
+            nose.tools.ok_(is_crash_value(argv))
+            nose.tools.eq_(state.solver.eval(argv), coredump.argv[0])
+            arg = state.mem[coredump.argv[1]].string.concrete
+            nose.tools.eq_(arg, b"a")
+
+            # written memory is not replaced by the core
+            state.memory.store(coredump.argv[2], b"x")
+            nose.tools.eq_(state.mem[coredump.argv[2]].string.concrete, b"x")
+
+            # outside of `ranges` memory stays symbolic
+            rsp = coredump.registers["rsp"]
+            nose.tools.ok_(state.memory.load(rsp, 8).symbolic)
+            # copies read from the core as well
+            copy = state.copy()
+            env = copy.mem[coredump.argc_address + 8 * 8].uint64_t.concrete
+            nose.tools.eq_(env, coredump.u64(coredump.argc_address + 8 * 8))
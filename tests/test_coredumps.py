@@ -0,0 +1,91 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import List
+
+import nose
+
+from hase.compression import decompress_core
+from hase.coredump_handler import INCOMING_PREFIX, MANIFEST_NAME, crash_name
+from hase.record import Job, Recording, RecordPaths, ReportWorker
+from hase.record.coredumps import Coredump, CoredumpQueue
+
+# executable, uid, gid, tid, global tid, pid, global pid, signal, time
+OS_ARGS = ["!usr!bin!loopy", "0", "0", "42", "4242", "42", "4242", "11", "1539100000"]
+
+
+def run_handler(spool_dir: str, max_pending: int, core: bytes) -> None:
+    args = [sys.executable, "-m", "hase.coredump_handler", spool_dir, str(max_pending)]
+    process = subprocess.run(args + OS_ARGS, input=core, stdout=subprocess.PIPE)
+    nose.tools.eq_(process.returncode, 0)
+
+
+def test_spool_naming() -> None:
+    nose.tools.eq_(crash_name(OS_ARGS), "1539100000-4242-4242")
+    with TemporaryDirectory() as tempdir:
+        run_handler(tempdir, 4, b"core")
+        nose.tools.eq_(os.listdir(tempdir), ["1539100000-4242-4242"])
+
+        crash = Coredump(Path(tempdir).joinpath("1539100000-4242-4242"))
+        # zstd compressed if zstandard is installed
+        with open(decompress_core(crash.get()), "rb") as f:
+            nose.tools.eq_(f.read(), b"core")
+        with open(str(crash.path.joinpath(MANIFEST_NAME))) as f:
+            coredump = json.load(f)["coredump"]
+        nose.tools.eq_(coredump["executable"], "usr/bin/loopy")
+        nose.tools.eq_(coredump["time"], "20181009T154640")
+        nose.tools.eq_(crash.pid, 4242)
+
+
+def test_spool_limit() -> None:
+    with TemporaryDirectory() as tempdir:
+        for i in range(2):
+            os.mkdir(os.path.join(tempdir, "1539000000-%d-%d" % (i, i)))
+        run_handler(tempdir, 2, b"core")
+        nose.tools.eq_(len(os.listdir(tempdir)), 2)
+
+
+def test_queue_order() -> None:
+    with TemporaryDirectory() as tempdir:
+        spool = Path(tempdir)
+        for name in ["1539100002-5-5", "1539100001-7-7", "1539100001-6-6"]:
+            spool.joinpath(name).mkdir()
+        spool.joinpath(INCOMING_PREFIX + "1539100003-1-1").mkdir()
+
+        queue = CoredumpQueue(spool)
+        names = [c.path.name for c in queue.ready()]
+        nose.tools.eq_(names, ["1539100001-6-6", "1539100001-7-7", "1539100002-5-5"])
+        nose.tools.eq_(queue.pending(), 1)
+        nose.tools.eq_(queue.ready(), [])
+
+        os.rename(
+            str(spool.joinpath(INCOMING_PREFIX + "1539100003-1-1")),
+            str(spool.joinpath("1539100003-1-1")),
+        )
+        nose.tools.eq_(queue.pending(), 0)
+        nose.tools.eq_([c.path.name for c in queue.wait()], ["1539100003-1-1"])
+
+
+def test_worker_max_pending() -> None:
+    with TemporaryDirectory() as tempdir:
+        root = Path(tempdir)
+        jobs = []  # type: List[Job]
+        for i in range(2):
+            crash = root.joinpath("crash-%d" % i)
+            paths = RecordPaths(crash, root, None)
+            paths.perf_directory.mkdir(parents=True)
+            with open(str(crash.joinpath(MANIFEST_NAME)), "w") as f:
+                json.dump(dict(coredump=dict(file="core")), f)
+            jobs.append(Job(Recording(Coredump(crash), None, 0), paths))
+
+        # the worker threads are not started, nothing is taken from the queue
+        worker = ReportWorker(max_pending=1)
+        nose.tools.ok_(worker.submit(jobs[0]))
+        nose.tools.ok_(not worker.submit(jobs[1]))
+        # the dropped crash is removed from disk
+        nose.tools.ok_(not jobs[1].record_paths.path.exists())
+        nose.tools.ok_(jobs[0].record_paths.perf_directory.exists())
+        nose.tools.eq_(worker.queue.qsize(), 1)
@@ -0,0 +1,73 @@
+import os
+import signal
+import socket
+import subprocess
+import time
+from tempfile import TemporaryDirectory
+from threading import Thread
+
+import nose
+
+from hase.record import event_loop
+from hase.record.control_socket import ControlSocket
+from hase.record.event_loop import EventLoop
+
+
+def test_timers() -> None:
+    calls = []
+    with EventLoop() as loop:
+        loop.call_later(0.02, lambda: calls.append(2))
+        loop.call_later(0.01, lambda: calls.append(1))
+        loop.call_later(0.03, loop.stop)
+        loop.run()
+    nose.tools.eq_(calls, [1, 2])
+
+
+def test_signal() -> None:
+    calls = []
+
+    def received() -> None:
+        calls.append(signal.SIGUSR2)
+        loop.stop()
+
+    with EventLoop() as loop:
+        loop.add_signal_handler(signal.SIGUSR2, received)
+        os.kill(os.getpid(), signal.SIGUSR2)
+        loop.run()
+    nose.tools.eq_(calls, [signal.SIGUSR2])
+
+
+def test_watch_process() -> None:
+    proc = subprocess.Popen(["sleep", "0.1"])
+    start = time.time()
+    with EventLoop() as loop:
+        loop.watch_process(proc.pid, loop.stop)
+        loop.run()
+    nose.tools.ok_(time.time() - start < 5)
+    nose.tools.ok_(event_loop.process_exited(proc.pid))
+    # the child is not reaped by the loop
+    _, status = os.waitpid(proc.pid, 0)
+    nose.tools.eq_(status, 0)
+
+
+def test_control_socket() -> None:
+    replies = []
+    with TemporaryDirectory() as tempdir, EventLoop() as loop:
+        path = os.path.join(tempdir, "control.sock")
+
+        def client() -> None:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.connect(path)
+                sock.sendall(b"list\n")
+                replies.append(sock.recv(128))
+
+        def handler(command: str) -> str:
+            loop.stop()
+            return "ok " + command
+
+        with ControlSocket(path, loop, handler):
+            thread = Thread(target=client)
+            thread.start()
+            loop.run()
+            thread.join()
+    nose.tools.eq_(replies, [b"ok list\n"])
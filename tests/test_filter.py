@@ -0,0 +1,107 @@
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import angr
+import nose
+
+from hase.pt import Instruction, InstructionClass
+from hase.replay import unpack
+from hase.symbex.filter import FilterBase, FilterTrace, omit_ranges
+from hase.symbex.tracer import skip_untraced_call
+
+from .helper import TEST_TRACES
+
+
+class NoGdb:
+    def get_func_range(self, name: str) -> None:
+        raise Exception("no gdb")
+
+
+def test_omit_ranges() -> None:
+    ranges = omit_ranges([[10, 5], [0, 0], [12, 8], [30, 2]])
+    nose.tools.eq_(ranges, ([10, 30], [20, 32]))
+
+
+def test_classify() -> None:
+    report = str(TEST_TRACES.joinpath("loopy-20181009T182008.tar.gz"))
+    with TemporaryDirectory() as tempdir:
+        manifest = unpack(report, Path(tempdir))
+        project = angr.Project(manifest["coredump"]["executable"], auto_load_libs=False)
+        main = project.loader.main_object.get_symbol("main").rebased_addr
+        plt_name, plt = next(iter(project.loader.main_object.plt.items()))
+        trace_filter = FilterBase(project, [], {}, NoGdb(), [[main, 4]])
+
+        trace = [
+            Instruction(ip, 1, InstructionClass.ptic_other)
+            for ip in [main, main + 4, plt, main]
+        ]
+        classes = trace_filter.classify_trace(trace)
+        # every address is classified once
+        nose.tools.ok_(classes[0] is classes[3])
+        nose.tools.eq_(len(trace_filter.classes), 3)
+
+        nose.tools.ok_(classes[0].main and classes[0].omit)
+        nose.tools.eq_(classes[0].function.name, "main")
+        nose.tools.ok_(not classes[1].omit)
+        nose.tools.eq_(trace_filter.test_function_entry(main), (True, "main"))
+        nose.tools.eq_(trace_filter.test_function_entry(main + 4), (False, ""))
+
+        nose.tools.ok_(classes[2].plt_vdso and not classes[2].ld)
+        nose.tools.eq_(classes[2].function.name, plt_name)
+
+
+def test_untraced_calls() -> None:
+    report = str(TEST_TRACES.joinpath("loopy-20181009T182008.tar.gz"))
+    with TemporaryDirectory() as tempdir:
+        manifest = unpack(report, Path(tempdir))
+        project = angr.Project(manifest["coredump"]["executable"], auto_load_libs=False)
+        main = project.loader.main_object.get_symbol("main").rebased_addr
+        call = next(
+            insn
+            for insn in project.factory.block(main).capstone.insns
+            if insn.mnemonic == "call"
+        )
+        after_call = Instruction(
+            call.address + call.size, 1, InstructionClass.ptic_other
+        )
+        trace = [
+            Instruction(call.address, call.size, InstructionClass.ptic_call),
+            # the callee was not traced
+            after_call,
+            Instruction(call.address, call.size, InstructionClass.ptic_call),
+            # the callee was traced
+            Instruction(main, 1, InstructionClass.ptic_other),
+            after_call,
+        ]
+        trace_filter = FilterTrace(project, trace, {}, NoGdb(), [], False)
+        trace_filter.trace = trace_filter.new_trace = trace
+        trace_filter.trace_idx = list(range(len(trace)))
+        trace_filter.hook_target = {}
+        trace_filter.hook_entry = []
+
+        # everything was traced without ip filters
+        trace_filter.analyze_untraced_calls()
+        nose.tools.eq_(trace_filter.untraced_calls, set())
+
+        target = trace_filter.call_target(trace[0])
+        nose.tools.ok_(target is not None)
+        trace_filter.traced_ranges = [(main, main + 0x100)]
+        nose.tools.ok_(not trace_filter.is_traced(target))
+        trace_filter.analyze_untraced_calls()
+        nose.tools.eq_(trace_filter.untraced_calls, {0})
+        nose.tools.ok_(trace_filter.is_untraced_call(0))
+        nose.tools.ok_(not trace_filter.is_untraced_call(2))
+
+        # the callee was traced, but left no instructions: not expected
+        trace_filter.traced_ranges.append((target, target + 1))
+        trace_filter.analyze_untraced_calls()
+        nose.tools.eq_(trace_filter.untraced_calls, set())
+
+        state = project.factory.blank_state(addr=call.address)
+        new_state = skip_untraced_call(state, after_call)
+        nose.tools.eq_(new_state.addr, after_call.ip)
+        nose.tools.eq_(state.addr, call.address)
+        nose.tools.ok_(new_state.regs.rax.symbolic and new_state.regs.rdx.symbolic)
+        nose.tools.eq_(
+            state.solver.eval(state.regs.rsp), new_state.solver.eval(new_state.regs.rsp)
+        )
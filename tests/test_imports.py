@@ -0,0 +1,41 @@
+import json
+import subprocess
+import sys
+from typing import Any, Dict
+
+import nose
+
+from .helper import TEST_ROOT
+
+# replay dependencies, loading them takes seconds
+HEAVY_MODULES = ["angr", "claripy", "pwnlib", "PyQt5", "qtconsole", "ipdb"]
+
+# seconds, generous for slow CI machines
+STARTUP_BUDGET = {"hase.coredump_handler": 0.3, "hase.cli": 1.0, "hase.record": 1.0}
+
+MEASURE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+print(json.dumps(dict(time=time.perf_counter() - start, modules=list(sys.modules))))
+"""
+
+
+def measure_import(module: str) -> Dict[str, Any]:
+    # fresh interpreter, so nothing is imported yet
+    output = subprocess.check_output(
+        [sys.executable, "-c", MEASURE.format(module=module)],
+        cwd=str(TEST_ROOT.parent),
+    )
+    return json.loads(output.decode("utf-8"))
+
+
+def test_import_time() -> None:
+    for module, budget in STARTUP_BUDGET.items():
+        result = measure_import(module)
+        heavy = [m for m in result["modules"] if m.split(".")[0] in HEAVY_MODULES]
+        nose.tools.eq_(heavy, [], "%s imports %s" % (module, ", ".join(heavy)))
+        nose.tools.ok_(
+            result["time"] < budget,
+            "importing %s took %.3fs (budget %.3fs)" % (module, result["time"], budget),
+        )
@@ -0,0 +1,80 @@
+import os
+import subprocess
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Any
+
+import nose
+
+from hase.core_file import Coredump
+from hase.record import RecordPaths, ReportWorker
+from hase.record.flight_recorder import FlightRecorder, SnapshotLimits
+from hase.record.live_core import dump_core, frozen, user_regs_struct
+
+
+class NoRecord:
+    got_coredump = False
+
+    def snapshot(self, perf_directory: Path) -> Any:
+        raise AssertionError("process is gone")
+
+
+def test_dump_core() -> None:
+    # a plain child process, no processor trace required
+    process = subprocess.Popen(["sleep", "60", "1"])
+    try:
+        with TemporaryDirectory() as tempdir:
+            path = os.path.join(tempdir, "core")
+            with frozen(process.pid) as registers:
+                dump_core(process.pid, path, registers)
+            nose.tools.eq_(list(registers.keys()), [process.pid])
+            regs = user_regs_struct.from_buffer_copy(registers[process.pid])
+
+            with Coredump(path) as coredump:
+                nose.tools.eq_(coredump.pid, process.pid)
+                nose.tools.eq_(coredump.registers["rip"], regs.rip)
+                nose.tools.eq_(coredump.registers["rsp"], regs.rsp)
+                nose.tools.ok_(regs.rsp in coredump.stack)
+                args = [coredump.string(arg) for arg in coredump.argv]
+                nose.tools.eq_(args, [b"sleep", b"60", b"1"])
+        # the process continues after the snapshot
+        nose.tools.eq_(process.poll(), None)
+    finally:
+        process.kill()
+        process.wait()
+
+
+def test_snapshot_exited_process() -> None:
+    process = subprocess.Popen(["true"])
+    process.wait()
+    with TemporaryDirectory() as tempdir:
+        root = Path(tempdir)
+        paths = RecordPaths(root.joinpath("state"), root, None)
+        recorder = FlightRecorder(
+            NoRecord(), ReportWorker(), process.pid, paths, SnapshotLimits(), None
+        )
+        nose.tools.eq_(recorder.snapshot("test"), None)
+        # nothing is left behind
+        nose.tools.eq_(list(paths.path.iterdir()), [])
+
+
+def test_prune() -> None:
+    with TemporaryDirectory() as tempdir:
+        root = Path(tempdir)
+        paths = RecordPaths(root.joinpath("state"), root, None)
+        recorder = FlightRecorder(
+            NoRecord(), ReportWorker(), 42, paths, SnapshotLimits(max_snapshots=1), None
+        )
+        names = [
+            "server-snapshot-20181009T182008-42.hase",
+            "server-snapshot-20181009T182018-42.hase",
+            "server-snapshot-20181009T182008-4242.hase",
+            "server-20181009T182008-42.hase",
+        ]
+        for i, name in enumerate(names):
+            root.joinpath(name).touch()
+            os.utime(str(root.joinpath(name)), (i, i))
+        recorder.prune()
+        # only the older snapshot of this process is removed
+        remaining = sorted(p.name for p in root.iterdir() if p.is_file())
+        nose.tools.eq_(remaining, sorted(names[1:]))
@@ -0,0 +1,80 @@
+import os
+import subprocess
+from tempfile import TemporaryDirectory
+from typing import Any, Dict
+
+import nose
+from nose.plugins.skip import SkipTest
+
+from hase.compression import zstd_module
+from hase.core_file import Coredump
+from hase.record import minimize_report_core
+from hase.record.live_core import dump_core, frozen
+from hase.record.minimize import minimize_core, select_pages
+
+
+def test_minimize_core() -> None:
+    process = subprocess.Popen(["sleep", "60", "1"])
+    try:
+        with TemporaryDirectory() as tempdir:
+            path = os.path.join(tempdir, "core")
+            minimized = os.path.join(tempdir, "core.min")
+            with frozen(process.pid) as registers:
+                dump_core(process.pid, path, registers)
+
+            total, kept = minimize_core(path, minimized, context=0)
+            nose.tools.ok_(0 < kept < total)
+            nose.tools.eq_(os.path.getsize(path), os.path.getsize(minimized))
+
+            with Coredump(path) as core, Coredump(minimized) as small:
+                nose.tools.eq_(small.thread_registers(), core.thread_registers())
+                args = [small.string(arg) for arg in small.argv]
+                nose.tools.eq_(args, [b"sleep", b"60", b"1"])
+                nose.tools.eq_(small.env, core.env)
+
+                rsp = small.registers["rsp"]
+                stack = small.stack
+                nose.tools.ok_(stack is not None and rsp in stack)
+                end = stack.stop
+                nose.tools.eq_(small.read(rsp, end - rsp), core.read(rsp, end - rsp))
+
+                # dropped segments read as zeros
+                pages = select_pages(core, 0)
+                dropped = [
+                    s
+                    for idx, s in enumerate(core.segments)
+                    if idx not in pages and s.filesz > 0
+                ]
+                nose.tools.ok_(len(dropped) > 0)
+                segment = dropped[0]
+                nose.tools.eq_(
+                    small.read(segment.vaddr, segment.filesz), b"\0" * segment.filesz
+                )
+    finally:
+        process.kill()
+        process.wait()
+
+
+def test_minimize_zstd_core() -> None:
+    zstd = zstd_module()
+    if zstd is None:
+        raise SkipTest("Requires zstandard")
+    process = subprocess.Popen(["sleep", "60", "1"])
+    try:
+        with TemporaryDirectory() as tempdir:
+            path = os.path.join(tempdir, "core")
+            with frozen(process.pid) as registers:
+                dump_core(process.pid, path, registers)
+            with open(path, "rb") as src, open(path + ".zst", "wb") as dst:
+                zstd.ZstdCompressor().copy_stream(src, dst)
+            os.unlink(path)
+
+            manifest = dict(coredump=dict())  # type: Dict[str, Any]
+            minimized = minimize_report_core(path + ".zst", 0, manifest)
+            nose.tools.eq_(minimized, path + ".min")
+            # the decompressed copy is not kept next to the minimized core
+            nose.tools.eq_(sorted(os.listdir(tempdir)), ["core.min", "core.zst"])
+            nose.tools.eq_(manifest["coredump"]["minimized"]["context_pages"], 0)
+    finally:
+        process.kill()
+        process.wait()
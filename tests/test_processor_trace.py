@@ -0,0 +1,46 @@
+import os
+import sys
+from tempfile import NamedTemporaryFile
+
+import nose
+
+from hase.errors import HaseError
+from hase.record.processor_trace import (
+    PtFeatures,
+    build_address_filters,
+    executable_segments,
+)
+
+EXECUTABLE = os.path.realpath(sys.executable)
+
+
+def test_build_address_filters() -> None:
+    features = PtFeatures(supported=True, ip_filtering=True, num_address_ranges=8)
+    segments = executable_segments(EXECUTABLE)
+    nose.tools.ok_(len(segments) > 0)
+
+    filters = build_address_filters(["main"], sys.executable, features)
+    nose.tools.eq_(
+        [(f.path, f.offset, f.size) for f in filters],
+        [(EXECUTABLE, offset, size) for offset, size in segments],
+    )
+    # nothing to filter, nothing to check
+    nose.tools.eq_(build_address_filters([], sys.executable, PtFeatures()), [])
+
+
+def test_build_address_filters_errors() -> None:
+    no_filtering = PtFeatures(supported=True)
+    with nose.tools.assert_raises(HaseError):
+        build_address_filters(["main"], sys.executable, no_filtering)
+
+    segments = len(executable_segments(EXECUTABLE))
+    too_few = PtFeatures(supported=True, ip_filtering=True, num_address_ranges=1)
+    with nose.tools.assert_raises(HaseError):
+        build_address_filters(["main"] * (1 + segments), sys.executable, too_few)
+
+    features = PtFeatures(supported=True, ip_filtering=True, num_address_ranges=8)
+    with NamedTemporaryFile() as f:
+        f.write(b"#!/bin/sh\n")
+        f.flush()
+        with nose.tools.assert_raises(HaseError):
+            build_address_filters([f.name], sys.executable, features)
@@ -0,0 +1,132 @@
+from types import SimpleNamespace
+from typing import Any, List, Tuple
+from unittest.mock import patch
+
+import nose
+
+from hase import pt
+from hase.errors import PtError
+from hase.perf.tsc import TscConversion
+from hase.pt import Chunk, Chunker, Instruction, InstructionClass, ScheduleEntry
+
+
+def instructions(*ips: int) -> List[Instruction]:
+    return [Instruction(ip, 1, InstructionClass.ptic_other) for ip in ips]
+
+
+class FakeLib:
+    """
+    Replays `steps` instead of decoding a trace: ("sync",), ("insn", ip),
+    ("error",) or ("event", type, tsc, cr3)
+    """
+
+    pts_event_pending = 1
+    pts_eos = 4
+    ptic_error = 0
+    ptev_enabled = 0
+    ptev_disabled = 1
+    ptev_async_disabled = 2
+    ptev_paging = 4
+    ptev_async_paging = 5
+
+    def __init__(self, steps: List[Tuple[Any, ...]]) -> None:
+        self.steps = steps
+        self.pos = 0
+
+    def status(self) -> int:
+        if self.pos == len(self.steps):
+            return self.pts_eos
+        if self.steps[self.pos][0] == "event":
+            return self.pts_event_pending
+        return 0
+
+    def decoder_sync_forward(self, decoder: Any) -> int:
+        while self.pos < len(self.steps):
+            self.pos += 1
+            if self.steps[self.pos - 1][0] == "sync":
+                return self.status()
+        return -self.pts_eos
+
+    def decoder_next_event(self, decoder: Any, event: Any) -> int:
+        _, event.type, event.tsc, cr3 = self.steps[self.pos]
+        event.variant = SimpleNamespace(
+            paging=SimpleNamespace(cr3=cr3), async_paging=SimpleNamespace(cr3=cr3)
+        )
+        self.pos += 1
+        return self.status()
+
+    def decoder_next_instruction(self, decoder: Any, instruction: Any) -> int:
+        step = self.steps[self.pos]
+        self.pos += 1
+        if step[0] == "error":
+            return -13
+        instruction.ip, instruction.size = step[1], 1
+        instruction.iclass = InstructionClass.ptic_other
+        return self.status()
+
+    def decoder_get_error(self, status: int) -> bytes:
+        return b"no memory mapped at this address"
+
+
+FakeFfi = SimpleNamespace(new=lambda type: SimpleNamespace(), string=lambda s: s)
+
+
+def chunks(steps: List[Tuple[Any, ...]], skip_errors: bool) -> List[Chunk]:
+    lib = FakeLib(steps)
+    with patch.object(pt, "lib", lib), patch.object(pt, "ffi", FakeFfi):
+        return Chunker(None, TscConversion(1, 0, 0), skip_errors).chunks()
+
+
+STEPS = [
+    ("sync",),
+    ("event", FakeLib.ptev_enabled, 1, 0),
+    ("event", FakeLib.ptev_paging, 1, 0x4000),
+    ("insn", 0x10),
+    ("insn", 0x11),
+    # another process of the cgroup, tracing stays enabled
+    ("event", FakeLib.ptev_paging, 5, 0x8000),
+    ("insn", 0x20),
+    ("error",),
+    ("sync",),
+    ("event", FakeLib.ptev_enabled, 8, 0),
+    ("event", FakeLib.ptev_paging, 8, 0x4000),
+    ("insn", 0x12),
+    ("event", FakeLib.ptev_disabled, 9, 0),
+]
+
+
+def test_chunker() -> None:
+    result = chunks(STEPS, skip_errors=True)
+    nose.tools.eq_(
+        [(c.start, c.stop, c.instructions, c.cr3) for c in result],
+        [(1, 5, instructions(0x10, 0x11), 0x4000), (8, 9, instructions(0x12), 0x4000)],
+    )
+    # in traces of a single process errors are not expected
+    with nose.tools.assert_raises(PtError):
+        chunks(STEPS[:8], skip_errors=False)
+
+
+def test_correlate_traces() -> None:
+    schedule = [
+        ScheduleEntry(0, 10, 10, 0, 100),
+        ScheduleEntry(0, 20, 20, 150, 200),
+        ScheduleEntry(0, 10, 10, 250, None),
+    ]
+    trace = [
+        Chunk(10, 90, instructions(0x10), 0x4000),
+        Chunk(160, 190, instructions(0x20), 0x8000),
+        Chunk(260, 270, instructions(0x11), 0x4000),
+        # switch within the cgroup without a sideband event
+        Chunk(270, 290, instructions(0x21), 0x8000),
+    ]
+    nose.tools.eq_(
+        pt.correlate_traces([trace], schedule, 10, 10, shared=True),
+        instructions(0x10, 0x11),
+    )
+    for entry in schedule:
+        entry.chunks = []
+    # traces of a single process do not switch address spaces
+    nose.tools.eq_(
+        pt.correlate_traces([trace], schedule, 10, 10),
+        instructions(0x10, 0x11, 0x21),
+    )
@@ -0,0 +1,40 @@
+import nose
+
+from hase.errors import HaseError
+from hase.perf.pt_config import (
+    PROFILES,
+    AddressFilter,
+    PtCaps,
+    PtConfig,
+    filter_string,
+    pt_profile,
+)
+
+
+def test_default_profile_matches_perf() -> None:
+    # value perf-record uses and we used to hard-code
+    nose.tools.eq_(pt_profile("default").config(), 0x300F621)
+
+
+def test_profiles_round_trip() -> None:
+    for name in PROFILES:
+        config = pt_profile(name)
+        copy = PtConfig.from_dict(config.to_dict())
+        nose.tools.eq_(config.config(), copy.config())
+
+
+def test_validate_against_caps() -> None:
+    caps = PtCaps(mtc=True, mtc_periods=0x249, psb_periods=0x3F)
+    pt_profile("default").validate(caps)
+    nose.tools.assert_raises(HaseError, pt_profile("timing").validate, caps)
+
+
+def test_address_filter() -> None:
+    filters = [AddressFilter("/bin/ls", 0x1000, 0x2000), AddressFilter("/lib/a", 0, 16)]
+    nose.tools.eq_(str(filters[0]), "filter 0x1000/0x2000@/bin/ls")
+    nose.tools.eq_(repr(filters[1]), "<AddressFilter filter 0x0/0x10@/lib/a>")
+    nose.tools.eq_(
+        filter_string(filters), "filter 0x1000/0x2000@/bin/ls,filter 0x0/0x10@/lib/a"
+    )
+    copy = AddressFilter.from_dict(filters[0].to_dict())
+    nose.tools.eq_(str(copy), str(filters[0]))
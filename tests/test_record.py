@@ -16,6 +16,7 @@ import nose
 from nose.plugins.skip import SkipTest
 
 from hase import main
+from hase.archive import is_archive
 
 from .helper import TEST_BIN
 
@@ -76,8 +77,8 @@ def test_record_command() -> None:
 
         process.join()
 
-        archives = list(temppath.glob("*.tar.gz"))
+        archives = [p for p in temppath.iterdir() if is_archive(p)]
         nose.tools.assert_equal(len(archives), 1)
 
-        states = main(["hase", "replay", str(archives[0])])
+        states = main(["hase", "replay", "--no-cache", str(archives[0])])
         nose.tools.assert_true(len(states) > 10)
@@ -1,13 +1,32 @@
 from __future__ import absolute_import, division, print_function
 
 import logging
+import os
+from tempfile import TemporaryDirectory
+from typing import Optional
 
 import nose
 
 from hase import main
+from hase.symbex.cdanalyzer import CALLEE_SAVED_REGISTERS
 
 from .helper import TEST_TRACES
 
+cache_dir = None  # type: Optional[TemporaryDirectory]
+
+
+def setup() -> None:
+    # keep the report cache of the user clean
+    global cache_dir
+    cache_dir = TemporaryDirectory()
+    os.environ["HASE_CACHE_DIR"] = cache_dir.name
+
+
+def teardown() -> None:
+    os.environ.pop("HASE_CACHE_DIR", None)
+    if cache_dir is not None:
+        cache_dir.cleanup()
+
 
 def test_loopy() -> None:
     state = main(
@@ -31,3 +50,76 @@ def test_control_flow() -> None:
             str(TEST_TRACES.joinpath("control_flow-20181003T145029.tar.gz")),
         ]
     )
+
+
+def test_block_step() -> None:
+    report = str(TEST_TRACES.joinpath("loopy-20181009T182008.tar.gz"))
+    single = main(["hase", "replay", "--single-step", report])
+    block = main(["hase", "replay", report])
+    nose.tools.eq_(single.major_index, block.major_index)
+    for a, b in zip(single.major_states, block.major_states):
+        for reg in ["rip", "rsp", "rbp", "rax", "rdi", "rsi"]:
+            nose.tools.eq_(a.registers[reg].value, b.registers[reg].value)
+    nose.tools.eq_(single.last_main_state.index, block.last_main_state.index)
+
+
+def test_unicorn() -> None:
+    report = str(TEST_TRACES.joinpath("loopy-20181009T182008.tar.gz"))
+    symbolic = main(["hase", "replay", report])
+    concrete = main(["hase", "replay", "--unicorn", report])
+    nose.tools.eq_(symbolic.major_index, concrete.major_index)
+
+    segments = concrete.tracer.concrete_segments
+    nose.tools.ok_(len(segments) > 0)
+    nose.tools.ok_(any(segment.concrete for segment in segments))
+    nose.tools.eq_(symbolic.tracer.concrete_segments, [])
+
+    # the last state is constrained by the coredump, compare the ones before
+    nose.tools.ok_(len(symbolic.major_states) > 2)
+    for a, b in zip(symbolic.major_states, concrete.major_states):
+        for reg in ["rip", "rsp", "rbp", "rax", "rdi", "rsi"]:
+            nose.tools.eq_(a.registers[reg].value, b.registers[reg].value)
+
+
+def test_window() -> None:
+    report = str(TEST_TRACES.joinpath("control_flow-20181003T145029.tar.gz"))
+    full = main(["hase", "replay", report])
+    window = main(["hase", "replay", "--window", "2000", report])
+    start = window.tracer.window_start
+    nose.tools.ok_(start > 0)
+    nose.tools.eq_(len(window.tracer.old_trace), len(full.tracer.old_trace) - start)
+    nose.tools.ok_(len(window.tracer.trace) < len(full.tracer.trace))
+    a, b = full.major_states[-1], window.major_states[-1]
+    for reg in ["rip", "rsp"]:
+        nose.tools.eq_(a.registers[reg].value, b.registers[reg].value)
+
+    # the registers unwound from the coredump at the window start match the
+    # ones of the full replay at the same instruction
+    entry = full.tracer.trace_idx.index(start)
+    candidates = [full[i][0] for i in (entry - 1, entry)]
+    expected = [s for s in candidates if s.to_instruction is full.tracer.trace[entry]]
+    nose.tools.eq_(len(expected), 1)
+    simstate = window.major_states[0].simstate
+    nose.tools.eq_(simstate.addr, full.tracer.trace[entry].ip)
+    known = [
+        reg
+        for reg in ["rsp"] + CALLEE_SAVED_REGISTERS
+        if not getattr(simstate.regs, reg).symbolic
+    ]
+    nose.tools.ok_("rsp" in known and len(known) > 1)
+    for reg in known:
+        nose.tools.eq_(
+            window.major_states[0].registers[reg].value,
+            expected[0].registers[reg].value,
+        )
+
+
+def test_sat_interval() -> None:
+    report = str(TEST_TRACES.joinpath("control_flow-20181003T145029.tar.gz"))
+    every_step = main(["hase", "replay", "--single-step", report])
+    lazy = main(["hase", "replay", "--single-step", "--sat-interval", "0", report])
+    nose.tools.ok_(lazy.tracer.sat_checks < every_step.tracer.sat_checks)
+    nose.tools.eq_(every_step.major_index, lazy.major_index)
+    for a, b in zip(every_step.major_states, lazy.major_states):
+        for reg in ["rip", "rsp", "rbp", "rax"]:
+            nose.tools.eq_(a.registers[reg].value, b.registers[reg].value)
@@ -0,0 +1,103 @@
+import os
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Any, Dict, List
+
+import nose
+
+from hase.report_cache import ReportCache
+
+DATA_SIZE = 64 * 1024
+
+
+def write_report(root: Path, name: str) -> str:
+    path = root.joinpath(name)
+    path.write_bytes(name.encode("utf-8"))
+    return str(path)
+
+
+def filler(calls: List[Path]) -> Any:
+    def fill(path: Path) -> Dict[str, Any]:
+        calls.append(path)
+        path.joinpath("core").write_bytes(b"x" * DATA_SIZE)
+        return dict(path=str(path))
+
+    return fill
+
+
+def test_unpack_once() -> None:
+    with TemporaryDirectory() as tempdir:
+        root = Path(tempdir)
+        report = write_report(root, "a.hase")
+        cache = ReportCache(root.joinpath("cache"))
+        calls = []  # type: List[Path]
+
+        first = cache.acquire(report)
+        manifest = cache.unpack(first, filler(calls))
+        # a second replay of the same report shares the entry
+        second = cache.acquire(report)
+        nose.tools.eq_(first.path, second.path)
+        nose.tools.eq_(cache.unpack(second, filler(calls)), manifest)
+        nose.tools.eq_(calls, [first.path])
+        first.release()
+        second.release()
+
+        # an interrupted unpack is redone from scratch
+        report = write_report(root, "b.hase")
+        entry = cache.acquire(report)
+        entry.path.joinpath("leftover").write_bytes(b"x")
+
+        def fail(path: Path) -> Dict[str, Any]:
+            raise KeyboardInterrupt()
+
+        with nose.tools.assert_raises(KeyboardInterrupt):
+            cache.unpack(entry, fail)
+        nose.tools.ok_(not entry.complete)
+        cache.unpack(entry, filler(calls))
+        nose.tools.ok_(not entry.path.joinpath("leftover").exists())
+        entry.release()
+
+
+def test_report_hash() -> None:
+    with TemporaryDirectory() as tempdir:
+        root = Path(tempdir)
+        report = write_report(root, "a.hase")
+        cache = ReportCache(root.joinpath("cache"))
+        digest = cache.report_hash(report)
+        nose.tools.eq_(cache.report_hash(report), digest)
+        nose.tools.ok_(cache.report_hash(write_report(root, "b.hase")) != digest)
+
+
+def test_evict_lru() -> None:
+    with TemporaryDirectory() as tempdir:
+        root = Path(tempdir)
+        # room for two entries
+        cache = ReportCache(root.joinpath("cache"), int(DATA_SIZE * 2.5))
+        calls = []  # type: List[Path]
+        paths = []
+        for i, name in enumerate(["a.hase", "b.hase", "c.hase"]):
+            entry = cache.acquire(write_report(root, name))
+            # acquire orders the entries by the mtime of the lock file
+            os.utime(str(entry.path.joinpath(".lock")), (i, i))
+            cache.unpack(entry, filler(calls))
+            entry.release()
+            paths.append(entry.path)
+
+        nose.tools.eq_([p.exists() for p in paths], [False, True, True])
+        nose.tools.eq_([p for _, p in cache.entries()], paths[1:])
+
+
+def test_evict_in_use() -> None:
+    with TemporaryDirectory() as tempdir:
+        root = Path(tempdir)
+        cache = ReportCache(root.joinpath("cache"), 0)
+        calls = []  # type: List[Path]
+        entry = cache.acquire(write_report(root, "a.hase"))
+        cache.unpack(entry, filler(calls))
+        # held entries are not evicted, even if the cache is too large
+        nose.tools.ok_(entry.complete)
+
+        entry.release()
+        cache.evict()
+        nose.tools.ok_(not entry.path.exists())
+        nose.tools.eq_(cache.entries(), [])
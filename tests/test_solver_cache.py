@@ -0,0 +1,44 @@
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import angr
+import claripy
+import nose
+
+from hase.symbex.solver_cache import SolverCache
+
+
+def state_with(constraint: str) -> angr.SimState:
+    state = angr.SimState(arch="AMD64")
+    x = claripy.BVS("x", 64)
+    state.solver.add(x > 5 if constraint == "gt" else x < 5)
+    state.solver.add(x < 7 if constraint == "gt" else x > 3)
+    state.regs.rax = x
+    return state
+
+
+def test_solver_cache() -> None:
+    with TemporaryDirectory() as tempdir:
+        path = Path(tempdir).joinpath("solver.sqlite")
+        cache = SolverCache(path=path)
+        state = state_with("gt")
+        nose.tools.eq_(cache.eval(state, state.regs.rax), 6)
+        nose.tools.ok_(cache.satisfiable(state))
+        nose.tools.eq_(cache.stats()["misses"], 2)
+
+        # a new variable with the same constraints, only the name differs
+        other = state_with("gt")
+        nose.tools.eq_(cache.eval(other, other.regs.rax), 6)
+        nose.tools.eq_(cache.stats()["hits"], 1)
+
+        different = state_with("lt")
+        nose.tools.eq_(cache.eval(different, different.regs.rax), 4)
+        nose.tools.eq_(cache.stats()["misses"], 3)
+        cache.close()
+
+        # results are reused by later replays
+        cache = SolverCache(path=path)
+        state = state_with("lt")
+        nose.tools.eq_(cache.eval(state, state.regs.rax), 4)
+        nose.tools.eq_(cache.stats(), dict(hits=1, misses=0, size=1))
+        cache.close()
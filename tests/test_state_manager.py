@@ -0,0 +1,117 @@
+from typing import Any, Tuple
+
+import nose
+
+from hase.pt import Instruction, InstructionClass
+from hase.symbex.state import State, StateManager, checkpoint_indices
+
+
+class FakeTracer:
+    """
+    Simulation states are the number of executed instructions
+    """
+
+    def __init__(self, length: int) -> None:
+        self.trace = [
+            Instruction(i, 1, InstructionClass.ptic_other) for i in range(length)
+        ]
+        self.executed = 0
+
+    def execute(
+        self, state: Any, previous: Instruction, instruction: Instruction, index: int
+    ) -> Tuple[Any, Any]:
+        self.executed += 1
+        return state, state + 1
+
+
+def manager(
+    length: int, interval: int, **kwargs: Any
+) -> Tuple[FakeTracer, StateManager]:
+    tracer = FakeTracer(length)
+    states = StateManager(tracer, length, **kwargs)
+    for i in range(0, length, interval):
+        states.add_major(State(i, None, tracer.trace[i], None, i))
+    return tracer, states
+
+
+def test_recompute() -> None:
+    tracer, states = manager(1000, 100)
+    state, is_new = states[150]
+    nose.tools.ok_(is_new)
+    nose.tools.eq_(state.simstate, 150)
+    nose.tools.eq_(tracer.executed, 50)
+    # states just before the requested one are kept as well
+    nose.tools.eq_(states[149], (states.index_to_state[149], False))
+    nose.tools.eq_(tracer.executed, 50)
+
+
+def test_eviction() -> None:
+    tracer, states = manager(1000, 100, max_recomputed=20)
+    states[150]
+    states[250]
+    nose.tools.eq_(len(states.recomputed), 20)
+    # the least recently used states were dropped, the requested ones are kept
+    nose.tools.ok_(states.index_to_state[137] is None)
+    nose.tools.eq_(states[150][1], False)
+    nose.tools.eq_(states[250][1], False)
+    nose.tools.eq_(sorted(states.memory_usage().keys()), states.checkpoints)
+
+
+def test_promote() -> None:
+    tracer, states = manager(1000, 100, max_recomputed=1)
+    states[180]
+    nose.tools.eq_(states.checkpoints, list(range(0, 1000, 100)))
+    states[170]
+    # the segment was recomputed twice, 170 becomes a checkpoint
+    nose.tools.ok_(170 in states.checkpoints)
+    executed = tracer.executed
+    states[180]
+    nose.tools.eq_(tracer.executed - executed, 10)
+
+
+def test_prefetch() -> None:
+    tracer, states = manager(1000, 100)
+    states.prefetch(150, radius=4)
+    assert states.prefetcher is not None
+    nose.tools.ok_(states.prefetcher.wait(timeout=10))
+    # neighbours and the midpoints of the adjacent segments
+    for index in [146, 147, 154, 50, 150, 250]:
+        nose.tools.ok_(states.index_to_state[index] is not None)
+    executed = tracer.executed
+    nose.tools.eq_(states[154][1], False)
+    nose.tools.eq_(tracer.executed, executed)
+    states.stop_prefetch()
+
+
+def test_prefetch_cancel() -> None:
+    tracer, states = manager(1000, 100)
+    nose.tools.eq_(states.materialize(150, lambda: True), None)
+    nose.tools.eq_(tracer.executed, 0)
+    states.prefetch(150)
+    assert states.prefetcher is not None
+    states.prefetcher.cancel()
+    nose.tools.eq_(states.prefetcher.jobs, [])
+    states.stop_prefetch()
+    nose.tools.ok_(states.prefetcher is None)
+
+
+def test_checkpoint_indices() -> None:
+    nose.tools.eq_(checkpoint_indices(1000, 10, 1.0), list(range(0, 1000, 100)))
+    indices = checkpoint_indices(1000, 10, 3.0)
+    nose.tools.eq_(len(indices), 10)
+    gaps = [b - a for a, b in zip(indices, indices[1:])]
+    # denser before the crash
+    nose.tools.eq_(gaps, sorted(gaps, reverse=True))
+    nose.tools.ok_(gaps[0] > 2 * gaps[-1])
+
+
+def test_max_latency() -> None:
+    tracer, states = manager(1000, 100, max_latency=0.5)
+    # 10ms per instruction
+    states.record_cost(0, 100, 1.0)
+    nose.tools.assert_almost_equal(states.recompute_cost(100, 190), 0.9)
+    states[190]
+    # the segment got a checkpoint after 0.5s
+    nose.tools.ok_(150 in states.checkpoints)
+    nose.tools.eq_(states.source(170), 150)
+    nose.tools.eq_(states.source(180), 179)